@@ -0,0 +1,388 @@
+"""Append-only audit log of DOV verification results.
+
+Records are JSON lines in numbered segment files under audit/. The active
+(highest, unsealed) segment takes appends until it reaches SEGMENT_BYTES or
+SEGMENT_MAX_AGE, then it is sealed and a new one is started. The audit_index
+table maps each line to its id_number, segment and byte offset, so an ID's
+history is read with one indexed query and a seek per record.
+
+Deleting an ID marks its index rows deleted and appends a tombstone line (keyed
+by a hash of the ID, not the ID itself); nothing is rewritten at delete time.
+An old dov_audit_log.txt is moved into segments the first time a process
+reads or deletes from the audit log (--import-legacy does it up front).
+Sealed segments whose dead bytes pass COMPACT_RATIO are rewritten without
+them in the background, so deleted records are physically gone soon after.
+
+    python audit_log.py --history 8001015009087
+    python audit_log.py --compact [--ratio 0]
+    python audit_log.py --import-legacy      # move dov_audit_log.txt into segments
+    python audit_log.py --stats
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Tuple
+
+import db_access
+
+logger = logging.getLogger(__name__)
+
+AUDIT_DIR = os.path.join(db_access.DATA_DIR, "audit")
+SEGMENT_BYTES = int(os.getenv("DOVS_AUDIT_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+# Seal the active segment after this long even if small, so deletes in it get compacted
+SEGMENT_MAX_AGE = float(os.getenv("DOVS_AUDIT_SEGMENT_MAX_AGE", str(7 * 86400)))
+# Compact a sealed segment once this fraction of it is deleted or unindexed
+COMPACT_RATIO = float(os.getenv("DOVS_AUDIT_COMPACT_RATIO", "0.25"))
+LEGACY_MARKER = "--- Verification Session ---"
+# meta keys: bytes of dov_audit_log.txt imported so far, and set once all of it is
+LEGACY_OFFSET = "legacy_audit_offset"
+LEGACY_IMPORTED = "legacy_audit_imported"
+
+_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audit-compaction")
+_compact_queued = threading.Event()
+_compact_lock = threading.Lock()
+_legacy_checked = False
+_legacy_lock = threading.Lock()
+
+
+def id_hash(id_number: str) -> str:
+    return hashlib.sha256(id_number.strip().encode("utf-8")).hexdigest()
+
+
+def _abs(rel: str) -> str:
+    return os.path.join(db_access.DATA_DIR, rel)
+
+
+# ---------------- writing ---------------- #
+
+def _new_segment(conn, number: int) -> Dict[str, Any]:
+    rel = f"audit/segment-{number:06d}.jsonl"
+    os.makedirs(AUDIT_DIR, exist_ok=True)
+    now = time.time()
+    conn.execute("INSERT INTO audit_segments (segment, path, bytes, created_at) VALUES (?, ?, 0, ?)",
+                 (number, rel, now))
+    return {"segment": number, "path": rel, "bytes": 0, "created_at": now}
+
+
+def _active_segment(conn, incoming: int) -> Dict[str, Any]:
+    seg = conn.execute("""
+        SELECT segment, path, bytes, created_at FROM audit_segments
+        WHERE sealed_at IS NULL ORDER BY segment DESC LIMIT 1
+    """).fetchone()
+    if seg is None:
+        last = conn.execute("SELECT MAX(segment) AS n FROM audit_segments").fetchone()["n"] or 0
+        return _new_segment(conn, last + 1)
+    if seg["bytes"] and (seg["bytes"] + incoming > SEGMENT_BYTES or time.time() - seg["created_at"] > SEGMENT_MAX_AGE):
+        conn.execute("UPDATE audit_segments SET sealed_at = ? WHERE segment = ?", (time.time(), seg["segment"]))
+        return _new_segment(conn, seg["segment"] + 1)
+    return seg
+
+
+def _encode(record: Dict[str, Any]) -> bytes:
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def _append(conn, entries: List[tuple]) -> None:
+    """Write (line, id_number, kind) entries to the active segment and index them.
+
+    Must run inside db_access.transaction(): BEGIN IMMEDIATE is what serialises
+    appends across processes. Offsets come from the file's real end, so lines
+    left behind by a rolled-back transaction are simply never indexed.
+    """
+    seg = _active_segment(conn, sum(len(e[0]) for e in entries))
+    with open(_abs(seg["path"]), "ab") as f:
+        offset = f.seek(0, os.SEEK_END)
+        rows = []
+        for line, id_number, kind in entries:
+            rows.append((seg["segment"], offset, len(line), id_number, kind))
+            offset += len(line)
+        f.write(b"".join(e[0] for e in entries))
+    conn.executemany("INSERT INTO audit_index (segment, offset, length, id_number, kind) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.execute("UPDATE audit_segments SET bytes = ? WHERE segment = ?", (offset, seg["segment"]))
+
+
+def append_many(records: Iterable[Dict[str, Any]]) -> int:
+    """Append records in one transaction; each is keyed on its "id_number"."""
+    entries = [(_encode(r), (r.get("id_number") or "").strip() or None, "record") for r in records]
+    if entries:
+        with db_access.transaction() as conn:
+            _append(conn, entries)
+    return len(entries)
+
+
+def append(record: Dict[str, Any]) -> None:
+    append_many([record])
+
+
+def tombstone(id_number: str) -> int:
+    """Mark every record for id_number deleted; returns how many. O(records for that ID)."""
+    id_number = (id_number or "").strip()
+    if not id_number:
+        return 0
+    ensure_legacy_imported()
+    with db_access.transaction() as conn:
+        n = conn.execute("UPDATE audit_index SET deleted = 1 WHERE id_number = ? AND kind = 'record' AND deleted = 0",
+                         (id_number,)).rowcount
+        if n:
+            stone = {"kind": "tombstone", "id_sha256": id_hash(id_number), "records": n,
+                     "timestamp": datetime.now().strftime(db_access.TIMESTAMP_FMT)}
+            _append(conn, [(_encode(stone), None, "tombstone")])
+    if n:
+        maybe_compact()
+    return n
+
+
+# ---------------- reading ---------------- #
+
+def history(id_number: str) -> List[Dict[str, Any]]:
+    """Live records for id_number, oldest first."""
+    ensure_legacy_imported()
+    for _ in range(3):
+        rows = db_access.get_conn().execute("""
+            SELECT s.path, i.offset, i.length FROM audit_index i JOIN audit_segments s USING (segment)
+            WHERE i.id_number = ? AND i.kind = 'record' AND i.deleted = 0
+            ORDER BY i.segment, i.offset
+        """, ((id_number or "").strip(),)).fetchall()
+        try:
+            return _read_lines(rows)
+        except FileNotFoundError:
+            # A compaction swapped the segment between the query and the read
+            continue
+    return _read_lines(rows)
+
+
+def _read_lines(rows) -> List[Dict[str, Any]]:
+    out, f, path = [], None, None
+    try:
+        for r in rows:
+            if r["path"] != path:
+                if f:
+                    f.close()
+                path = r["path"]
+                f = open(_abs(path), "rb")
+            f.seek(r["offset"])
+            out.append(json.loads(f.read(r["length"])))
+    finally:
+        if f:
+            f.close()
+    return out
+
+
+# ---------------- compaction ---------------- #
+
+def compact_segment(segment: int) -> int:
+    """Rewrite a sealed segment without its deleted and unindexed lines; returns bytes reclaimed."""
+    conn = db_access.get_conn()
+    seg = conn.execute("SELECT path, bytes FROM audit_segments WHERE segment = ? AND sealed_at IS NOT NULL",
+                       (segment,)).fetchone()
+    if seg is None:
+        return 0
+    live = conn.execute("SELECT offset, length FROM audit_index WHERE segment = ? AND deleted = 0 ORDER BY offset",
+                        (segment,)).fetchall()
+    new_rel = f"audit/segment-{segment:06d}.{secrets.token_hex(4)}.jsonl"
+    moved, new_offset = {}, 0
+    with open(_abs(seg["path"]), "rb") as src, open(_abs(new_rel), "wb") as dst:
+        for r in live:
+            src.seek(r["offset"])
+            dst.write(src.read(r["length"]))
+            moved[r["offset"]] = new_offset
+            new_offset += r["length"]
+        dst.flush()
+        os.fsync(dst.fileno())
+
+    with db_access.transaction() as tx:
+        current = tx.execute("SELECT path FROM audit_segments WHERE segment = ?", (segment,)).fetchone()
+        if current is None or current["path"] != seg["path"]:
+            # Another process compacted it first
+            os.remove(_abs(new_rel))
+            return 0
+        # Rows deleted while we copied stay flagged; their bytes go next time
+        rows = tx.execute("SELECT offset, length, id_number, kind, deleted FROM audit_index WHERE segment = ?",
+                          (segment,)).fetchall()
+        tx.execute("DELETE FROM audit_index WHERE segment = ?", (segment,))
+        tx.executemany("""
+            INSERT INTO audit_index (segment, offset, length, id_number, kind, deleted) VALUES (?, ?, ?, ?, ?, ?)
+        """, [(segment, moved[r["offset"]], r["length"], r["id_number"], r["kind"], r["deleted"])
+              for r in rows if r["offset"] in moved])
+        tx.execute("UPDATE audit_segments SET path = ?, bytes = ?, compacted_at = ? WHERE segment = ?",
+                   (new_rel, new_offset, time.time(), segment))
+    os.remove(_abs(seg["path"]))
+    return seg["bytes"] - new_offset
+
+
+def compactable(ratio: float = COMPACT_RATIO) -> List[int]:
+    """Sealed segments at least `ratio` garbage (and with some garbage at all)."""
+    rows = db_access.get_conn().execute("""
+        SELECT s.segment, s.bytes - COALESCE(SUM(CASE WHEN i.deleted = 0 THEN i.length END), 0) AS garbage, s.bytes
+        FROM audit_segments s LEFT JOIN audit_index i ON i.segment = s.segment
+        WHERE s.sealed_at IS NOT NULL
+        GROUP BY s.segment
+    """).fetchall()
+    return [r["segment"] for r in rows if r["garbage"] > 0 and r["garbage"] >= ratio * r["bytes"]]
+
+
+def compact(ratio: float = COMPACT_RATIO) -> Dict[str, int]:
+    counts = {"segments": 0, "bytes": 0}
+    with _compact_lock:
+        for segment in compactable(ratio):
+            counts["bytes"] += compact_segment(segment)
+            counts["segments"] += 1
+    return counts
+
+
+def _compact_in_background() -> None:
+    _compact_queued.clear()
+    try:
+        result = compact()
+        if result["segments"]:
+            logger.info("Compacted %d audit segments, reclaimed %d bytes", result["segments"], result["bytes"])
+    except Exception:
+        logger.exception("Audit log compaction failed")
+
+
+def maybe_compact() -> None:
+    """Queue a compaction pass on the background thread unless one is already queued."""
+    if not _compact_queued.is_set():
+        _compact_queued.set()
+        _pool.submit(_compact_in_background)
+
+
+def seal_active() -> None:
+    with db_access.transaction() as conn:
+        conn.execute("UPDATE audit_segments SET sealed_at = ? WHERE sealed_at IS NULL", (time.time(),))
+
+
+# ---------------- legacy text log ---------------- #
+
+def _legacy_record(block: str) -> Dict[str, Any]:
+    record = {"legacy": True, "text": block.strip()}
+    m = re.search(r"^\s*ID Number:\s*(\S+)", block, re.M)
+    if m:
+        record["id_number"] = m.group(1)
+    m = re.search(r"^\s*Timestamp:\s*(.+)$", block, re.M)
+    if m:
+        record["timestamp"] = m.group(1).strip()
+    return record
+
+
+def _legacy_chunk(path: str, offset: int, chunk: int) -> Tuple[List[Dict[str, Any]], int, bool]:
+    """Read up to chunk blocks from byte offset; returns (records, offset after them, whether the file ended)."""
+    records, block = [], []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for raw in iter(f.readline, b""):
+            line = raw.decode("utf-8").replace("\r\n", "\n")
+            if line.strip() == LEGACY_MARKER or line.strip() == "=" * 50:
+                if "".join(block).strip():
+                    records.append(_legacy_record("".join(block)))
+                block = []
+                if len(records) >= chunk:
+                    return records, f.tell(), False
+            else:
+                block.append(line)
+        if "".join(block).strip():
+            records.append(_legacy_record("".join(block)))
+        return records, f.tell(), True
+
+
+def _meta(conn, key: str):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else None
+
+
+def import_legacy(path: str = db_access.LOG_FILE, chunk: int = db_access.EXPORT_CHUNK) -> int:
+    """Move the blocks of the old text audit log into segments, then remove the text file.
+
+    Each chunk of blocks is committed with the byte offset it ended at
+    (LEGACY_OFFSET in meta), so the write lock is only held per chunk and an
+    interrupted import resumes where it stopped. LEGACY_IMPORTED is set with
+    the last chunk: a file that outlived a finished import is never imported
+    twice, and concurrent importers each take the next chunk.
+    """
+    if not os.path.exists(path):
+        return 0
+    n, done = 0, False
+    while not done:
+        with db_access.transaction() as conn:
+            if _meta(conn, LEGACY_IMPORTED) is not None:
+                break
+            records, offset, done = _legacy_chunk(path, _meta(conn, LEGACY_OFFSET) or 0, chunk)
+            if records:
+                _append(conn, [(_encode(r), (r.get("id_number") or "").strip() or None, "record") for r in records])
+                n += len(records)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (LEGACY_OFFSET, offset))
+            if done:
+                conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (LEGACY_IMPORTED, offset))
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    if n:
+        logger.info("Imported %d legacy audit blocks from %s", n, path)
+    return n
+
+
+def ensure_legacy_imported() -> None:
+    """Import the old text log the first time this process needs the audit log, so deletes never rewrite it."""
+    global _legacy_checked
+    if _legacy_checked:
+        return
+    with _legacy_lock:
+        if _legacy_checked:
+            return
+        try:
+            import_legacy()
+        except Exception:
+            # Leave the file for the next attempt; a broken legacy log must not fail a delete
+            logger.exception("Importing the legacy audit log failed")
+            return
+        _legacy_checked = True
+
+
+def stats() -> Dict[str, Any]:
+    conn = db_access.get_conn()
+    seg = conn.execute("""
+        SELECT COUNT(*) AS segments, COALESCE(SUM(bytes), 0) AS bytes,
+               SUM(sealed_at IS NULL) AS active FROM audit_segments
+    """).fetchone()
+    idx = conn.execute("""
+        SELECT SUM(kind = 'record' AND deleted = 0) AS live, SUM(deleted) AS deleted,
+               SUM(kind = 'tombstone') AS tombstones FROM audit_index
+    """).fetchone()
+    return {**seg, **{k: v or 0 for k, v in idx.items()}}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Segmented JSONL audit log maintenance")
+    parser.add_argument("--history", metavar="ID_NUMBER", help="print the live records for an ID number")
+    parser.add_argument("--compact", action="store_true", help="rewrite sealed segments without deleted records")
+    parser.add_argument("--ratio", type=float, default=COMPACT_RATIO, help="garbage fraction that triggers --compact")
+    parser.add_argument("--seal", action="store_true", help="seal the active segment (e.g. before --compact)")
+    parser.add_argument("--import-legacy", action="store_true", help="move dov_audit_log.txt into segments")
+    parser.add_argument("--stats", action="store_true")
+    args = parser.parse_args()
+
+    if args.history:
+        for rec in history(args.history):
+            print(json.dumps(rec, ensure_ascii=False))
+    elif args.import_legacy:
+        print(f"Imported {import_legacy()} legacy audit blocks.")
+    elif args.seal or args.compact:
+        if args.seal:
+            seal_active()
+        if args.compact:
+            result = compact(args.ratio)
+            print(f"Compacted {result['segments']} segments, reclaimed {result['bytes']} bytes.")
+    elif args.stats:
+        print(stats())
+    else:
+        parser.print_help()
@@ -0,0 +1,469 @@
+"""Benchmarks for db_access, the dashboard and the exports on synthetic datasets.
+
+    python benchmarks.py generate --rows 10k 100k 1m
+    python benchmarks.py run --rows 10k 100k --output bench_results.json
+    python benchmarks.py run --rows 10k --baseline bench_baseline.json
+    python benchmarks.py compare bench_baseline.json bench_results.json
+
+Each dataset lives in bench_data/<rows>/: a verifications database, a matching
+audit log and a photo store, built once and deterministically from --seed.
+Every case runs in a fresh subprocess with DOVS_DATA_DIR pointing at the
+dataset, so the peak RSS it reports is its own. Wall time is the median of
+--repeat runs after one warm-up run. Results are JSON. `compare` (or
+`run --baseline`) flags cases slower or larger than the baseline by more than
+--threshold and exits non-zero if any are.
+"""
+import io
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.getenv("DOVS_BENCH_DIR") or os.path.join(BASE_DIR, "bench_data")
+RESULT_MARKER = "BENCH_RESULT "
+DEFAULT_SIZES = ("10k", "100k", "1m")
+DEFAULT_SEED = 20240601
+PHOTO_POOL = 48
+INSERT_CHUNK = 10_000
+# Reserved ID numbers (prefix 99) that delete_by_id_number consumes, two rows each
+DELETE_VICTIMS = 200
+LOOKUPS_PER_RUN = 1000
+RECENT_EXPORT_ROWS = 5000
+# Slowdowns smaller than this are timer noise, whatever the ratio
+MIN_REGRESSION_S = 0.005
+
+FIRST_NAMES = ["Thabo", "Lerato", "Sipho", "Naledi", "Johan", "Anele", "Pieter", "Zanele", "Ayesha", "Kagiso",
+               "Mpho", "Susan", "Themba", "Priya", "Willem", "Nomvula", "David", "Palesa", "Riaan", "Busisiwe"]
+SURNAMES = ["Nkosi", "Dlamini", "van der Merwe", "Mokoena", "Botha", "Khumalo", "Naidoo", "Pillay", "Smith",
+            "Mahlangu", "Venter", "Ndlovu", "Coetzee", "Zulu", "Jacobs", "Mthembu"]
+STATUSES = (("Success", 0.80), ("Failed", 0.15), ("Pending", 0.05))
+
+
+def parse_size(value: str) -> int:
+    v = value.strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000}.get(v[-1:], 1)
+    return int(float(v.rstrip("km")) * scale)
+
+
+def size_label(rows: int) -> str:
+    if rows % 1_000_000 == 0:
+        return f"{rows // 1_000_000}m"
+    if rows % 1_000 == 0:
+        return f"{rows // 1_000}k"
+    return str(rows)
+
+
+def dataset_dir(rows: int) -> str:
+    return os.path.join(BENCH_DIR, size_label(rows))
+
+
+def _subprocess(args: List[str], rows: int, timeout: float | None = None) -> subprocess.CompletedProcess:
+    # The dataset directory is also the cwd, so anything a case writes relative to it stays there
+    env = dict(os.environ, DOVS_DATA_DIR=dataset_dir(rows))
+    env.pop("DOVS_DB_FILE", None)
+    # Time the queries and rendering, not response_cache hits after the warm-up run
+    env.setdefault("RESPONSE_CACHE_BYTES", "0")
+    env.setdefault("RESPONSE_CACHE_DISK_BYTES", "0")
+    return subprocess.run([sys.executable, os.path.abspath(__file__), *args], env=env, cwd=env["DOVS_DATA_DIR"],
+                          capture_output=True, text=True, timeout=timeout)
+
+
+def _maxrss_kb(who=resource.RUSAGE_SELF) -> int:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+# ---------------- dataset generation (runs inside the dataset's subprocess) ---------------- #
+
+def _synthetic_photo(rng: random.Random) -> bytes:
+    from PIL import Image, ImageFilter
+
+    img = Image.effect_noise((360, 480), 60).filter(ImageFilter.GaussianBlur(1.5)).convert("RGB")
+    tint = Image.new("RGB", img.size, (rng.randint(90, 220), rng.randint(70, 200), rng.randint(60, 180)))
+    out = io.BytesIO()
+    Image.blend(img, tint, 0.5).save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+
+def _id_number(rng: random.Random) -> str:
+    # YYMMDD + 7 digits; YY stays below 99 so the reserved delete victims never collide
+    return f"{rng.randint(60, 98):02d}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}{rng.randint(0, 9_999_999):07d}"
+
+
+def _generate(rows: int, seed: int, anchor: str) -> Dict[str, Any]:
+    import audit_log
+    import db_access
+    import photo_store
+
+    rng = random.Random(seed + rows)
+    end = datetime.strptime(anchor, "%Y-%m-%d") + timedelta(days=1)
+    span = int(timedelta(days=3 * 365).total_seconds())
+
+    pool = []
+    for i in range(PHOTO_POOL):
+        tmp = photo_store.incoming_path(f"bench_{i}.jpg")
+        os.makedirs(os.path.dirname(tmp), exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(_synthetic_photo(rng))
+        pool.append(photo_store.store_file(tmp))
+
+    people = max(1, int(rows * 0.7))
+    person_ids = [_id_number(rng) for _ in range(people)]
+    victims = [f"99{n:011d}" for n in range(DELETE_VICTIMS)]
+    statuses, weights = zip(*STATUSES)
+
+    def people_rows():
+        for n in range(rows):
+            if n < 2 * DELETE_VICTIMS and rows > 4 * DELETE_VICTIMS:
+                id_number = victims[n // 2]
+            else:
+                id_number = person_ids[rng.randrange(people)]
+            p = random.Random(id_number)
+            first, surname = p.choice(FIRST_NAMES), p.choice(SURNAMES)
+            ts = end - timedelta(seconds=rng.randrange(span))
+            status = rng.choices(statuses, weights)[0]
+            has_photos = rng.random() > 0.05
+            yield (
+                ts.strftime(db_access.TIMESTAMP_FMT), db_access.to_epoch(ts), f"C{100000 + n}", status,
+                f"Verification for {first} {surname} - {status}", f"{first} {surname}", id_number, id_number,
+                f"{first.lower()}.{surname.lower().replace(' ', '')}@example.invalid",
+                rng.choice(pool) if has_photos else None, rng.choice(pool) if has_photos else None,
+            )
+
+    chunk = []
+
+    def flush():
+        with db_access.transaction() as conn:
+            conn.executemany("""
+                INSERT INTO verifications (timestamp, ts_epoch, client_id, status, details, name, id_number,
+                                           id_number_norm, email, id_photo, selfie_photo)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, chunk)
+            # Same record shape as xds_main.log_verification_result
+            audit_log.append_many({
+                "timestamp": r[0], "client_id": r[2], "enquiry_id": r[2], "enquiry_result_id": None, "status": r[3], "id_number": r[6],
+                "summary": {"Name": r[5], "ID Number": r[6], "Email": r[8]},
+            } for r in chunk)
+        chunk.clear()
+
+    for row in people_rows():
+        chunk.append(row)
+        if len(chunk) >= INSERT_CHUNK:
+            flush()
+    if chunk:
+        flush()
+
+    manifest = {"rows": rows, "seed": seed, "anchor": anchor, "photos": len(pool),
+                "generated_at": datetime.now().isoformat(timespec="seconds")}
+    with open(os.path.join(db_access.DATA_DIR, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def generate(rows: int, seed: int = DEFAULT_SEED, anchor: str | None = None, force: bool = False) -> Dict[str, Any]:
+    """Build the dataset for `rows` unless it already exists; returns its manifest."""
+    path = dataset_dir(rows)
+    manifest_file = os.path.join(path, "manifest.json")
+    if os.path.exists(manifest_file) and not force:
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    if os.path.exists(path):
+        import shutil
+        shutil.rmtree(path)
+    os.makedirs(path)
+    anchor = anchor or datetime.now().strftime("%Y-%m-%d")
+    proc = _subprocess(["_generate", str(rows), str(seed), anchor], rows)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Generating {size_label(rows)} failed:\n{proc.stderr[-2000:]}")
+    with open(manifest_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ---------------- cases (run inside the dataset's subprocess) ---------------- #
+
+class _Context:
+    """Imports the app against the dataset and derives realistic parameters from its data."""
+
+    def __init__(self):
+        import dashboard_app
+        import db_access
+
+        self.db = db_access
+        self.client = dashboard_app.app.test_client()
+        conn = db_access.get_conn()
+        newest = conn.execute("SELECT MAX(ts_epoch) AS t FROM verifications").fetchone()["t"] or 0
+        newest_dt = datetime.utcfromtimestamp(newest)
+        sample = conn.execute("""
+            SELECT id_number_norm, name FROM verifications WHERE id_number_norm NOT LIKE '99%'
+            ORDER BY ts_epoch DESC LIMIT 1
+        """).fetchone() or {"id_number_norm": "", "name": ""}
+        recent = conn.execute("SELECT ts_epoch FROM verifications ORDER BY ts_epoch DESC LIMIT 1 OFFSET ?",
+                              (RECENT_EXPORT_ROWS - 1,)).fetchone()
+        _, cursor = db_access.query_verifications({})
+        self.params = {
+            "id_number": sample["id_number_norm"],
+            "name": (sample["name"] or "").split(" ")[0],
+            "full_name": sample["name"] or "",
+            "id_prefix": sample["id_number_norm"][:6],
+            "year": newest_dt.year,
+            "month": newest_dt.month,
+            "date_from": (newest_dt - timedelta(days=30)).strftime("%Y-%m-%d"),
+            "date_to": newest_dt.strftime("%Y-%m-%d"),
+            "recent_from": datetime.utcfromtimestamp(recent["ts_epoch"]).strftime("%Y-%m-%d") if recent else "",
+            "cursor": cursor or "",
+        }
+        ids = [r["id_number_norm"] for r in conn.execute(
+            "SELECT id_number_norm FROM verifications WHERE id_number_norm NOT LIKE '99%' LIMIT ?",
+            (LOOKUPS_PER_RUN // 2,)).fetchall()]
+        self.lookup_ids = ids + [f"0{n:012d}" for n in range(LOOKUPS_PER_RUN - len(ids))]
+
+    def get(self, url: str) -> Callable[[], None]:
+        url = url.format(**self.params)
+
+        def run():
+            resp = self.client.get(url, buffered=False)
+            try:
+                if resp.status_code != 200:
+                    raise RuntimeError(f"GET {url} returned {resp.status_code}")
+                for _ in resp.iter_encoded():
+                    pass
+            finally:
+                resp.close()
+        return run
+
+
+DASHBOARD_CASES = {
+    "dashboard_default": "",
+    "dashboard_status": "?status=Success",
+    "dashboard_name": "?name={name}",
+    "dashboard_id_number": "?id_number={id_number}",
+    "dashboard_month": "?year={year}&month={month}",
+    "dashboard_date_range": "?date_from={date_from}&date_to={date_to}",
+    "dashboard_combined": "?status=Failed&name={name}&year={year}",
+    "dashboard_page2": "?cursor={cursor}",
+}
+SEARCH_CASES = {
+    "search_name_prefix": "/api/search?q={name}",
+    "search_full_name": "/api/search?q={full_name}",
+    "search_id_prefix": "/api/search?q={id_prefix}",
+}
+EXPORT_CASES = {
+    "export_csv": "/export/csv",
+    "export_ndjson": "/export/ndjson",
+    "export_xlsx_link": "/export/xlsx?images=link",
+    # Embedded photos and the PDF are bounded to the newest RECENT_EXPORT_ROWS rows
+    "export_xlsx_embed": "/export/xlsx?date_from={recent_from}",
+    "export_pdf": "/export/pdf?date_from={recent_from}",
+}
+
+
+def _case_fetch_all(ctx: _Context):
+    return lambda: ctx.db.fetch_all_verifications()
+
+
+def _case_delete(ctx: _Context):
+    def run():
+        victim = ctx.db.get_conn().execute(
+            "SELECT id_number_norm FROM verifications WHERE id_number_norm LIKE '99%' LIMIT 1").fetchone()
+        if victim is None:
+            raise RuntimeError("No delete victims left; regenerate the dataset with --force")
+        ctx.db.delete_by_id_number(victim["id_number_norm"])
+    return run
+
+
+def _case_verified_within(ctx: _Context):
+    import xds_main
+
+    def run():
+        for id_number in ctx.lookup_ids:
+            xds_main.verified_within_last_3_months(id_number)
+    return run
+
+
+def _build_cases() -> Dict[str, Callable[[_Context], Callable[[], None]]]:
+    cases = {"fetch_all_verifications": _case_fetch_all}
+    for name, query in DASHBOARD_CASES.items():
+        cases[name] = lambda ctx, q=query: ctx.get("/admin/dashboard" + q)
+    for name, url in {**SEARCH_CASES, **EXPORT_CASES}.items():
+        cases[name] = lambda ctx, u=url: ctx.get(u)
+    cases["delete_by_id_number"] = _case_delete
+    cases["verified_within_last_3_months"] = _case_verified_within
+    return cases
+
+
+CASES = _build_cases()
+# Cases whose timed unit is a batch of calls rather than one
+CASE_OPS = {"verified_within_last_3_months": LOOKUPS_PER_RUN}
+
+
+def _run_case(name: str, repeat: int) -> Dict[str, Any]:
+    # Silence the [DEBUG] prints so stdout carries only the result line
+    real_stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        ctx = _Context()
+        fn = CASES[name](ctx)
+        rss_before = _maxrss_kb()
+        fn()
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - started)
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+    ops = CASE_OPS.get(name, 1)
+    return {
+        "wall_s": round(statistics.median(times), 6),
+        "min_s": round(min(times), 6),
+        "max_s": round(max(times), 6),
+        "runs": repeat,
+        "ops_per_run": ops,
+        "per_op_us": round(statistics.median(times) / ops * 1e6, 2),
+        "rss_before_kb": rss_before,
+        "peak_rss_kb": _maxrss_kb(),
+        "children_peak_rss_kb": _maxrss_kb(resource.RUSAGE_CHILDREN),
+    }
+
+
+# ---------------- orchestration ---------------- #
+
+def run(sizes: List[int], case_names: List[str], repeat: int, timeout: float, seed: int) -> Dict[str, Any]:
+    import sqlite3
+
+    results: Dict[str, Any] = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": repeat,
+        },
+        "results": {},
+    }
+    for rows in sizes:
+        manifest = generate(rows, seed)
+        label = size_label(rows)
+        results["meta"].setdefault("datasets", {})[label] = manifest
+        results["results"][label] = {}
+        for name in case_names:
+            print(f"[{label}] {name} ...", end=" ", flush=True)
+            try:
+                proc = _subprocess(["_case", name, str(repeat)], rows, timeout)
+                lines = [ln for ln in proc.stdout.splitlines() if ln.startswith(RESULT_MARKER)]
+                if proc.returncode != 0 or not lines:
+                    outcome = {"error": (proc.stderr.strip().splitlines() or ["no result"])[-1]}
+                else:
+                    outcome = json.loads(lines[-1][len(RESULT_MARKER):])
+            except subprocess.TimeoutExpired:
+                outcome = {"error": f"timeout after {timeout:.0f}s"}
+            results["results"][label][name] = outcome
+            print(outcome.get("error") or f"{outcome['wall_s']:.3f}s, peak {outcome['peak_rss_kb'] // 1024} MiB")
+    return results
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """Print a baseline/current table and return the regressions beyond `threshold` (a ratio, e.g. 1.25)."""
+    regressions = []
+    print(f"{'dataset':<8}{'case':<32}{'base s':>10}{'now s':>10}{'ratio':>8}{'base MiB':>10}{'now MiB':>10}")
+    for label, cases in current.get("results", {}).items():
+        for name, now in cases.items():
+            base = baseline.get("results", {}).get(label, {}).get(name)
+            if not base or "error" in base or "error" in now:
+                continue
+            ratio = now["wall_s"] / base["wall_s"] if base["wall_s"] else 1.0
+            rss_ratio = now["peak_rss_kb"] / base["peak_rss_kb"] if base["peak_rss_kb"] else 1.0
+            flag = ""
+            if ratio > threshold and now["wall_s"] - base["wall_s"] > MIN_REGRESSION_S:
+                flag += " SLOWER"
+            if rss_ratio > threshold:
+                flag += " BIGGER"
+            if flag:
+                regressions.append(f"{label}/{name}:{flag}")
+            print(f"{label:<8}{name:<32}{base['wall_s']:>10.3f}{now['wall_s']:>10.3f}{ratio:>8.2f}"
+                  f"{base['peak_rss_kb'] / 1024:>10.1f}{now['peak_rss_kb'] / 1024:>10.1f}{flag}")
+    for r in regressions:
+        print(f"REGRESSION {r}")
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+    import fnmatch
+
+    parser = argparse.ArgumentParser(description="Benchmark db_access, dashboard and export hot paths")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="build synthetic datasets")
+    gen.add_argument("--rows", nargs="+", default=list(DEFAULT_SIZES), help="sizes such as 10k 100k 1m")
+    gen.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    gen.add_argument("--anchor", help="date of the newest verification (YYYY-MM-DD, default today)")
+    gen.add_argument("--force", action="store_true", help="rebuild datasets that already exist")
+
+    run_p = sub.add_parser("run", help="run benchmark cases")
+    run_p.add_argument("--rows", nargs="+", default=list(DEFAULT_SIZES))
+    run_p.add_argument("--cases", nargs="+", default=["*"], help="case names or glob patterns")
+    run_p.add_argument("--repeat", type=int, default=3)
+    run_p.add_argument("--timeout", type=float, default=1800, help="seconds per case")
+    run_p.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    run_p.add_argument("--output", default="bench_results.json")
+    run_p.add_argument("--baseline", help="compare against this results file")
+    run_p.add_argument("--threshold", type=float, default=1.25, help="regression ratio for --baseline")
+
+    cmp_p = sub.add_parser("compare", help="compare two results files")
+    cmp_p.add_argument("baseline")
+    cmp_p.add_argument("current")
+    cmp_p.add_argument("--threshold", type=float, default=1.25)
+
+    sub.add_parser("list", help="list case names")
+
+    # Internal entry points, run with DOVS_DATA_DIR set to the dataset
+    gen_i = sub.add_parser("_generate")
+    gen_i.add_argument("rows", type=int)
+    gen_i.add_argument("seed", type=int)
+    gen_i.add_argument("anchor")
+    case_i = sub.add_parser("_case")
+    case_i.add_argument("name")
+    case_i.add_argument("repeat", type=int)
+
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        for size in args.rows:
+            started = time.perf_counter()
+            manifest = generate(parse_size(size), args.seed, args.anchor, args.force)
+            print(f"{size_label(manifest['rows'])}: ready in {dataset_dir(manifest['rows'])} "
+                  f"({time.perf_counter() - started:.1f}s)")
+    elif args.command == "run":
+        names = [n for n in CASES if any(fnmatch.fnmatch(n, pat) for pat in args.cases)]
+        results = run([parse_size(s) for s in args.rows], names, args.repeat, args.timeout, args.seed)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+        if args.baseline:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                regressed = compare(json.load(f), results, args.threshold)
+            sys.exit(1 if regressed else 0)
+    elif args.command == "compare":
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.current, "r", encoding="utf-8") as f:
+            cur = json.load(f)
+        regressed = compare(base, cur, args.threshold)
+        sys.exit(1 if regressed else 0)
+    elif args.command == "list":
+        print("\n".join(CASES))
+    elif args.command == "_generate":
+        _generate(args.rows, args.seed, args.anchor)
+    elif args.command == "_case":
+        print(RESULT_MARKER + json.dumps(_run_case(args.name, args.repeat)))
@@ -0,0 +1,243 @@
+"""Resumable bulk verification driven by a JSONL or CSV file.
+
+Each input line names one client to verify:
+
+    {"id_number": "9104036161082", "cell_number": "0732563864", "reference": "batch-7"}   (JSONL)
+    id_number,cell_number,reference                                                       (CSV, with header)
+
+The lines are checkpointed into bulk_items under a run id derived from the
+file's contents, so running the same file again resumes where the previous
+run stopped. Clients verified in the last 3 months are skipped; the rest go
+through a pool of async workers (match -> DOV request -> queued in
+dov_pending) and, unless --no-poll is given, the runner then polls until every
+queued enquiry has a result stored or has expired. Throughput and per-stage
+latency are printed at the end.
+
+    python bulk_verify.py clients.jsonl --workers 20
+"""
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List
+
+import db_access
+import xds_main
+from dov_poller import DovPoller
+from xds_async import AsyncXDSClient
+
+logger = logging.getLogger(__name__)
+
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", "20"))
+# Items still to be worked, by checkpoint state
+ACTIVE_STATES = ("new", "matched", "requested")
+# How often the poll phase re-checks whether the run's enquiries are all settled
+SETTLE_CHECK_INTERVAL = 5.0
+
+_FIELD_ALIASES = {
+    "idnumber": "id_number", "idno": "id_number", "id": "id_number",
+    "cellnumber": "cell_number", "cellno": "cell_number", "cell": "cell_number", "mobile": "cell_number",
+    "reference": "reference", "yourreference": "reference", "ref": "reference",
+}
+
+
+def _normalize_record(raw: Dict[str, Any], line_no: int) -> Dict[str, Any]:
+    item = {"line_no": line_no}
+    for key, value in raw.items():
+        field = _FIELD_ALIASES.get("".join(ch for ch in str(key).lower() if ch.isalnum()))
+        if field and value is not None:
+            item[field] = str(value).strip()
+    return item
+
+
+def read_input(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield {"line_no", "id_number", "cell_number", "reference"} per record, JSONL or CSV by extension."""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith((".jsonl", ".ndjson", ".json")):
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    yield _normalize_record(json.loads(line), line_no)
+        else:
+            for line_no, row in enumerate(csv.DictReader(f), 2):
+                yield _normalize_record(row, line_no)
+
+
+def run_id_for(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class BulkRunner:
+    def __init__(self, run_id: str, client: AsyncXDSClient, workers: int = BULK_WORKERS, priority: int = 0):
+        self.run_id = run_id
+        self.client = client
+        self.workers = workers
+        self.priority = priority
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.processed = 0
+        self.errors = 0
+        self._seen_ids = set()
+
+    def _timed(self, stage: str, started: float) -> None:
+        self.latencies[stage].append(time.perf_counter() - started)
+
+    async def _checkpoint(self, item: Dict[str, Any], **fields) -> None:
+        await asyncio.to_thread(db_access.update_bulk_item, self.run_id, item["line_no"], **fields)
+        item.update(fields)
+
+    async def _process(self, item: Dict[str, Any]) -> None:
+        id_number = item.get("id_number") or ""
+        if item["state"] == "new":
+            if not id_number or not item.get("cell_number"):
+                await self._checkpoint(item, state="failed", error="missing id_number or cell_number")
+                return
+            if id_number in self._seen_ids:
+                await self._checkpoint(item, state="duplicate")
+                return
+            self._seen_ids.add(id_number)
+            started = time.perf_counter()
+            recent = await asyncio.to_thread(xds_main.verified_within_last_3_months, id_number)
+            self._timed("prefilter", started)
+            if recent:
+                await self._checkpoint(item, state="skipped")
+                return
+
+            started = time.perf_counter()
+            match = await self.client.call(self.client.match_consumer, id_number, item["cell_number"],
+                                           item.get("reference") or "")
+            self._timed("match", started)
+            if not (match.get("enquiry_id") and match.get("enquiry_result_id")):
+                await self._checkpoint(item, state="failed", error=match.get("error") or "no enquiry IDs returned")
+                return
+            await self._checkpoint(item, state="matched", enquiry_id=match["enquiry_id"],
+                                   enquiry_result_id=match["enquiry_result_id"])
+
+        if item["state"] == "matched":
+            started = time.perf_counter()
+            link = await self.client.call(self.client.request_facial_verification, item["enquiry_id"],
+                                          item["enquiry_result_id"], redirect_url="")
+            self._timed("dov_request", started)
+            if not link:
+                await self._checkpoint(item, state="failed", error="DOV request returned no result")
+                return
+            await self._checkpoint(item, state="requested")
+
+        if item["state"] == "requested":
+            def queue():
+                with db_access.transaction():
+                    db_access.enqueue_dov_poll(item["enquiry_id"], item["enquiry_result_id"], id_number,
+                                               priority=self.priority)
+                    db_access.update_bulk_item(self.run_id, item["line_no"], state="queued")
+            await asyncio.to_thread(queue)
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            try:
+                await self._process(item)
+                self.processed += 1
+            except Exception as e:
+                # Left in its current state so the next run retries it
+                self.errors += 1
+                logger.warning("Line %s (%s) failed at %s: %s", item["line_no"], item.get("id_number"), item["state"], e)
+                await asyncio.to_thread(db_access.update_bulk_item, self.run_id, item["line_no"], error=str(e)[:500])
+
+    async def submit_all(self) -> None:
+        """Feed every unfinished item through the worker pool, reading checkpoints a chunk at a time."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+        tasks = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+        after = 0
+        while True:
+            chunk = await asyncio.to_thread(db_access.bulk_items, self.run_id, ACTIVE_STATES, after)
+            if not chunk:
+                break
+            for item in chunk:
+                await queue.put(item)
+            after = chunk[-1]["line_no"]
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+
+    async def wait_for_results(self) -> None:
+        """Poll dov_pending until none of this run's enquiries is still pending."""
+        poller = DovPoller(self.client)
+        stop = asyncio.Event()
+
+        async def watch():
+            while (await asyncio.to_thread(db_access.bulk_run_counts, self.run_id)).get("pending"):
+                await asyncio.sleep(SETTLE_CHECK_INTERVAL)
+            stop.set()
+
+        await asyncio.gather(poller.run(stop), watch())
+
+    def report(self, elapsed: float) -> str:
+        counts = db_access.bulk_run_counts(self.run_id)
+        lines = [
+            f"Run {self.run_id}: {sum(counts.values())} items in {elapsed:.1f}s",
+            "  " + ", ".join(f"{state}={n}" for state, n in sorted(counts.items())),
+            f"  worked {self.processed} items ({self.processed / elapsed if elapsed else 0:.2f}/s), {self.errors} errors",
+        ]
+        stages = dict(self.latencies)
+        waits = db_access.bulk_poll_waits(self.run_id)
+        if waits:
+            stages["result_wait"] = waits
+        for stage, values in stages.items():
+            values = sorted(values)
+            lines.append(f"  {stage:<12} n={len(values):<6} p50={_percentile(values, 0.5):.3f}s "
+                         f"p95={_percentile(values, 0.95):.3f}s max={values[-1]:.3f}s")
+        return "\n".join(lines)
+
+
+async def run(path: str, workers: int = BULK_WORKERS, poll: bool = True, priority: int = 0,
+              url: str | None = None) -> BulkRunner:
+    run_id = run_id_for(path)
+    existing = await asyncio.to_thread(db_access.get_bulk_run, run_id)
+    if existing and existing["loaded"]:
+        logger.info("Resuming run %s for %s", run_id, path)
+    else:
+        total = await asyncio.to_thread(db_access.load_bulk_run, run_id, os.path.abspath(path), read_input(path))
+        logger.info("Loaded %d items from %s as run %s", total, path, run_id)
+
+    async with AsyncXDSClient(url=url, concurrency=workers) as client:
+        runner = BulkRunner(run_id, client, workers, priority)
+        await runner.submit_all()
+        if poll:
+            await runner.wait_for_results()
+    if poll and runner.errors == 0:
+        await asyncio.to_thread(db_access.finish_bulk_run, run_id)
+    return runner
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Verify every client in a JSONL/CSV file, resumably")
+    parser.add_argument("input", help="JSONL or CSV file of id_number, cell_number[, reference]")
+    parser.add_argument("--workers", type=int, default=BULK_WORKERS, help="concurrent XDS requests")
+    parser.add_argument("--no-poll", action="store_true", help="stop once requests are queued; dov_poller collects results")
+    parser.add_argument("--priority", type=int, default=0, help="dov_pending priority for this run's enquiries")
+    parser.add_argument("--url", help="XDS endpoint (defaults to XDS_URL)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    try:
+        runner = asyncio.run(run(args.input, args.workers, not args.no_poll, args.priority, args.url))
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume.")
+    else:
+        print(runner.report(time.perf_counter() - started))
@@ -1,18 +1,24 @@
-from flask import Flask, render_template, jsonify, request, send_from_directory, Response
-from flask import redirect, url_for
+from flask import Flask, render_template, jsonify, request, send_file, send_from_directory, Response
+from flask import redirect, url_for, stream_with_context
 import os
 from datetime import datetime
-import csv
-import io
+import audit_log
 import db_access
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas as rl_canvas
-import xlsxwriter
+import export_jobs
+import exports
+import http_cache
+import live_feed
+import metrics
+import photos
+import response_cache
 
 app = Flask(__name__)
+app.jinja_env.globals["photo_url"] = photos.photo_url
+http_cache.init_app(app)
+metrics.init_app(app)
 
-DB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "verifications.db")
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
+DB_FILE = db_access.DB_FILE
+UPLOAD_FOLDER = os.path.join(db_access.DATA_DIR, "uploads")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # ---------------- CUSTOM URLS ---------------- #
@@ -26,33 +32,34 @@ def healthz():
 @app.route("/readyz")
 def readyz():
     try:
-        # Touch the DB to confirm connectivity
-        _ = db_access.fetch_all_verifications()
+        # One primary-key read: proves the database is reachable and migrated, whatever its size
+        db_access.data_version()
         return "ready", 200
     except Exception as e:
         return ("not ready: " + str(e)), 500
-        
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 
 def get_full_upload_path(path_value):
     """Return the absolute path on disk for any stored upload."""
-    if not path_value:
-        return None
-    filename = os.path.basename(path_value)
-    full_path = os.path.join(UPLOAD_FOLDER, filename)
-    return full_path if os.path.exists(full_path) else None
+    return photos.source_path(path_value)
 
 
 def _to_uploads_url(path_value):
     """Return a browser-usable URL under /uploads for any stored path."""
-    if not path_value:
-        return ""
-    p = str(path_value).strip().replace("\\", "/")
-    return f"/{p}" if not p.startswith("/") else p
+    rel = db_access.normalize_path(path_value)
+    return f"/{rel}" if rel else ""
 
 
 @app.route("/uploads/<path:filename>")
 def uploaded_file(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    # Content-addressed photos are cached for a year; send_file handles If-None-Match and Range
+    response = send_from_directory(UPLOAD_FOLDER, filename)
+    return http_cache.cache_upload(response, filename)
 
 
 @app.route("/")
@@ -63,76 +70,51 @@ def root():
 # ---------------- DASHBOARD ---------------- #
 
 
-@app.route(DASHBOARD_URL)
-def index():
-    # --- Collect filters from query params ---
-    status = request.args.get("status", "all")
-    name = request.args.get("name", "").strip()
-    id_number = request.args.get("id_number", "").strip()
-    month = request.args.get("month", "0")
-    year = request.args.get("year", str(datetime.now().year))
-    date_from = request.args.get("date_from", "")
-    date_to = request.args.get("date_to", "")
-
-    current_filters = {
-        "status": status,
-        "name": name,
-        "id_number": id_number,
+def _filters_from_args(args):
+    """Dashboard filters from a query string; exports reuse this so they match the view."""
+    month = args.get("month", "0")
+    year = args.get("year", str(datetime.now().year))
+    return {
+        "status": args.get("status", "all"),
+        "name": args.get("name", "").strip(),
+        "id_number": args.get("id_number", "").strip(),
         "month": int(month) if month.isdigit() else 0,
         "year": int(year) if year.isdigit() else datetime.now().year,
-        "date_from": date_from,
-        "date_to": date_to,
+        "date_from": args.get("date_from", ""),
+        "date_to": args.get("date_to", ""),
     }
 
-    logs = db_access.fetch_all_verifications()
+
+def _view_key(*extra):
+    """ETag key for filtered views: the normalized filters plus any view-specific arguments."""
+    return lambda: [_filters_from_args(request.args)] + [request.args.get(name, "") for name in extra]
+
+
+@app.route(DASHBOARD_URL)
+@http_cache.conditional(_view_key("cursor"))
+def index():
+    current_filters = _filters_from_args(request.args)
+
+    cursor = request.args.get("cursor", "")
+    logs, next_cursor = db_access.query_verifications(current_filters, cursor=cursor or None)
 
     # --- Normalize photo fields for the template ---
     for v in logs:
         v["id_photo"] = _to_uploads_url(v.get("id_photo"))
         v["selfie_photo"] = _to_uploads_url(v.get("selfie_photo"))
 
-    # --- Apply filters ---
-    if status.lower() != "all":
-        logs = [v for v in logs if v.get("status", "").lower() == status.lower()]
-    if name:
-        logs = [v for v in logs if name.lower() in v.get("name", "").lower()]
-    if id_number:
-        logs = [v for v in logs if v.get("id_number", "") == id_number]
-    if current_filters["month"] != 0:
-        logs = [v for v in logs if "timestamp" in v and datetime.strptime(v["timestamp"], "%Y-%m-%d %H:%M:%S").month == current_filters["month"]]
-    if current_filters["year"]:
-        logs = [v for v in logs if "timestamp" in v and datetime.strptime(v["timestamp"], "%Y-%m-%d %H:%M:%S").year == current_filters["year"]]
-    if date_from:
-        try:
-            df = datetime.strptime(date_from, "%Y-%m-%d")
-            logs = [v for v in logs if datetime.strptime(v["timestamp"], "%Y-%m-%d %H:%M:%S") >= df]
-        except Exception:
-            pass
-    if date_to:
-        try:
-            dt = datetime.strptime(date_to, "%Y-%m-%d")
-            logs = [v for v in logs if datetime.strptime(v["timestamp"], "%Y-%m-%d %H:%M:%S") <= dt]
-        except Exception:
-            pass
-
-    # --- Stats ---
-    total = len(logs)
-    success = sum(1 for v in logs if v.get("status", "").lower() == "success")
-    failed = sum(1 for v in logs if v.get("status", "").lower() == "failed")
-    last_date = max([v.get("timestamp") for v in logs], default="N/A")
-
-    stats = {"total": total, "success": success, "failed": failed, "last_date": last_date}
-
-    # --- Chart data ---
+    # --- Stats & chart data (aggregated in SQL over the full filtered set) ---
+    stats = response_cache.aggregate("stats", current_filters, db_access.verification_stats)
     month_labels = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
                     "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
-    month_values = [0] * 12
-    for v in logs:
-        try:
-            ts = datetime.strptime(v["timestamp"], "%Y-%m-%d %H:%M:%S")
-            month_values[ts.month - 1] += 1
-        except Exception:
-            continue
+    month_values = response_cache.aggregate("months", current_filters, db_access.monthly_counts)
+
+    page_args = request.args.to_dict()
+    page_args.pop("cursor", None)
+    next_url = url_for("index", **page_args, cursor=next_cursor) if next_cursor else None
+    first_url = url_for("index", **page_args) if cursor else None
+    # Only the newest page follows live inserts
+    live_after = None if cursor else db_access.max_verification_id()
 
     return render_template(
         "dashboard.html",
@@ -144,10 +126,79 @@ def index():
         month_labels=month_labels,
         month_values=month_values,
         current_query=request.query_string.decode("utf-8"),
+        next_url=next_url,
+        first_url=first_url,
+        live_after=live_after,
         DASHBOARD_URL=DASHBOARD_URL,
     )
 
 
+# ---------------- LIVE UPDATES ---------------- #
+LIVE_BATCH = 200
+
+
+def _row_json(v):
+    row = {k: v.get(k) for k in ("id", "name", "id_number", "email", "status", "timestamp")}
+    for col in ("id_photo", "selfie_photo"):
+        row[col] = photos.photo_url(v[col]) if v.get(col) else ""
+        row[col + "_web"] = photos.photo_url(v[col], "web") if v.get(col) else ""
+    return row
+
+
+def _delta_payload(filters, after):
+    """Rows with id > after (oldest first, at most LIVE_BATCH) plus the refreshed stats and chart data."""
+    rows = db_access.verifications_after(after, filters, limit=LIVE_BATCH)
+    return {
+        "rows": [_row_json(v) for v in rows],
+        "last_id": rows[-1]["id"] if rows else after,
+        "has_more": len(rows) == LIVE_BATCH,
+        "stats": response_cache.aggregate("stats", filters, db_access.verification_stats),
+        "month_values": response_cache.aggregate("months", filters, db_access.monthly_counts),
+    }
+
+
+@app.route("/api/verifications/delta")
+@http_cache.conditional(_view_key("after"))
+def verifications_delta():
+    after = request.args.get("after", default=0, type=int)
+    return jsonify(_delta_payload(_filters_from_args(request.args), after))
+
+
+@app.route("/api/verifications/stream")
+def verifications_stream():
+    filters = _filters_from_args(request.args)
+    # EventSource resends the last event id when it reconnects
+    after = request.headers.get("Last-Event-ID", type=int) or request.args.get("after", default=0, type=int)
+    return Response(
+        live_feed.stream(lambda last_id: _delta_payload(filters, last_id), after),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ---------------- SEARCH ---------------- #
+
+
+@app.route("/api/search")
+@http_cache.conditional(_view_key("q", "page"))
+def search():
+    """Ranked prefix search over name, email and ID number; `page` counts from 1."""
+    query = request.args.get("q", "").strip()
+    page = max(request.args.get("page", default=1, type=int), 1)
+    # Unlike the dashboard, search spans every year unless one is asked for
+    args = request.args.copy()
+    args.setdefault("year", "0")
+    hits, has_more = db_access.search_verifications(
+        query, _filters_from_args(args), offset=(page - 1) * db_access.PAGE_SIZE
+    )
+    return jsonify({
+        "query": query,
+        "page": page,
+        "hits": [dict(_row_json(v), rank=v["rank"]) for v in hits],
+        "has_more": has_more,
+    })
+
+
 # ---------------- CLIENT VERIFICATION ---------------- #
 @app.route(CLIENT_VERIFICATION_URL, methods=["GET", "POST"])
 def client_verification():
@@ -168,139 +219,101 @@ def client_verification():
 # ---------------- DELETE VERIFICATIONS ---------------- #
 @app.route("/delete_by_id_number/<id_number>", methods=["POST", "DELETE"])
 def delete_by_id_number_route(id_number):
-    logs = db_access.fetch_all_verifications()
-
-    # --- Remove associated photos ---
-    for v in logs:
-        if v.get("id_number") == id_number:
-            for photo_field in ["id_photo", "selfie_photo"]:
-                path = v.get(photo_field)
-                if path:
-                    full_path = os.path.join(UPLOAD_FOLDER, os.path.basename(path))
-                    if os.path.exists(full_path):
-                        try:
-                            os.remove(full_path)
-                        except Exception as e:
-                            print(f"[DEBUG] Could not delete {full_path}: {e}")
-
-    # --- Delete from DB & audit log ---
+    # --- Delete from DB, uploads & audit log ---
     ok = db_access.delete_by_id_number(id_number)
     msg = f"Verification for ID Number {id_number} deleted from DB, audit log, and uploads."
     return jsonify({"success": bool(ok), "message": msg}), 200 if ok else 500
 
 
+# ---------------- AUDIT LOG ---------------- #
+@app.route("/admin/audit/<id_number>")
+def audit_history(id_number):
+    # Indexed lookup of the ID's live audit records; no log scan
+    return jsonify({"id_number": id_number, "records": audit_log.history(id_number)})
+
+
 # ---------------- EXPORT ROUTES ---------------- #
 @app.route("/export/csv")
+@http_cache.conditional(_view_key())
 def export_csv():
-    logs = db_access.fetch_all_verifications()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Timestamp", "Client ID", "Status", "Name", "ID Number", "Email", "ID Photo", "Selfie Photo"])
-    for v in logs:
-        writer.writerow([
-            v.get("timestamp", ""),
-            v.get("client_id", ""),
-            v.get("status", ""),
-            v.get("name", ""),
-            v.get("id_number", ""),
-            v.get("email", ""),
-            v.get("id_photo", ""),
-            v.get("selfie_photo", "")
-        ])
-    return Response(output.getvalue(), mimetype="text/csv",
+    filters = _filters_from_args(request.args)
+    return Response(stream_with_context(exports.iter_csv(filters)), mimetype="text/csv",
                     headers={"Content-Disposition": "attachment;filename=verifications.csv"})
 
 
+@app.route("/export/ndjson")
+@http_cache.conditional(_view_key())
+def export_ndjson():
+    filters = _filters_from_args(request.args)
+    return Response(stream_with_context(exports.iter_ndjson(filters)), mimetype="application/x-ndjson",
+                    headers={"Content-Disposition": "attachment;filename=verifications.ndjson"})
+
+
 @app.route("/export/xlsx")
+@http_cache.conditional(_view_key("images"))
 def export_xlsx():
-    logs = db_access.fetch_all_verifications()
-    output = io.BytesIO()
-    workbook = xlsxwriter.Workbook(output, {"in_memory": True})
-    worksheet = workbook.add_worksheet("Verifications")
-
-    headers = ["Timestamp", "Client ID", "Status", "Name", "ID Number", "Email", "ID Photo", "Selfie Photo"]
-    for col, h in enumerate(headers):
-        worksheet.write(0, col, h)
-
-    for row, v in enumerate(logs, start=1):
-        worksheet.write(row, 0, v.get("timestamp", ""))
-        worksheet.write(row, 1, v.get("client_id", ""))
-        worksheet.write(row, 2, v.get("status", ""))
-        worksheet.write(row, 3, v.get("name", ""))
-        worksheet.write(row, 4, v.get("id_number", ""))
-        worksheet.write(row, 5, v.get("email", ""))
-
-        # --- Embed images if they exist ---
-        if v.get("id_photo"):
-            img_path = get_full_upload_path(v["id_photo"])
-            if img_path:
-                worksheet.set_row(row, 60)
-                worksheet.insert_image(row, 6, img_path, {"x_scale": 0.3, "y_scale": 0.3})
-
-        if v.get("selfie_photo"):
-            img_path = get_full_upload_path(v["selfie_photo"])
-            if img_path:
-                worksheet.set_row(row, 60)
-                worksheet.insert_image(row, 7, img_path, {"x_scale": 0.3, "y_scale": 0.3})
-
-    workbook.close()
-    output.seek(0)
-    return Response(
-        output.read(),
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": "attachment;filename=verifications.xlsx"},
+    filters = _filters_from_args(request.args)
+    images = request.args.get("images", "embed")
+    # Built once per filter set and data version, then served from the disk cache
+    output = response_cache.cached_file(
+        ["xlsx", filters, images, request.host_url], "xlsx",
+        lambda fh: exports.write_xlsx(filters, images=images, base_url=request.host_url, output=fh),
     )
+    return send_file(output, mimetype=exports.XLSX_MIME, as_attachment=True, download_name="verifications.xlsx",
+                     conditional=False, etag=False)
 
 
 @app.route("/export/pdf")
+@http_cache.conditional(_view_key())
 def export_pdf():
-    logs = db_access.fetch_all_verifications()
-    output = io.BytesIO()
-    c = rl_canvas.Canvas(output, pagesize=letter)
-    width, height = letter
-
-    y = height - 40
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(30, y, "Verification Report")
-    y -= 30
-
-    c.setFont("Helvetica", 9)
-    for v in logs:
-        line = f"{v.get('timestamp', '')} | {v.get('client_id', '')} | {v.get('status', '')} | {v.get('name', '')} | {v.get('id_number', '')} | {v.get('email', '')}"
-        c.drawString(30, y, line)
-        y -= 15
-
-        # --- Draw ID photo ---
-        if v.get("id_photo"):
-            img_path = get_full_upload_path(v["id_photo"])
-            if img_path:
-                try:
-                    c.drawImage(img_path, 50, y - 60, width=80, height=60, preserveAspectRatio=True, mask="auto")
-                except Exception as e:
-                    c.drawString(50, y, f"[Could not render ID Photo: {e}]")
-
-        # --- Draw Selfie photo ---
-        if v.get("selfie_photo"):
-            img_path = get_full_upload_path(v["selfie_photo"])
-            if img_path:
-                try:
-                    c.drawImage(img_path, 150, y - 60, width=80, height=60, preserveAspectRatio=True, mask="auto")
-                except Exception as e:
-                    c.drawString(150, y, f"[Could not render Selfie Photo: {e}]")
-
-        y -= 10
-        if y < 80:
-            c.showPage()
-            y = height - 40
-            c.setFont("Helvetica", 9)
-
-    c.save()
-    output.seek(0)
-    return Response(
-        output.read(),
-        mimetype="application/pdf",
-        headers={"Content-Disposition": "attachment;filename=verifications.pdf"},
-    )
+    filters = _filters_from_args(request.args)
+    output = response_cache.cached_file(["pdf", filters], "pdf", lambda fh: exports.write_pdf(filters, output=fh))
+    return send_file(output, mimetype="application/pdf", as_attachment=True, download_name="verifications.pdf",
+                     conditional=False, etag=False)
+
+
+# ---------------- EXPORT JOBS ---------------- #
+
+def _job_json(job):
+    body = export_jobs.describe(job)
+    body["status_url"] = url_for("export_job_status", job_id=job["job_id"])
+    if job["state"] == "done":
+        body["download_url"] = url_for("download_export_job", job_id=job["job_id"])
+    return body
+
+
+@app.route("/export/jobs", methods=["POST"])
+def submit_export_job():
+    """Queue an export of the filtered view; poll status_url, then fetch download_url."""
+    fmt = request.args.get("format", "")
+    if fmt not in export_jobs.FORMATS:
+        return jsonify({"error": f"Unknown export format: {fmt}"}), 400
+    options = {}
+    if fmt == "xlsx":
+        options = {"images": request.args.get("images", "embed"), "base_url": request.host_url}
+    job = export_jobs.submit(fmt, _filters_from_args(request.args), options)
+    return jsonify(_job_json(job)), 200 if job["state"] == "done" else 202
+
+
+@app.route("/export/jobs/<job_id>")
+def export_job_status(job_id):
+    job = db_access.get_export_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired export job"}), 404
+    return jsonify(_job_json(job))
+
+
+@app.route("/export/jobs/<job_id>/download")
+def download_export_job(job_id):
+    job = db_access.get_export_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired export job"}), 404
+    path = export_jobs.file_path(job)
+    if job["state"] != "done" or not os.path.exists(path):
+        return jsonify({"error": f"Export is {job['state']}"}), 409
+    extension, mimetype = export_jobs.FORMATS[job["format"]]
+    # The file never changes once built; send_file answers If-None-Match and Range
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=f"verifications.{extension}")
 
 
 if __name__ == "__main__":
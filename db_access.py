@@ -1,10 +1,40 @@
 import os
+import base64
+import calendar
+import re
 import sqlite3
-from typing import List, Dict, Any
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Iterator, Tuple
+
+import db_migrations
+import metrics
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(BASE_DIR, "verifications.db")
-LOG_FILE = os.path.join(BASE_DIR, "dov_audit_log.txt")
+# Root for the database, audit log and uploads/; DOVS_DATA_DIR (or DOVS_DB_FILE for
+# just the database) points tools such as load tests and benchmarks at scratch data
+DATA_DIR = os.getenv("DOVS_DATA_DIR") or BASE_DIR
+DB_FILE = os.getenv("DOVS_DB_FILE") or os.path.join(DATA_DIR, "verifications.db")
+# Pre-segment text audit log; see audit_log for the current format
+LOG_FILE = os.path.join(DATA_DIR, "dov_audit_log.txt")
+
+TIMESTAMP_FMT = "%Y-%m-%d %H:%M:%S"
+TIMESTAMP_FORMATS = (TIMESTAMP_FMT, "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S")
+PAGE_SIZE = 50
+EXPORT_CHUNK = 1000
+# Content-addressed photos live below here (see photo_store)
+BLOB_PREFIX = "uploads/blobs/"
+
+# Per-connection tuning, applied once when a pooled connection is opened
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 16 * 1024
+STATEMENT_CACHE_SIZE = 256
+MAX_IDLE_CONNECTIONS = 8
+# bm25 column weights for search ranking: name, email, id_number
+SEARCH_WEIGHTS = (10.0, 4.0, 4.0)
+VERIFICATION_COLUMNS = "id, timestamp, ts_epoch, client_id, status, details, name, id_number, email, id_photo, selfie_photo"
 
 
 def normalize_path(path: str) -> str | None:
@@ -17,196 +47,892 @@ def normalize_path(path: str) -> str | None:
     return f"uploads/{os.path.basename(p)}"
 
 
-def _delete_audit_blocks_by_id_number(id_number: str, log_path: str = None) -> int:
-    """Remove all audit log blocks containing given ID number."""
-    path = log_path or LOG_FILE
-    if not os.path.exists(path):
-        return 0
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            content = f.read()
-        blocks = content.split("=" * 50 + "\n\n")
-        kept, removed = [], 0
-        for b in blocks:
-            if not b.strip():
-                continue
-            if f"ID Number: {id_number}" in b:
-                removed += 1
-                continue
-            kept.append(b)
-        new_content = ""
-        for b in kept:
-            if not b.endswith("\n"):
-                b += "\n"
-            new_content += b + "=" * 50 + "\n\n"
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(new_content)
-        return removed
-    except Exception as e:
-        print(f"[DEBUG] Audit log cleanup failed: {e}")
-        return 0
-
-
-def ensure_database():
-    """Ensure DB and table exist."""
-    recreate = False
-    if not os.path.exists(DB_FILE):
-        print("[DEBUG] Database file not found — creating new one.")
-        recreate = True
-    else:
+def resolve_photo_path(path: str) -> str | None:
+    """normalize_path, plus pre-blob paths resolved to their blob through photo_aliases.
+
+    For paths on their way into the table (inserts, audit log ingestion): rows
+    already stored were repointed by `photo_store.py --migrate`, so reads only
+    need normalize_path.
+    """
+    rel = normalize_path(path)
+    if not rel or rel.startswith(BLOB_PREFIX):
+        return rel
+    row = get_conn().execute("SELECT path FROM photo_aliases WHERE alias = ?", (rel,)).fetchone()
+    return row["path"] if row else rel
+
+
+def to_epoch(dt: datetime) -> int:
+    """Naive datetime -> epoch seconds, read as UTC to match the ts_epoch column."""
+    return calendar.timegm(dt.timetuple())
+
+
+def timestamp_to_epoch(timestamp: str | None) -> int:
+    """Parse a stored timestamp string into ts_epoch (0 when unparseable)."""
+    for fmt in TIMESTAMP_FORMATS:
         try:
-            conn = sqlite3.connect(DB_FILE)
-            cur = conn.cursor()
-            cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='verifications'")
-            if not cur.fetchone():
-                recreate = True
-            conn.close()
-        except sqlite3.DatabaseError:
-            recreate = True
-
-    if recreate:
-        conn = sqlite3.connect(DB_FILE)
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS verifications (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT,
-                client_id TEXT,
-                status TEXT,
-                details TEXT,
-                name TEXT,
-                id_number TEXT,
-                email TEXT,
-                id_photo TEXT,
-                selfie_photo TEXT
-            )
-        """)
-        conn.commit()
-        conn.close()
-        print("[DEBUG] Database recreated successfully.")
-
-
-def ensure_db_columns():
-    """Ensure id_photo and selfie_photo columns exist in verifications table."""
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("PRAGMA table_info(verifications)")
-    existing_cols = [row[1] for row in cur.fetchall()]
-
-    if "id_photo" not in existing_cols:
-        cur.execute("ALTER TABLE verifications ADD COLUMN id_photo TEXT;")
-        print("[DEBUG] Added missing column: id_photo")
-
-    if "selfie_photo" not in existing_cols:
-        cur.execute("ALTER TABLE verifications ADD COLUMN selfie_photo TEXT;")
-        print("[DEBUG] Added missing column: selfie_photo")
-
-    conn.commit()
-    conn.close()
-
-
-# Run safety checks at import
-ensure_database()
-ensure_db_columns()
+            return to_epoch(datetime.strptime(timestamp or "", fmt))
+        except ValueError:
+            continue
+    return 0
+
+
+def _abs_upload_path(path: str | None) -> str | None:
+    rel = normalize_path(path)
+    return os.path.join(DATA_DIR, rel) if rel else None
+
+
+# Bring the schema up to date at import
+db_migrations.migrate(DB_FILE)
 
 
 def dict_factory(cursor, row):
     return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
 
 
-def get_conn():
-    conn = sqlite3.connect(DB_FILE)
+# ---------------- CONNECTION MANAGER ---------------- #
+# Each thread gets one long-lived connection. When a thread ends (e.g. a
+# per-request thread of the dev server) its connection goes back to a small
+# idle pool for the next thread instead of being closed.
+
+_local = threading.local()
+_idle: List[sqlite3.Connection] = []
+_idle_lock = threading.Lock()
+
+
+def _open_connection() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_FILE, timeout=30, isolation_level=None, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE)
     conn.row_factory = dict_factory
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
     return conn
 
 
+class _ThreadConnection:
+    """Holds a thread's connection and returns it to the idle pool when the thread goes away."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.pid = os.getpid()
+
+    def __del__(self):
+        try:
+            if self.pid != os.getpid():
+                return
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            with _idle_lock:
+                if len(_idle) < MAX_IDLE_CONNECTIONS:
+                    _idle.append(self.conn)
+                    return
+            self.conn.close()
+        except Exception:
+            pass
+
+
+def get_conn() -> sqlite3.Connection:
+    """Return this thread's connection (autocommit; use transaction() to group writes)."""
+    holder = getattr(_local, "holder", None)
+    if holder is None or holder.pid != os.getpid():
+        conn = None
+        with _idle_lock:
+            if _idle:
+                conn = _idle.pop()
+        holder = _ThreadConnection(conn or _open_connection())
+        _local.holder = holder
+    return holder.conn
+
+
+@contextmanager
+def transaction():
+    """BEGIN IMMEDIATE ... COMMIT on this thread's connection; nested use joins the outer transaction."""
+    conn = get_conn()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def close_conn() -> None:
+    """Close this thread's connection (e.g. before a fork or at shutdown)."""
+    holder = getattr(_local, "holder", None)
+    if holder is not None:
+        _local.holder = None
+        holder.conn.close()
+        holder.pid = None
+
+
 def insert_verification(timestamp: str, client_id: str, status: str,
                         details: str = None, name: str = None, id_number: str = None,
                         email: str = None, id_photo: str = None, selfie_photo: str = None) -> int:
     """Insert a new verification into DB."""
-    conn = get_conn()
-    cur = conn.cursor()
+    cur = get_conn().cursor()
     cur.execute("""
-        INSERT INTO verifications (timestamp, client_id, status, details, name, id_number, email, id_photo, selfie_photo)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO verifications (timestamp, ts_epoch, client_id, status, details, name, id_number, id_number_norm,
+                                   email, id_photo, selfie_photo)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, (
-        timestamp, client_id, status, details, name, id_number, email,
-        normalize_path(id_photo), normalize_path(selfie_photo)
+        timestamp, timestamp_to_epoch(timestamp), client_id, status, details, name,
+        id_number, id_number.strip() if id_number is not None else None, email,
+        resolve_photo_path(id_photo), resolve_photo_path(selfie_photo)
     ))
-    conn.commit()
-    new_id = cur.lastrowid
-    conn.close()
-    return new_id
+    return cur.lastrowid
 
 
 def fetch_all_verifications() -> List[Dict[str, Any]]:
     """Fetch all verifications as dicts, ordered by timestamp DESC."""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id, timestamp, client_id, status, details, name, id_number, email, id_photo, selfie_photo
+    cur = get_conn().cursor()
+    cur.execute(f"""
+        SELECT {VERIFICATION_COLUMNS}
         FROM verifications
-        ORDER BY datetime(timestamp) DESC, id DESC
+        ORDER BY ts_epoch DESC, id DESC
     """)
     rows = cur.fetchall()
-    conn.close()
+    return [_prepare_row(r) for r in rows]
+
+
+def _prepare_row(r: Dict[str, Any]) -> Dict[str, Any]:
+    r["date_str"] = r.get("timestamp", "")
+    r["id_photo"] = normalize_path(r.get("id_photo"))
+    r["selfie_photo"] = normalize_path(r.get("selfie_photo"))
+    return r
+
+
+# ---------------- FILTERED QUERIES ---------------- #
+
+def _time_bounds(filters: Dict[str, Any]) -> Tuple[datetime | None, datetime | None]:
+    """Collapse year/month/date_from/date_to into one [lower, upper) datetime range."""
+    lower, upper = None, None
+
+    def narrow(lo, hi):
+        nonlocal lower, upper
+        if lo is not None and (lower is None or lo > lower):
+            lower = lo
+        if hi is not None and (upper is None or hi < upper):
+            upper = hi
+
+    year = filters.get("year") or 0
+    month = filters.get("month") or 0
+    if not 1 <= year < 9999:
+        year = 0
+    if year and 1 <= month <= 12:
+        start = datetime(year, month, 1)
+        narrow(start, datetime(year + (month == 12), month % 12 + 1, 1))
+    elif year:
+        narrow(datetime(year, 1, 1), datetime(year + 1, 1, 1))
+
+    for key, is_upper in (("date_from", False), ("date_to", True)):
+        value = filters.get(key)
+        if not value:
+            continue
+        try:
+            day = datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            continue
+        if is_upper:
+            # date_to is inclusive of the whole day
+            narrow(None, day + timedelta(days=1))
+        else:
+            narrow(day, None)
+
+    return lower, upper
+
+
+def fts_query(text: str | None, columns: Tuple[str, ...] = ()) -> str | None:
+    """FTS5 MATCH expression for free text: every word must match the start of a token.
+
+    Words are quoted, so user input can never be read as FTS5 syntax.
+    """
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        return None
+    expr = " ".join(f'"{w}"*' for w in words)
+    return f"{{{' '.join(columns)}}} : ({expr})" if columns else expr
+
+
+def build_filter_clause(filters: Dict[str, Any] | None) -> Tuple[str, List[Any]]:
+    """Translate dashboard filters into a parameterized WHERE clause (without the WHERE keyword)."""
+    filters = filters or {}
+    clauses: List[str] = []
+    params: List[Any] = []
+
+    status = (filters.get("status") or "all").strip()
+    if status.lower() != "all":
+        clauses.append("status = ? COLLATE NOCASE")
+        params.append(status)
+
+    name = (filters.get("name") or "").strip()
+    match = fts_query(name, ("name",))
+    if match:
+        clauses.append("id IN (SELECT rowid FROM verifications_fts WHERE verifications_fts MATCH ?)")
+        params.append(match)
+    elif name:
+        # Punctuation only: nothing for the tokenizer to match on
+        escaped = name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        clauses.append("name LIKE ? ESCAPE '\\'")
+        params.append(f"%{escaped}%")
+
+    id_number = (filters.get("id_number") or "").strip()
+    if id_number:
+        clauses.append("id_number_norm = ?")
+        params.append(id_number)
+
+    lower, upper = _time_bounds(filters)
+    if lower is not None:
+        clauses.append("ts_epoch >= ?")
+        params.append(to_epoch(lower))
+    if upper is not None:
+        clauses.append("ts_epoch < ?")
+        params.append(to_epoch(upper))
+
+    return (" AND ".join(clauses) or "1"), params
+
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    """Opaque keyset cursor pointing just past the given row."""
+    raw = f"{row.get('ts_epoch') or 0}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode("ascii")).decode("ascii")
+
+
+def decode_cursor(cursor: str | None) -> Tuple[int, int] | None:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("ascii")
+        ts_epoch, rec_id = raw.split("|", 1)
+        return int(ts_epoch), int(rec_id)
+    except Exception:
+        return None
+
+
+def query_verifications(filters: Dict[str, Any] | None = None, limit: int = PAGE_SIZE,
+                        cursor: str | None = None) -> Tuple[List[Dict[str, Any]], str | None]:
+    """Return one page of filtered verifications (newest first) and the cursor for the next page."""
+    where, params = build_filter_clause(filters)
+    after = decode_cursor(cursor)
+    if after:
+        where += " AND (ts_epoch, id) < (?, ?)"
+        params += list(after)
+
+    cur = get_conn().cursor()
+    cur.execute(f"""
+        SELECT {VERIFICATION_COLUMNS}
+        FROM verifications
+        WHERE {where}
+        ORDER BY ts_epoch DESC, id DESC
+        LIMIT ?
+    """, params + [limit + 1])
+    rows = cur.fetchall()
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return [_prepare_row(r) for r in rows[:limit]], next_cursor
+
+
+def verifications_after(after_id: int, filters: Dict[str, Any] | None = None,
+                        limit: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    """Filtered verifications with id > after_id, oldest id first (the live dashboard's delta)."""
+    where, params = build_filter_clause(filters)
+    cur = get_conn().cursor()
+    cur.execute(f"""
+        SELECT {VERIFICATION_COLUMNS}
+        FROM verifications
+        WHERE id > ? AND {where}
+        ORDER BY id
+        LIMIT ?
+    """, [after_id] + params + [limit])
+    return [_prepare_row(r) for r in cur.fetchall()]
+
+
+def search_verifications(text: str, filters: Dict[str, Any] | None = None, limit: int = PAGE_SIZE,
+                         offset: int = 0) -> Tuple[List[Dict[str, Any]], bool]:
+    """Best-ranked verifications whose name, email or id_number match text (by word prefix).
+
+    Returns one page of rows (each with its bm25 `rank`, lower is better) and
+    whether more follow. Dashboard filters narrow the hits further.
+    """
+    match = fts_query(text)
+    if not match:
+        return [], False
+    where, params = build_filter_clause(filters)
+    ranked = "SELECT rowid, bm25(verifications_fts, ?, ?, ?) AS rank FROM verifications_fts WHERE verifications_fts MATCH ?"
+    inner_page, outer_page = "", "LIMIT ? OFFSET ?"
+    if where == "1":
+        # Unfiltered: FTS5 picks the page before anything is joined
+        inner_page, outer_page = "ORDER BY rank, rowid DESC LIMIT ? OFFSET ?", ""
+    cur = get_conn().cursor()
+    cur.execute(f"""
+        SELECT {VERIFICATION_COLUMNS}, hits.rank
+        FROM ({ranked} {inner_page}) AS hits
+        JOIN verifications ON verifications.id = hits.rowid
+        WHERE {where}
+        ORDER BY hits.rank, verifications.id DESC
+        {outer_page}
+    """, [*SEARCH_WEIGHTS, match, *([limit + 1, offset] if inner_page else params + [limit + 1, offset])])
+    rows = cur.fetchall()
+    return [_prepare_row(r) for r in rows[:limit]], len(rows) > limit
+
+
+def max_verification_id() -> int:
+    row = get_conn().execute("SELECT MAX(id) AS id FROM verifications").fetchone()
+    return row["id"] or 0
+
+
+def iter_verification_chunks(filters: Dict[str, Any] | None = None,
+                             chunk_size: int = EXPORT_CHUNK) -> Iterator[List[Dict[str, Any]]]:
+    """Yield the whole filtered set, newest first, as lists of at most chunk_size rows.
+
+    Each chunk is its own indexed keyset query, so no statement or snapshot is
+    held open between chunks and memory stays at one chunk regardless of size.
+    """
+    cursor = None
+    while True:
+        rows, cursor = query_verifications(filters, limit=chunk_size, cursor=cursor)
+        if rows:
+            yield rows
+        if not cursor:
+            return
+
+
+def iter_verifications(filters: Dict[str, Any] | None = None,
+                       chunk_size: int = EXPORT_CHUNK) -> Iterator[Dict[str, Any]]:
+    """Row-at-a-time view over iter_verification_chunks()."""
+    for rows in iter_verification_chunks(filters, chunk_size):
+        yield from rows
+
+
+def _rollup_clause(filters: Dict[str, Any] | None) -> Tuple[str, List[Any]] | None:
+    """WHERE clause over verification_daily, or None when the filters need row-level data."""
+    filters = filters or {}
+    if (filters.get("name") or "").strip() or (filters.get("id_number") or "").strip():
+        return None
+
+    clauses: List[str] = []
+    params: List[Any] = []
+    status = (filters.get("status") or "all").strip()
+    if status.lower() != "all":
+        clauses.append("status = LOWER(?)")
+        params.append(status)
+
+    # Time bounds are always whole days, so they map exactly onto day buckets
+    lower, upper = _time_bounds(filters)
+    if lower is not None:
+        clauses.append("day >= ?")
+        params.append(to_epoch(lower) // 86400)
+    if upper is not None:
+        clauses.append("day < ?")
+        params.append(to_epoch(upper) // 86400)
+    return (" AND ".join(clauses) or "1"), params
+
+
+def epoch_to_timestamp(epoch: int) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime(TIMESTAMP_FMT)
+
+
+def verification_stats(filters: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """Total/success/failed counts and most recent timestamp for the filtered set."""
+    cur = get_conn().cursor()
+    rollup = _rollup_clause(filters)
+    if rollup is not None:
+        where, params = rollup
+        cur.execute(f"""
+            SELECT COALESCE(SUM(total), 0) AS total,
+                   COALESCE(SUM(CASE WHEN status = 'success' THEN total END), 0) AS success,
+                   COALESCE(SUM(CASE WHEN status = 'failed' THEN total END), 0) AS failed,
+                   MAX(latest_epoch) AS last_epoch
+            FROM verification_daily
+            WHERE {where}
+        """, params)
+        row = cur.fetchone()
+        last_epoch = row.pop("last_epoch")
+        row["last_date"] = epoch_to_timestamp(last_epoch) if last_epoch is not None else None
+    else:
+        where, params = build_filter_clause(filters)
+        # With a single MAX() aggregate SQLite returns the bare `timestamp` from that same row
+        cur.execute(f"""
+            SELECT COUNT(*) AS total,
+                   COALESCE(SUM(status = 'success' COLLATE NOCASE), 0) AS success,
+                   COALESCE(SUM(status = 'failed' COLLATE NOCASE), 0) AS failed,
+                   MAX(ts_epoch) AS last_epoch,
+                   timestamp AS last_date
+            FROM verifications
+            WHERE {where}
+        """, params)
+        row = cur.fetchone()
+        row.pop("last_epoch")
+    row["last_date"] = row["last_date"] or "N/A"
+    return row
+
+
+def monthly_counts(filters: Dict[str, Any] | None = None) -> List[int]:
+    """Verifications per calendar month (Jan..Dec) for the filtered set."""
+    rollup = _rollup_clause(filters)
+    if rollup is not None:
+        where, params = rollup
+        sql = f"""
+            SELECT CAST(strftime('%m', day * 86400, 'unixepoch') AS INTEGER) AS month, SUM(total) AS n
+            FROM verification_daily
+            WHERE {where}
+            GROUP BY month
+        """
+    else:
+        where, params = build_filter_clause(filters)
+        sql = f"""
+            SELECT CAST(strftime('%m', ts_epoch, 'unixepoch') AS INTEGER) AS month, COUNT(*) AS n
+            FROM verifications
+            WHERE {where}
+            GROUP BY month
+        """
+    cur = get_conn().cursor()
+    cur.execute(sql, params)
+    rows = cur.fetchall()
 
-    logs: List[Dict[str, Any]] = []
+    values = [0] * 12
     for r in rows:
-        r["date_str"] = r.get("timestamp", "")
-        r["id_photo"] = normalize_path(r.get("id_photo"))
-        r["selfie_photo"] = normalize_path(r.get("selfie_photo"))
-        logs.append(r)
-    return logs
+        if r["month"] and 1 <= r["month"] <= 12:
+            values[r["month"] - 1] = r["n"]
+    return values
+
+
+def rebuild_rollups() -> int:
+    """Recompute the verification_daily rollup from the verifications table."""
+    return db_migrations.rebuild_rollups(get_conn())
+
+
+def data_version() -> int:
+    """Counter bumped by every write to verifications (see migration 10); cheap to read per request."""
+    row = get_conn().execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()
+    return row["value"] if row else 0
+
+
+def verified_since(id_number: str, since: datetime) -> bool:
+    """True if id_number has a verification at or after `since` (an index-only lookup)."""
+    cur = get_conn().cursor()
+    cur.execute(
+        "SELECT 1 AS hit FROM verifications WHERE id_number_norm = ? AND ts_epoch >= ? LIMIT 1",
+        ((id_number or "").strip(), to_epoch(since)),
+    )
+    row = cur.fetchone()
+    return row is not None
+
+
+# ---------------- DOV poll queue ---------------- #
+
+def enqueue_dov_poll(enquiry_id: str, enquiry_result_id: str = None, id_number: str = None,
+                     priority: int = 0, first_poll_at: float = None) -> None:
+    """Add an enquiry to dov_pending (or re-arm it, keeping the higher priority)."""
+    now = time.time()
+    get_conn().execute("""
+        INSERT INTO dov_pending (enquiry_id, enquiry_result_id, id_number, priority, next_poll_at,
+                                 state, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, 'pending', ?, ?)
+        ON CONFLICT (enquiry_id) DO UPDATE SET
+            priority = MAX(priority, excluded.priority),
+            next_poll_at = MIN(next_poll_at, excluded.next_poll_at),
+            state = 'pending',
+            updated_at = excluded.updated_at
+    """, (enquiry_id, enquiry_result_id, id_number, priority,
+          now if first_poll_at is None else first_poll_at, now, now))
+
+
+def due_dov_polls(now: float, limit: int) -> List[Dict[str, Any]]:
+    """Pending enquiries due by `now`, highest priority first, then longest waiting."""
+    cur = get_conn().cursor()
+    cur.execute("""
+        SELECT * FROM dov_pending
+        WHERE state = 'pending' AND next_poll_at <= ?
+        ORDER BY priority DESC, next_poll_at LIMIT ?
+    """, (now, limit))
+    return cur.fetchall()
+
+
+def next_dov_poll_at() -> float | None:
+    """When the earliest pending enquiry is due, or None if nothing is pending."""
+    cur = get_conn().cursor()
+    cur.execute("SELECT MIN(next_poll_at) AS due FROM dov_pending WHERE state = 'pending'")
+    return cur.fetchone()["due"]
+
+
+def reschedule_dov_poll(enquiry_id: str, next_poll_at: float, error: str = None) -> None:
+    get_conn().execute("""
+        UPDATE dov_pending SET attempts = attempts + 1, next_poll_at = ?, last_error = ?, updated_at = ?
+        WHERE enquiry_id = ?
+    """, (next_poll_at, error, time.time(), enquiry_id))
+
+
+def finish_dov_poll(enquiry_id: str, state: str, error: str = None) -> None:
+    """Take an enquiry off the queue; state is 'done', 'expired' or 'failed'."""
+    get_conn().execute("""
+        UPDATE dov_pending SET state = ?, attempts = attempts + 1, last_error = ?, updated_at = ?
+        WHERE enquiry_id = ?
+    """, (state, error, time.time(), enquiry_id))
+
+
+def dov_poll_counts() -> Dict[str, int]:
+    cur = get_conn().cursor()
+    cur.execute("SELECT state, COUNT(*) AS n FROM dov_pending GROUP BY state")
+    return {r["state"]: r["n"] for r in cur.fetchall()}
+
+
+# ---------------- bulk verification checkpoints ---------------- #
+
+BULK_ITEM_FIELDS = ("state", "enquiry_id", "enquiry_result_id", "error")
+
+
+def get_bulk_run(run_id: str) -> Dict[str, Any] | None:
+    cur = get_conn().cursor()
+    cur.execute("SELECT * FROM bulk_runs WHERE run_id = ?", (run_id,))
+    return cur.fetchone()
+
+
+def load_bulk_run(run_id: str, source: str, items: Iterator[Dict[str, Any]], chunk_size: int = EXPORT_CHUNK) -> int:
+    """Record a run's input lines as 'new' items, chunk_size per transaction; returns the item count.
+
+    Safe to repeat after an interrupted load: lines already recorded are kept as they are.
+    """
+    now = time.time()
+    get_conn().execute("INSERT OR IGNORE INTO bulk_runs (run_id, source, created_at) VALUES (?, ?, ?)",
+                       (run_id, source, now))
+    total = 0
+    chunk = []
+
+    def flush():
+        with transaction() as conn:
+            conn.executemany("""
+                INSERT OR IGNORE INTO bulk_items (run_id, line_no, id_number, cell_number, reference, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, chunk)
+        chunk.clear()
+
+    for item in items:
+        chunk.append((run_id, item["line_no"], item.get("id_number"), item.get("cell_number"),
+                      item.get("reference") or "", now))
+        total += 1
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    get_conn().execute("UPDATE bulk_runs SET loaded = 1 WHERE run_id = ?", (run_id,))
+    return total
+
+
+def bulk_items(run_id: str, states: Tuple[str, ...], after_line: int = 0,
+               limit: int = EXPORT_CHUNK) -> List[Dict[str, Any]]:
+    """The run's items in the given states after line `after_line`, in input order."""
+    marks = ", ".join("?" * len(states))
+    cur = get_conn().cursor()
+    cur.execute(f"""
+        SELECT * FROM bulk_items
+        WHERE run_id = ? AND line_no > ? AND state IN ({marks})
+        ORDER BY line_no LIMIT ?
+    """, (run_id, after_line, *states, limit))
+    return cur.fetchall()
+
+
+def update_bulk_item(run_id: str, line_no: int, **fields) -> None:
+    """Checkpoint one item; fields are any of BULK_ITEM_FIELDS."""
+    unknown = set(fields) - set(BULK_ITEM_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown bulk item fields: {sorted(unknown)}")
+    assignments = ", ".join(f"{k} = ?" for k in fields)
+    get_conn().execute(f"UPDATE bulk_items SET {assignments}, updated_at = ? WHERE run_id = ? AND line_no = ?",
+                       (*fields.values(), time.time(), run_id, line_no))
+
+
+def bulk_run_counts(run_id: str) -> Dict[str, int]:
+    """Item counts by state; queued items report their dov_pending state (done/expired/...) instead."""
+    cur = get_conn().cursor()
+    cur.execute("""
+        SELECT CASE WHEN b.state = 'queued' THEN COALESCE(p.state, 'queued') ELSE b.state END AS state,
+               COUNT(*) AS n
+        FROM bulk_items b LEFT JOIN dov_pending p ON p.enquiry_id = b.enquiry_id
+        WHERE b.run_id = ?
+        GROUP BY 1
+    """, (run_id,))
+    return {r["state"]: r["n"] for r in cur.fetchall()}
+
+
+def bulk_poll_waits(run_id: str) -> List[float]:
+    """Seconds each of the run's completed enquiries spent in dov_pending."""
+    cur = get_conn().cursor()
+    cur.execute("""
+        SELECT p.updated_at - p.created_at AS wait
+        FROM bulk_items b JOIN dov_pending p ON p.enquiry_id = b.enquiry_id
+        WHERE b.run_id = ? AND p.state = 'done'
+    """, (run_id,))
+    return [r["wait"] for r in cur.fetchall()]
+
+
+def finish_bulk_run(run_id: str) -> None:
+    get_conn().execute("UPDATE bulk_runs SET finished_at = ? WHERE run_id = ?", (time.time(), run_id))
+
+
+# ---------------- export jobs ---------------- #
+
+EXPORT_JOB_FIELDS = ("state", "rows_done", "rows_total", "path", "bytes", "error",
+                     "started_at", "finished_at", "expires_at")
+
+
+def create_export_job(job_id: str, request_key: str, fmt: str, filters: str, options: str) -> None:
+    now = time.time()
+    get_conn().execute("""
+        INSERT INTO export_jobs (job_id, request_key, format, filters, options, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (job_id, request_key, fmt, filters, options, now, now))
+
+
+def get_export_job(job_id: str) -> Dict[str, Any] | None:
+    cur = get_conn().cursor()
+    cur.execute("SELECT * FROM export_jobs WHERE job_id = ?", (job_id,))
+    return cur.fetchone()
+
+
+def find_export_job(request_key: str, now: float) -> Dict[str, Any] | None:
+    """The newest job for the same request that is queued, running or done and not yet expired."""
+    cur = get_conn().cursor()
+    cur.execute("""
+        SELECT * FROM export_jobs
+        WHERE request_key = ? AND state IN ('queued', 'running', 'done') AND COALESCE(expires_at, ?) >= ?
+        ORDER BY created_at DESC LIMIT 1
+    """, (request_key, now, now))
+    return cur.fetchone()
+
+
+def claim_export_job(job_id: str) -> bool:
+    """Move a queued job to running; False if another worker got it first."""
+    now = time.time()
+    return get_conn().execute("""
+        UPDATE export_jobs SET state = 'running', started_at = ?, updated_at = ?
+        WHERE job_id = ? AND state = 'queued'
+    """, (now, now, job_id)).rowcount == 1
+
+
+def update_export_job(job_id: str, **fields) -> None:
+    """Record progress or the outcome; fields are any of EXPORT_JOB_FIELDS."""
+    unknown = set(fields) - set(EXPORT_JOB_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown export job fields: {sorted(unknown)}")
+    assignments = ", ".join(f"{k} = ?" for k in fields)
+    get_conn().execute(f"UPDATE export_jobs SET {assignments}, updated_at = ? WHERE job_id = ?",
+                       (*fields.values(), time.time(), job_id))
+
+
+def requeue_stale_export_jobs(before: float) -> List[str]:
+    """Put running jobs with no progress since `before` (their worker died) back in the queue."""
+    with transaction() as conn:
+        rows = conn.execute("""
+            SELECT job_id FROM export_jobs WHERE state IN ('queued', 'running') AND updated_at < ?
+        """, (before,)).fetchall()
+        conn.executemany("""
+            UPDATE export_jobs SET state = 'queued', rows_done = 0, updated_at = ? WHERE job_id = ?
+        """, [(time.time(), r["job_id"]) for r in rows])
+    return [r["job_id"] for r in rows]
+
+
+def expired_export_jobs(now: float) -> List[Dict[str, Any]]:
+    cur = get_conn().cursor()
+    cur.execute("SELECT job_id, path FROM export_jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+    return cur.fetchall()
+
+
+def delete_export_jobs(job_ids: List[str]) -> int:
+    return get_conn().executemany("DELETE FROM export_jobs WHERE job_id = ?", [(j,) for j in job_ids]).rowcount
+
+
+def export_job_paths() -> set:
+    return {r["path"] for r in get_conn().execute("SELECT path FROM export_jobs WHERE path IS NOT NULL")}
+
+
+# ---------------- audit log ingestion ---------------- #
+
+def get_ingest_checkpoint(source: str) -> Dict[str, Any] | None:
+    cur = get_conn().cursor()
+    cur.execute("SELECT segment, path, offset FROM ingest_checkpoints WHERE source = ?", (source,))
+    return cur.fetchone()
+
+
+def ingest_verifications(sessions: List[Dict[str, Any]], source: str, segment: int, path: str, offset: int) -> int:
+    """Insert a batch of new sessions and advance the source's checkpoint in one transaction.
+
+    Sessions already stored (same timestamp, client_id and ID number) are
+    skipped, looked up on the (timestamp, client_id) index; returns how many
+    rows were inserted.
+    """
+    rows = [(
+        s.get("timestamp"), timestamp_to_epoch(s.get("timestamp")), s.get("client_id"), s.get("status"),
+        s.get("details"), s.get("name"), s.get("id_number"),
+        s["id_number"].strip() if s.get("id_number") is not None else None, s.get("email"),
+        resolve_photo_path(s.get("id_photo")), resolve_photo_path(s.get("selfie_photo")),
+    ) for s in sessions]
+    with transaction() as conn:
+        cur = conn.cursor()
+        inserted = 0
+        if rows:
+            cur.executemany("""
+                INSERT INTO verifications (timestamp, ts_epoch, client_id, status, details, name, id_number,
+                                           id_number_norm, email, id_photo, selfie_photo)
+                SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, ?10, ?11
+                WHERE NOT EXISTS (SELECT 1 FROM verifications
+                                  WHERE timestamp = ?1 AND client_id = ?3 AND id_number_norm IS ?8)
+            """, rows)
+            inserted = cur.rowcount
+        cur.execute("""
+            INSERT INTO ingest_checkpoints (source, segment, path, offset, updated_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (source) DO UPDATE SET segment = excluded.segment, path = excluded.path,
+                                               offset = excluded.offset, updated_at = excluded.updated_at
+        """, (source, segment, path, offset, time.time()))
+    return inserted
+
+
+_DUPLICATE_SESSIONS = """
+    SELECT v.id, v.timestamp, v.client_id, d.keep_id, v.id_photo, v.selfie_photo
+    FROM verifications v
+    JOIN (SELECT timestamp, client_id, id_number_norm, MIN(id) AS keep_id FROM verifications
+          WHERE timestamp IS NOT NULL AND client_id IS NOT NULL
+          GROUP BY timestamp, client_id, id_number_norm HAVING COUNT(*) > 1) d
+      ON v.timestamp = d.timestamp AND v.client_id = d.client_id AND v.id_number_norm IS d.id_number_norm
+     AND v.id <> d.keep_id
+    ORDER BY v.id
+"""
+
+
+def duplicate_sessions() -> List[Dict[str, Any]]:
+    """Rows repeating an earlier row's session (timestamp, client_id and ID number), with that row's id as keep_id.
+
+    client_id alone is not enough: live inserts fall back to "N/A" for it.
+    """
+    return get_conn().execute(_DUPLICATE_SESSIONS).fetchall()
+
+
+def delete_duplicate_sessions() -> int:
+    """Delete the rows duplicate_sessions() lists, keeping the first of each; returns how many went.
+
+    Photos are released like any delete, but a pre-blob file is only removed
+    once no remaining row points at it: duplicates usually share their photos.
+    """
+    with transaction() as conn:
+        rows = conn.execute(_DUPLICATE_SESSIONS).fetchall()
+        conn.executemany("DELETE FROM verifications WHERE id = ?", [(r["id"],) for r in rows])
+        paths = {p for r in rows for p in (r["id_photo"], r["selfie_photo"]) if p}
+        _release_photo_blobs(conn, paths)
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS released_paths (path TEXT PRIMARY KEY) WITHOUT ROWID")
+        conn.execute("DELETE FROM temp.released_paths")
+        conn.executemany("INSERT INTO temp.released_paths VALUES (?)", [(p,) for p in paths])
+        # One pass over verifications for all of them (the photo columns are not indexed)
+        unreferenced = [r["path"] for r in conn.execute("""
+            SELECT path FROM temp.released_paths
+            EXCEPT SELECT id_photo FROM verifications EXCEPT SELECT selfie_photo FROM verifications
+        """)]
+        conn.execute("DROP TABLE temp.released_paths")
+    _remove_photo_files(unreferenced)
+    print(f"[DEBUG] Deleted {len(rows)} duplicate sessions")
+    return len(rows)
+
+
+# ---------------- photo blobs ---------------- #
+
+def register_photo_blob(path: str, sha256: str, size: int) -> None:
+    get_conn().execute("INSERT OR IGNORE INTO photo_blobs (path, sha256, size) VALUES (?, ?, ?)",
+                       (path, sha256, size))
+
+
+def add_photo_alias(alias: str, path: str) -> None:
+    get_conn().execute("INSERT OR REPLACE INTO photo_aliases (alias, path) VALUES (?, ?)", (alias, path))
+
+
+def _release_photo_blobs(conn: sqlite3.Connection, paths) -> int:
+    """Drop blobs among `paths` that no verification references any more, unlinking their files.
+
+    Runs inside the caller's write transaction so a concurrent photo_store.store_file
+    cannot pick up a blob that is being removed.
+    """
+    released = 0
+    for rel in {p for p in paths if p and p.startswith(BLOB_PREFIX)}:
+        row = conn.execute("SELECT refcount FROM photo_blobs WHERE path = ?", (rel,)).fetchone()
+        if row is None or row["refcount"] > 0:
+            continue
+        conn.execute("DELETE FROM photo_blobs WHERE path = ?", (rel,))
+        conn.execute("DELETE FROM photo_aliases WHERE path = ?", (rel,))
+        f = os.path.join(DATA_DIR, rel)
+        if os.path.exists(f):
+            os.remove(f)
+            print(f"[DEBUG] Removed unreferenced blob: {f}")
+        released += 1
+    return released
+
+
+def _remove_photo_files(paths) -> None:
+    """Remove pre-blob photo files; blobs are reference-counted and released by _release_photo_blobs."""
+    for p in paths:
+        if p and normalize_path(p).startswith(BLOB_PREFIX):
+            continue
+        f = _abs_upload_path(p)
+        if f and os.path.exists(f):
+            try:
+                os.remove(f)
+                print(f"[DEBUG] Removed file: {f}")
+            except Exception as e:
+                print(f"[DEBUG] Failed to remove {f}: {e}")
 
 
 def delete_verification(rec_id: int) -> None:
     """Delete a single verification by row ID, remove linked files if they exist."""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id_photo, selfie_photo FROM verifications WHERE id=?", (rec_id,))
-    row = cur.fetchone()
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id_photo, selfie_photo FROM verifications WHERE id=?", (rec_id,))
+        row = cur.fetchone()
+        cur.execute("DELETE FROM verifications WHERE id=?", (rec_id,))
+        if row:
+            _release_photo_blobs(conn, (row.get("id_photo"), row.get("selfie_photo")))
 
     if row:
-        for col in ("id_photo", "selfie_photo"):
-            f = row.get(col)
-            if f and os.path.exists(f):
-                try:
-                    os.remove(f)
-                    print(f"[DEBUG] Removed file: {f}")
-                except Exception as e:
-                    print(f"[DEBUG] Failed to remove {f}: {e}")
-
-    cur.execute("DELETE FROM verifications WHERE id=?", (rec_id,))
-    conn.commit()
-    conn.close()
+        _remove_photo_files((row.get("id_photo"), row.get("selfie_photo")))
 
 
 def delete_by_id_number(id_number: str) -> bool:
     """Delete verification(s) by ID number, and prune audit log entries + linked files."""
     print(f"[DEBUG] Attempting to delete ID number: {id_number}")
 
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("SELECT id_photo, selfie_photo FROM verifications WHERE TRIM(id_number) = ?", (id_number.strip(),))
-    rows = cur.fetchall()
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id_photo, selfie_photo FROM verifications WHERE id_number_norm = ?", (id_number.strip(),))
+        rows = cur.fetchall()
+        cur.execute("DELETE FROM verifications WHERE id_number_norm = ?", (id_number.strip(),))
+        deleted_count = cur.rowcount
+        _release_photo_blobs(conn, [p for r in rows for p in (r.get("id_photo"), r.get("selfie_photo"))])
 
     # Delete linked files
     for r in rows:
-        for f in r:
-            if f and os.path.exists(f):
-                try:
-                    os.remove(f)
-                    print(f"[DEBUG] Removed file: {f}")
-                except Exception as e:
-                    print(f"[DEBUG] Failed to remove {f}: {e}")
-
-    cur.execute("DELETE FROM verifications WHERE TRIM(id_number) = ?", (id_number.strip(),))
-    deleted_count = cur.rowcount
-    conn.commit()
-    conn.close()
+        _remove_photo_files((r.get("id_photo"), r.get("selfie_photo")))
     print(f"[DEBUG] Rows deleted from DB: {deleted_count}")
 
-    removed_blocks = _delete_audit_blocks_by_id_number(id_number)
-    print(f"[DEBUG] Removed {removed_blocks} matching audit log blocks.")
+    # Tombstones the ID's audit records (compacted away in the background); deferred import, audit_log imports us
+    import audit_log
+    removed_blocks = audit_log.tombstone(id_number)
+    print(f"[DEBUG] Removed {removed_blocks} matching audit log records.")
     return deleted_count > 0 or removed_blocks > 0
+
+
+# ---------------- Instrumentation ---------------- #
+# Latency and error metrics per query function (see metrics); rebinding the module
+# globals means calls from other modules and from within this one are both timed.
+INSTRUMENTED = (
+    insert_verification, fetch_all_verifications, query_verifications, verifications_after,
+    search_verifications, max_verification_id, iter_verification_chunks, iter_verifications,
+    verification_stats, monthly_counts, rebuild_rollups, data_version, verified_since,
+    enqueue_dov_poll, due_dov_polls, next_dov_poll_at, reschedule_dov_poll, finish_dov_poll, dov_poll_counts,
+    get_bulk_run, load_bulk_run, bulk_items, update_bulk_item, bulk_run_counts, bulk_poll_waits, finish_bulk_run,
+    create_export_job, get_export_job, find_export_job, claim_export_job, update_export_job,
+    requeue_stale_export_jobs, expired_export_jobs, delete_export_jobs,
+    get_ingest_checkpoint, ingest_verifications, duplicate_sessions, delete_duplicate_sessions, register_photo_blob, add_photo_alias,
+    delete_verification, delete_by_id_number,
+)
+for _func in INSTRUMENTED:
+    globals()[_func.__name__] = metrics.instrument(_func)
@@ -0,0 +1,471 @@
+"""Versioned schema migrations for verifications.db, tracked with PRAGMA user_version.
+
+Each migration is applied once, in order, and bumps user_version when it completes.
+Steps are written to be safely re-run, so an interrupted migration (e.g. a killed
+backfill) simply resumes on the next start.
+"""
+import sqlite3
+import time
+
+BACKFILL_CHUNK = 5000
+
+# Epoch seconds of the stored (naive, local) timestamp read as UTC; unparseable -> 0.
+# SQLite's strftime('%s') accepts all formats we have written over time:
+# "YYYY-MM-DD HH:MM:SS", with fractional seconds, and with a "T" separator.
+TS_EPOCH_SQL = "COALESCE(CAST(strftime('%s', {col}) AS INTEGER), 0)"
+
+
+def _columns(conn, table: str) -> set:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _create_verifications(conn) -> None:
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS verifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            client_id TEXT,
+            status TEXT,
+            details TEXT,
+            name TEXT,
+            id_number TEXT,
+            email TEXT,
+            id_photo TEXT,
+            selfie_photo TEXT
+        )
+    """)
+    # Databases created before photos were stored lack these columns
+    existing = _columns(conn, "verifications")
+    for col in ("id_photo", "selfie_photo"):
+        if col not in existing:
+            conn.execute(f"ALTER TABLE verifications ADD COLUMN {col} TEXT")
+            print(f"[DEBUG] Added missing column: {col}")
+    conn.execute("COMMIT")
+
+
+def _add_normalized_columns(conn) -> None:
+    conn.execute("BEGIN IMMEDIATE")
+    existing = _columns(conn, "verifications")
+    if "ts_epoch" not in existing:
+        conn.execute("ALTER TABLE verifications ADD COLUMN ts_epoch INTEGER")
+    if "id_number_norm" not in existing:
+        conn.execute("ALTER TABLE verifications ADD COLUMN id_number_norm TEXT")
+
+    # db_access fills both columns itself; the triggers cover any other writer.
+    ts_new = TS_EPOCH_SQL.format(col="NEW.timestamp")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS verifications_normalize_insert
+        AFTER INSERT ON verifications
+        WHEN NEW.ts_epoch IS NULL OR NEW.id_number_norm IS NOT TRIM(NEW.id_number)
+        BEGIN
+            UPDATE verifications
+            SET ts_epoch = COALESCE(NEW.ts_epoch, {ts_new}), id_number_norm = TRIM(NEW.id_number)
+            WHERE id = NEW.id;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS verifications_normalize_update
+        AFTER UPDATE OF timestamp, id_number ON verifications
+        BEGIN
+            UPDATE verifications
+            SET ts_epoch = {ts_new}, id_number_norm = TRIM(NEW.id_number)
+            WHERE id = NEW.id;
+        END
+    """)
+    conn.execute("COMMIT")
+
+    backfill_normalized_columns(conn)
+
+
+def backfill_normalized_columns(conn, chunk_size: int = BACKFILL_CHUNK, pause: float = 0.0) -> int:
+    """Fill ts_epoch/id_number_norm for existing rows, one short transaction per id range.
+
+    Committing every chunk keeps the write lock for milliseconds at a time, so
+    verification workers and log imports keep running while a large table is backfilled.
+    """
+    ts_col = TS_EPOCH_SQL.format(col="timestamp")
+    updated, last_id = 0, 0
+    while True:
+        row = conn.execute(
+            "SELECT MAX(id) FROM (SELECT id FROM verifications WHERE id > ? ORDER BY id LIMIT ?)",
+            (last_id, chunk_size),
+        ).fetchone()
+        if row[0] is None:
+            break
+        upper = row[0]
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.execute(f"""
+            UPDATE verifications
+            SET ts_epoch = {ts_col}, id_number_norm = TRIM(id_number)
+            WHERE id > ? AND id <= ?
+              AND (ts_epoch IS NULL OR id_number_norm IS NOT TRIM(id_number))
+        """, (last_id, upper))
+        conn.execute("COMMIT")
+        updated += cur.rowcount
+        last_id = upper
+        if pause:
+            time.sleep(pause)
+    if updated:
+        print(f"[DEBUG] Backfilled normalized columns on {updated} rows.")
+    return updated
+
+
+def _create_indexes(conn) -> None:
+    conn.execute("BEGIN IMMEDIATE")
+    # Dashboard default sort and date-range filters
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_verifications_ts ON verifications (ts_epoch DESC, id DESC)")
+    # 90-day re-verification lookup and delete_by_id_number (covering for the lookup)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_verifications_id_number ON verifications (id_number_norm, ts_epoch)")
+    # Status filter, case-insensitive as the dashboard compares it
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_verifications_status ON verifications (status COLLATE NOCASE, ts_epoch, id)")
+    conn.execute("COMMIT")
+
+
+# Rollup key for a verifications row: (day number since epoch, lower-cased status)
+_ROLLUP_KEY = "{ref}.ts_epoch / 86400, LOWER(COALESCE({ref}.status, ''))"
+
+# Remove one row from its rollup bucket; `latest_epoch` is only recomputed
+# (from that day's slice of idx_verifications_ts) when the removed row was the latest.
+_ROLLUP_SUBTRACT = """
+    UPDATE verification_daily
+    SET total = total - 1,
+        latest_epoch = CASE WHEN latest_epoch > OLD.ts_epoch THEN latest_epoch ELSE (
+            SELECT MAX(v.ts_epoch) FROM verifications v
+            WHERE v.ts_epoch >= verification_daily.day * 86400
+              AND v.ts_epoch < (verification_daily.day + 1) * 86400
+              AND LOWER(COALESCE(v.status, '')) = verification_daily.status
+        ) END
+    WHERE day = OLD.ts_epoch / 86400 AND status = LOWER(COALESCE(OLD.status, ''));
+    DELETE FROM verification_daily
+    WHERE day = OLD.ts_epoch / 86400 AND status = LOWER(COALESCE(OLD.status, '')) AND total <= 0;
+"""
+
+_ROLLUP_ADD = f"""
+    INSERT INTO verification_daily (day, status, total, latest_epoch)
+    VALUES ({_ROLLUP_KEY.format(ref="NEW")}, 1, NEW.ts_epoch)
+    ON CONFLICT (day, status) DO UPDATE
+    SET total = total + 1, latest_epoch = MAX(latest_epoch, excluded.latest_epoch);
+"""
+
+
+def rebuild_rollups(conn) -> int:
+    """Recompute verification_daily from scratch; returns the number of buckets."""
+    owns_tx = not conn.in_transaction
+    if owns_tx:
+        conn.execute("BEGIN IMMEDIATE")
+    conn.execute("DELETE FROM verification_daily")
+    conn.execute(f"""
+        INSERT INTO verification_daily (day, status, total, latest_epoch)
+        SELECT {_ROLLUP_KEY.format(ref="verifications")}, COUNT(*), MAX(ts_epoch)
+        FROM verifications
+        WHERE ts_epoch IS NOT NULL
+        GROUP BY 1, 2
+    """)
+    buckets = conn.execute("SELECT COUNT(*) FROM verification_daily").fetchone()[0]
+    if owns_tx:
+        conn.execute("COMMIT")
+    return buckets
+
+
+def _create_daily_rollup(conn) -> None:
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS verification_daily (
+            day INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            latest_epoch INTEGER,
+            PRIMARY KEY (day, status)
+        ) WITHOUT ROWID
+    """)
+    # Rows whose ts_epoch is still NULL are counted once the normalize trigger sets it.
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS verification_daily_insert
+        AFTER INSERT ON verifications
+        WHEN NEW.ts_epoch IS NOT NULL
+        BEGIN {_ROLLUP_ADD} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS verification_daily_delete
+        AFTER DELETE ON verifications
+        WHEN OLD.ts_epoch IS NOT NULL
+        BEGIN {_ROLLUP_SUBTRACT} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS verification_daily_update_old
+        AFTER UPDATE OF ts_epoch, status ON verifications
+        WHEN OLD.ts_epoch IS NOT NULL
+        BEGIN {_ROLLUP_SUBTRACT} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS verification_daily_update_new
+        AFTER UPDATE OF ts_epoch, status ON verifications
+        WHEN NEW.ts_epoch IS NOT NULL
+        BEGIN {_ROLLUP_ADD} END
+    """)
+    rebuild_rollups(conn)
+    conn.execute("COMMIT")
+
+
+def _create_dov_pending(conn) -> None:
+    conn.execute("BEGIN IMMEDIATE")
+    # Enquiries waiting on a DOV result; worked through by dov_poller
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS dov_pending (
+            enquiry_id TEXT PRIMARY KEY,
+            enquiry_result_id TEXT,
+            id_number TEXT,
+            priority INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_poll_at REAL NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            last_error TEXT
+        )
+    """)
+    # Due-poll scan: only pending rows, soonest first
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_dov_pending_due
+        ON dov_pending (next_poll_at, priority) WHERE state = 'pending'
+    """)
+    conn.execute("COMMIT")
+
+
+def _create_bulk_runs(conn) -> None:
+    conn.execute("BEGIN IMMEDIATE")
+    # Checkpoints for bulk_verify: one row per input file, one per input line
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS bulk_runs (
+            run_id TEXT PRIMARY KEY,
+            source TEXT,
+            created_at REAL NOT NULL,
+            loaded INTEGER NOT NULL DEFAULT 0,
+            finished_at REAL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS bulk_items (
+            run_id TEXT NOT NULL,
+            line_no INTEGER NOT NULL,
+            id_number TEXT,
+            cell_number TEXT,
+            reference TEXT,
+            state TEXT NOT NULL DEFAULT 'new',
+            enquiry_id TEXT,
+            enquiry_result_id TEXT,
+            error TEXT,
+            updated_at REAL,
+            PRIMARY KEY (run_id, line_no)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("COMMIT")
+
+
+# Reference counting for content-addressed photos: one count per verifications
+# column that points at the blob. Paths outside photo_blobs match nothing.
+_BLOB_REF = "UPDATE photo_blobs SET refcount = refcount {op} 1 WHERE path = {ref}.{col};"
+
+
+def _create_photo_blobs(conn) -> None:
+    conn.execute("BEGIN IMMEDIATE")
+    # One row per stored photo file under uploads/blobs/ (see photo_store)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS photo_blobs (
+            path TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    # Pre-blob photo paths (uploads/ids/..., uploads/selfies/...) and the blob they moved to
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS photo_aliases (
+            alias TEXT PRIMARY KEY,
+            path TEXT NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_photo_aliases_path ON photo_aliases (path)")
+    add = "".join(_BLOB_REF.format(op="+", ref="NEW", col=c) for c in ("id_photo", "selfie_photo"))
+    sub = "".join(_BLOB_REF.format(op="-", ref="OLD", col=c) for c in ("id_photo", "selfie_photo"))
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS photo_blobs_insert AFTER INSERT ON verifications BEGIN {add} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS photo_blobs_delete AFTER DELETE ON verifications BEGIN {sub} END")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS photo_blobs_update
+        AFTER UPDATE OF id_photo, selfie_photo ON verifications
+        BEGIN {sub} {add} END
+    """)
+    conn.execute("COMMIT")
+
+
+def _create_audit_index(conn) -> None:
+    conn.execute("BEGIN IMMEDIATE")
+    # JSONL segment files of the audit log (see audit_log); the highest unsealed one takes appends
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS audit_segments (
+            segment INTEGER PRIMARY KEY,
+            path TEXT NOT NULL,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            sealed_at REAL,
+            compacted_at REAL
+        )
+    """)
+    # One row per record line; deletes set `deleted` (a tombstone) instead of rewriting the file
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS audit_index (
+            segment INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            id_number TEXT,
+            kind TEXT NOT NULL DEFAULT 'record',
+            deleted INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (segment, offset)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_index_id ON audit_index (id_number, segment, offset)")
+    conn.execute("COMMIT")
+
+
+def _create_ingest_checkpoints(conn) -> None:
+    conn.execute("BEGIN IMMEDIATE")
+    # (timestamp, client_id) is how log ingestion tells sessions apart. Not unique: rows stored
+    # twice before ingestion checked for them are kept (reconcile.py reports them)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_verifications_ts_client ON verifications (timestamp, client_id)")
+    # How far log_to_db has read the audit log: the segment file and byte offset
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+            source TEXT PRIMARY KEY,
+            segment INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    conn.execute("COMMIT")
+
+
+def _create_data_version(conn) -> None:
+    conn.execute("BEGIN IMMEDIATE")
+    # Counters the dashboard derives ETags from; bumped by every write to verifications
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID")
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('data_version', 1)")
+    bump = "UPDATE meta SET value = value + 1 WHERE key = 'data_version';"
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS data_version_{event.lower()} AFTER {event} ON verifications
+            BEGIN {bump} END
+        """)
+    conn.execute("COMMIT")
+
+
+def _create_search_index(conn) -> None:
+    conn.execute("BEGIN IMMEDIATE")
+    # External-content FTS5 index over verifications: only the tokens are stored here.
+    # Prefix indexes make 2- and 3-character prefix queries index lookups too.
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS verifications_fts USING fts5(
+            name, email, id_number,
+            content='verifications', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    old = "INSERT INTO verifications_fts (verifications_fts, rowid, name, email, id_number) " \
+          "VALUES ('delete', old.id, old.name, old.email, old.id_number);"
+    new = "INSERT INTO verifications_fts (rowid, name, email, id_number) " \
+          "VALUES (new.id, new.name, new.email, new.id_number);"
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS verifications_fts_insert AFTER INSERT ON verifications BEGIN {new} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS verifications_fts_delete AFTER DELETE ON verifications BEGIN {old} END")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS verifications_fts_update AFTER UPDATE OF name, email, id_number ON verifications
+        BEGIN {old} {new} END
+    """)
+    conn.execute("INSERT INTO verifications_fts (verifications_fts) VALUES ('rebuild')")
+    conn.execute("COMMIT")
+
+
+def _create_export_jobs(conn) -> None:
+    conn.execute("BEGIN IMMEDIATE")
+    # Background exports (see export_jobs): request, progress and the finished file
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS export_jobs (
+            job_id TEXT PRIMARY KEY,
+            request_key TEXT NOT NULL,
+            format TEXT NOT NULL,
+            filters TEXT NOT NULL,
+            options TEXT NOT NULL DEFAULT '{}',
+            state TEXT NOT NULL DEFAULT 'queued',
+            rows_done INTEGER NOT NULL DEFAULT 0,
+            rows_total INTEGER,
+            path TEXT,
+            bytes INTEGER,
+            error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            updated_at REAL NOT NULL,
+            expires_at REAL
+        )
+    """)
+    # Resubmitting the same export (same filters, same data) reuses the job
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_export_jobs_key ON export_jobs (request_key, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_export_jobs_expiry ON export_jobs (expires_at) WHERE expires_at IS NOT NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_export_jobs_active ON export_jobs (state, updated_at) WHERE state IN ('queued', 'running')")
+    conn.execute("COMMIT")
+
+
+MIGRATIONS = [
+    (1, "create verifications table", _create_verifications),
+    (2, "normalized timestamp and id_number columns", _add_normalized_columns),
+    (3, "indexes for dashboard sort, id_number lookup and status filter", _create_indexes),
+    (4, "daily per-status rollup maintained by triggers", _create_daily_rollup),
+    (5, "dov_pending table for the DOV result poller", _create_dov_pending),
+    (6, "bulk_runs/bulk_items checkpoints for bulk_verify", _create_bulk_runs),
+    (7, "content-addressed photo blobs with reference counts", _create_photo_blobs),
+    (8, "segment and id_number index for the JSONL audit log", _create_audit_index),
+    (9, "(timestamp, client_id) index and audit ingestion checkpoints", _create_ingest_checkpoints),
+    (10, "data_version counter for HTTP ETags", _create_data_version),
+    (11, "FTS5 search index over name, email and id_number", _create_search_index),
+    (12, "export_jobs table for background exports", _create_export_jobs),
+]
+
+
+def current_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_path: str) -> int:
+    """Apply all pending migrations to db_path and return the resulting schema version."""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        version = current_version(conn)
+        for number, description, step in MIGRATIONS:
+            if number <= version:
+                continue
+            print(f"[DEBUG] Applying migration {number}: {description}")
+            try:
+                step(conn)
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            conn.execute(f"PRAGMA user_version = {number}")
+            version = number
+        return version
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    from db_access import DB_FILE
+
+    parser = argparse.ArgumentParser(description="Apply schema migrations to verifications.db")
+    parser.add_argument("--rebuild-rollups", action="store_true", help="recompute verification_daily from scratch")
+    args = parser.parse_args()
+
+    print(f"Schema at version {migrate(DB_FILE)} of {MIGRATIONS[-1][0]}: {DB_FILE}")
+    if args.rebuild_rollups:
+        import db_access
+        print(f"Rebuilt verification_daily: {db_access.rebuild_rollups()} buckets.")
@@ -0,0 +1,167 @@
+"""Central scheduler for DOV result polls.
+
+Enquiries waiting on a facial verification result are kept in the dov_pending
+table (see db_access.enqueue_dov_poll), so they survive restarts. One process
+polls them all: every tick it takes the enquiries due within POLL_WINDOW,
+highest priority first, and polls that batch concurrently over the asyncio XDS
+client. An enquiry without a result is rescheduled with exponential backoff
+plus jitter; one that has a result is stored with insert_verification_with_xml
+and taken off the queue.
+
+    python dov_poller.py                 # run until interrupted
+    python dov_poller.py --once          # poll whatever is due and exit
+    python dov_poller.py --enqueue 12345 --result-id 67890
+    python dov_poller.py --status
+    python dov_poller.py --metrics-port 9101   # also serve /metrics
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Dict
+
+import db_access
+import metrics
+import xds_main
+from xds_async import AsyncXDSClient
+
+logger = logging.getLogger(__name__)
+
+POLL_BATCH = int(os.getenv("DOV_POLL_BATCH", "200"))
+POLL_CONCURRENCY = int(os.getenv("DOV_POLL_CONCURRENCY", "20"))
+# Enquiries due within this many seconds of each other are polled in one batch
+POLL_WINDOW = float(os.getenv("DOV_POLL_WINDOW", "2"))
+BACKOFF_BASE = float(os.getenv("DOV_POLL_BACKOFF_BASE", "10"))
+BACKOFF_MAX = float(os.getenv("DOV_POLL_BACKOFF_MAX", "300"))
+# Give up on an enquiry the consumer has not completed after this long
+MAX_AGE = float(os.getenv("DOV_POLL_MAX_AGE", str(6 * 3600)))
+# Longest idle sleep, so enquiries queued by other processes are picked up promptly
+IDLE_SLEEP = 15.0
+
+
+def backoff_delay(attempts: int) -> float:
+    """Seconds until the next poll after `attempts` empty polls: exponential, capped, half-jittered."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** min(attempts, 16)))
+    return random.uniform(delay / 2, delay)
+
+
+def result_ready(xml: str | None) -> bool:
+    return bool(xml) and "<NoResult>" not in xml
+
+
+def store_result(row: Dict[str, Any], xml: str) -> None:
+    """Insert the verification and retire the enquiry in one transaction, taken once the photos are on disk.
+
+    A malformed result, or one without the consumer's ID number, raises
+    instead: the enquiry stays pending and is polled again.
+    """
+    enquiry_id = row["enquiry_id"]
+    summary, incoming = xds_main.read_dov_result(enquiry_id, xml)
+    if summary.get("ID Number") in (None, "", "N/A"):
+        xds_main.discard_incoming(incoming)
+        raise ValueError("DOV result has no consumer ID number")
+    xds_main.store_verification(enquiry_id, summary, incoming,
+                                finish=lambda: db_access.finish_dov_poll(enquiry_id, "done"))
+    xds_main.log_verification_result(enquiry_id, row.get("enquiry_result_id"), summary, "Success")
+
+
+class DovPoller:
+    def __init__(self, client: AsyncXDSClient | None = None, batch: int = POLL_BATCH):
+        self.client = client or AsyncXDSClient(concurrency=POLL_CONCURRENCY)
+        self.batch = batch
+        self.stats = {"polled": 0, "done": 0, "rescheduled": 0, "expired": 0, "errors": 0}
+
+    async def poll_once(self) -> int:
+        """Poll every enquiry due within POLL_WINDOW (up to one batch); returns how many were polled."""
+        rows = await asyncio.to_thread(db_access.due_dov_polls, time.time() + POLL_WINDOW, self.batch)
+        if rows:
+            await asyncio.gather(*(self._poll(row) for row in rows))
+            self.stats["polled"] += len(rows)
+        return len(rows)
+
+    async def _poll(self, row: Dict[str, Any]) -> None:
+        enquiry_id = row["enquiry_id"]
+        error = None
+        try:
+            xml = await self.client.call(self.client.get_dov_result, enquiry_id)
+        except Exception as e:
+            logger.warning("DOV poll for %s failed: %s", enquiry_id, e)
+            self.stats["errors"] += 1
+            metrics.DOV_POLLS.inc(outcome="error")
+            xml, error = None, str(e)[:500]
+
+        if result_ready(xml):
+            try:
+                await asyncio.to_thread(store_result, row, xml)
+                self.stats["done"] += 1
+                metrics.DOV_POLLS.inc(outcome="result")
+                metrics.DOV_ATTEMPTS.observe(row["attempts"] + 1)
+                metrics.DOV_TIME_TO_RESULT.observe(time.time() - row["created_at"])
+                logger.info("DOV result stored for enquiry %s after %d polls", enquiry_id, row["attempts"] + 1)
+                return
+            except Exception as e:
+                logger.exception("Could not store DOV result for %s", enquiry_id)
+                metrics.DOV_POLLS.inc(outcome="store_error")
+                error = str(e)[:500]
+        elif error is None:
+            metrics.DOV_POLLS.inc(outcome="no_result")
+
+        if time.time() - row["created_at"] > MAX_AGE:
+            await asyncio.to_thread(db_access.finish_dov_poll, enquiry_id, "expired", error)
+            self.stats["expired"] += 1
+            metrics.DOV_POLLS.inc(outcome="expired")
+            logger.info("DOV enquiry %s expired without a result", enquiry_id)
+            return
+        next_at = time.time() + backoff_delay(row["attempts"])
+        await asyncio.to_thread(db_access.reschedule_dov_poll, enquiry_id, next_at, error)
+        self.stats["rescheduled"] += 1
+
+    async def run(self, stop: asyncio.Event | None = None) -> None:
+        """Poll until `stop` is set, sleeping until the next enquiry is due."""
+        stop = stop or asyncio.Event()
+        async with self.client:
+            while not stop.is_set():
+                if await self.poll_once() >= self.batch:
+                    continue
+                due = await asyncio.to_thread(db_access.next_dov_poll_at)
+                wait = IDLE_SLEEP if due is None else min(IDLE_SLEEP, max(0.0, due - time.time()))
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Poll XDS for pending DOV results")
+    parser.add_argument("--once", action="store_true", help="poll whatever is due, then exit")
+    parser.add_argument("--enqueue", metavar="ENQUIRY_ID", help="queue an enquiry for polling")
+    parser.add_argument("--result-id", help="EnquiryResultID for --enqueue")
+    parser.add_argument("--priority", type=int, default=0, help="higher is polled first")
+    parser.add_argument("--status", action="store_true", help="show queue counts by state")
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("DOV_POLLER_METRICS_PORT", "0")),
+                        help="serve Prometheus metrics on this port while running (0: off)")
+    args = parser.parse_args()
+
+    if args.enqueue:
+        db_access.enqueue_dov_poll(args.enqueue, args.result_id, priority=args.priority)
+        print(f"Queued enquiry {args.enqueue}.")
+    elif args.status:
+        for state, n in sorted(db_access.dov_poll_counts().items()):
+            print(f"{state}: {n}")
+    elif args.once:
+        async def _once():
+            poller = DovPoller()
+            async with poller.client:
+                await poller.poll_once()
+            print(poller.stats)
+        asyncio.run(_once())
+    else:
+        if args.metrics_port:
+            metrics.serve(args.metrics_port)
+        try:
+            asyncio.run(DovPoller().run())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,166 @@
+"""Single-pass parsing of DOV result XML.
+
+The consumer summary and both photos are pulled out of a result in one pass
+with expat. Photo text is never held whole: it is base64-decoded as the parser
+hands it over and written straight to the target file, so peak memory is a
+parser buffer rather than several copies of each multi-megabyte photo.
+(ElementTree's iterparse is not enough here: it only exposes an element's
+text once the element has been read completely.)
+"""
+import base64
+import binascii
+import os
+import re
+import threading
+from typing import Dict, IO, Tuple
+from xml.parsers import expat
+
+PHOTO_TAGS = ("ConsumerIDPhoto", "ConsumerCapturedPhoto")
+# Summary label -> ConsumerDetails child, as shown in the audit log and stored in verifications
+SUMMARY_FIELDS = (
+    ("ID Number", "IDNo"),
+    ("Date of Birth", "BirthDate"),
+    ("Gender", "Gender"),
+    ("Marital Status", "MaritalStatusDesc"),
+    ("Contact Number", "CellularNo"),
+    ("Email", "EmailAddress"),
+    ("Address", "ResidentialAddress"),
+    ("Employer", "EmployerDetail"),
+    ("Privacy Status", "PrivacyStatus"),
+    ("Verification Reference", "ReferenceNo"),
+)
+FEED_CHARS = 64 * 1024
+_NON_BASE64 = re.compile(r"[^A-Za-z0-9+/=]")
+
+
+class _Base64File:
+    """Incremental base64 decoder writing to a temp file that replaces `path` on success."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self.fh: IO[bytes] | None = None
+        self.pending = ""
+
+    def write(self, text: str) -> None:
+        data = self.pending + _NON_BASE64.sub("", text)
+        cut = len(data) - len(data) % 4
+        self.pending = data[cut:]
+        if cut:
+            if self.fh is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.fh = open(self.tmp, "wb")
+            self.fh.write(base64.b64decode(data[:cut]))
+
+    def close(self) -> str | None:
+        """Finish the file and return its path, or None if there was no photo data."""
+        if self.pending:
+            self.abort()
+            raise binascii.Error(f"Truncated base64 photo for {self.path}")
+        if self.fh is None:
+            return None
+        self.fh.close()
+        os.replace(self.tmp, self.path)
+        return self.path
+
+    def abort(self) -> None:
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+            if os.path.exists(self.tmp):
+                os.remove(self.tmp)
+
+
+class _DovResultHandler:
+    def __init__(self, photo_paths: Dict[str, str]):
+        self.photo_paths = photo_paths
+        self.depth = 0
+        self.details_depth: int | None = None
+        self.details: Dict[str, str] | None = None
+        self.field: str | None = None
+        self.field_text: list = []
+        self.sink: _Base64File | None = None
+        self.sink_tag: str | None = None
+        self.seen_photos = set()
+        self.photos: Dict[str, str] = {}
+
+    def start(self, name, attrs):
+        self.depth += 1
+        if name == "ConsumerDetails" and self.details is None:
+            # Like find(".//ConsumerDetails"): only the first one counts
+            self.details_depth = self.depth
+            self.details = {}
+        elif self.details_depth is not None and self.depth == self.details_depth + 1:
+            self.field = name
+            self.field_text = []
+        if name in PHOTO_TAGS and name not in self.seen_photos and self.sink is None:
+            self.seen_photos.add(name)
+            if name in self.photo_paths:
+                self.sink = _Base64File(self.photo_paths[name])
+                self.sink_tag = name
+
+    def chars(self, data):
+        if self.sink is not None:
+            self.sink.write(data)
+        elif self.field is not None and self.depth == self.details_depth + 1:
+            self.field_text.append(data)
+
+    def end(self, name):
+        if self.sink is not None and name == self.sink_tag:
+            path = self.sink.close()
+            if path:
+                self.photos[name] = path
+            self.sink = self.sink_tag = None
+        if self.field is not None and self.depth == self.details_depth + 1:
+            self.details.setdefault(self.field, "".join(self.field_text))
+            self.field = None
+        if self.details_depth == self.depth:
+            self.details_depth = None
+        self.depth -= 1
+
+    def abort(self) -> None:
+        if self.sink is not None:
+            self.sink.abort()
+        for path in self.photos.values():
+            if os.path.exists(path):
+                os.remove(path)
+        self.photos = {}
+
+
+def summary_from_details(details: Dict[str, str] | None) -> Dict[str, str]:
+    """The consumer summary dict for parsed ConsumerDetails children ({} if there were none)."""
+    if details is None:
+        return {}
+    summary = {
+        "Name": f"{details.get('FirstName', '')} {details.get('SecondName', '')} {details.get('Surname', '')}".strip(),
+    }
+    for label, tag in SUMMARY_FIELDS:
+        summary[label] = details.get(tag, "N/A")
+    return summary
+
+
+def parse_dov_result(source, photo_paths: Dict[str, str] | None = None) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Parse a DOV result (str, bytes or binary file) in one pass.
+
+    photo_paths maps PHOTO_TAGS to the files their decoded photos should be
+    written to; photos without a target are skipped without being buffered.
+    Returns (summary, {tag: written path}). On malformed XML nothing is kept
+    and expat.ExpatError is raised.
+    """
+    handler = _DovResultHandler(photo_paths or {})
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.chars
+    try:
+        if hasattr(source, "read"):
+            parser.ParseFile(source)
+        else:
+            for i in range(0, len(source), FEED_CHARS):
+                parser.Parse(source[i:i + FEED_CHARS], False)
+            parser.Parse("", True)
+    except (expat.ExpatError, binascii.Error, OSError):
+        handler.abort()
+        raise
+    return summary_from_details(handler.details), handler.photos
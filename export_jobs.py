@@ -0,0 +1,240 @@
+"""Background export jobs.
+
+Exports are submitted as jobs and built by a worker pool, so a large PDF or
+XLSX no longer ties up a web worker. Each job is a row in export_jobs with its
+filters, progress (rows done out of the filtered total) and, when done, the
+file under exports/. The dashboard polls the status and downloads the file.
+
+Submitting the same export again while the data is unchanged returns the
+existing job instead of building it twice. Finished files are kept for
+EXPORT_TTL and then removed, together with their rows, by cleanup(), which
+runs in the background every CLEANUP_INTERVAL while jobs are being
+submitted. A job whose worker died (no progress for STALE_AFTER) is queued
+again the next time a pool starts.
+
+    python export_jobs.py --submit pdf --status Failed --year 2025
+    python export_jobs.py --cleanup
+"""
+import hashlib
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Dict
+
+import db_access
+import exports
+import metrics
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.path.join(db_access.DATA_DIR, "exports")
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+# Finished files are downloadable for this long
+EXPORT_TTL = float(os.getenv("EXPORT_TTL", str(24 * 3600)))
+# Failed jobs stay visible, with their error, for this long
+FAILED_TTL = 3600.0
+# Progress is written at most this often (seconds)
+PROGRESS_INTERVAL = 1.0
+# A running job with no progress for this long has lost its worker
+STALE_AFTER = 600.0
+CLEANUP_INTERVAL = 300.0
+
+# format -> (file extension, MIME type)
+FORMATS = {
+    "csv": ("csv", "text/csv"),
+    "ndjson": ("ndjson", "application/x-ndjson"),
+    "xlsx": ("xlsx", exports.XLSX_MIME),
+    "pdf": ("pdf", "application/pdf"),
+}
+
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+_last_cleanup = 0.0
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    """The process's worker pool; starting it also picks up jobs orphaned by a dead worker."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export-job")
+            for job_id in db_access.requeue_stale_export_jobs(time.time() - STALE_AFTER):
+                logger.info("Re-queued stale export job %s", job_id)
+                _pool.submit(run_job, job_id)
+        return _pool
+
+
+def _request_key(fmt: str, filters: Dict[str, Any], options: Dict[str, Any]) -> str:
+    key = json.dumps([fmt, filters, options, db_access.data_version()], sort_keys=True, default=str)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def file_path(job: Dict[str, Any]) -> str | None:
+    return os.path.join(db_access.DATA_DIR, job["path"]) if job.get("path") else None
+
+
+def submit(fmt: str, filters: Dict[str, Any], options: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """Queue an export (or find the same one already queued or built); returns its job row."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    options = options or {}
+    pool = _get_pool()
+    maybe_cleanup()
+    key = _request_key(fmt, filters, options)
+    job = db_access.find_export_job(key, time.time())
+    if job and (job["state"] != "done" or os.path.exists(file_path(job))):
+        return job
+    job_id = secrets.token_hex(16)
+    db_access.create_export_job(job_id, key, fmt, json.dumps(filters, sort_keys=True), json.dumps(options, sort_keys=True))
+    pool.submit(run_job, job_id)
+    return db_access.get_export_job(job_id)
+
+
+class _Progress:
+    """exports progress callback that writes rows_done to the job at most every PROGRESS_INTERVAL."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.done = 0
+        self._written_at = 0.0
+
+    def __call__(self, done: int) -> None:
+        self.done = done
+        now = time.monotonic()
+        if now - self._written_at >= PROGRESS_INTERVAL:
+            self._written_at = now
+            db_access.update_export_job(self.job_id, rows_done=done)
+
+
+def _write(fmt: str, filters: Dict[str, Any], options: Dict[str, Any], out: BinaryIO, progress: _Progress) -> None:
+    if fmt in ("csv", "ndjson"):
+        chunks = exports.iter_csv if fmt == "csv" else exports.iter_ndjson
+        for chunk in chunks(filters, progress=progress):
+            out.write(chunk.encode("utf-8"))
+    elif fmt == "xlsx":
+        exports.write_xlsx(filters, images=options.get("images", "embed"), base_url=options.get("base_url", ""),
+                           output=out, progress=progress)
+    else:
+        exports.write_pdf(filters, output=out, progress=progress)
+
+
+def run_job(job_id: str) -> None:
+    """Build one job's file; does nothing if another worker has already claimed it."""
+    if not db_access.claim_export_job(job_id):
+        return
+    job = db_access.get_export_job(job_id)
+    fmt = job["format"]
+    filters, options = json.loads(job["filters"]), json.loads(job["options"])
+    rel = f"exports/{job_id}.{FORMATS[fmt][0]}"
+    path = os.path.join(db_access.DATA_DIR, rel)
+    # Unique temp name: a re-queued job may briefly be built twice
+    tmp = f"{path}.{secrets.token_hex(4)}.tmp"
+    progress = _Progress(job_id)
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    with metrics.timed(metrics.EXPORT_JOB_SECONDS, format=fmt):
+        try:
+            db_access.update_export_job(job_id, rows_total=db_access.verification_stats(filters)["total"])
+            with open(tmp, "wb") as out:
+                _write(fmt, filters, options, out, progress)
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.exception("Export job %s (%s) failed", job_id, fmt)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            now = time.time()
+            db_access.update_export_job(job_id, state="failed", error=str(e)[:500], rows_done=progress.done,
+                                        finished_at=now, expires_at=now + FAILED_TTL)
+            metrics.EXPORT_JOBS.inc(format=fmt, outcome="failed")
+            return
+    now = time.time()
+    db_access.update_export_job(job_id, state="done", rows_done=progress.done, path=rel, bytes=os.path.getsize(path),
+                                finished_at=now, expires_at=now + EXPORT_TTL)
+    metrics.EXPORT_JOBS.inc(format=fmt, outcome="done")
+    logger.info("Export job %s (%s) done: %d rows", job_id, fmt, progress.done)
+
+
+def cleanup(now: float | None = None) -> Dict[str, int]:
+    """Remove expired jobs and their files, and files under exports/ that no job owns."""
+    now = time.time() if now is None else now
+    expired = db_access.expired_export_jobs(now)
+    removed_files = 0
+    for job in expired:
+        if job["path"] and os.path.exists(file_path(job)):
+            os.remove(file_path(job))
+            removed_files += 1
+    removed_jobs = db_access.delete_export_jobs([job["job_id"] for job in expired])
+    if os.path.isdir(EXPORT_DIR):
+        owned = db_access.export_job_paths()
+        with os.scandir(EXPORT_DIR) as it:
+            for entry in it:
+                # Leftover temp files and files whose row is gone; recent ones may still be in use
+                rel = f"exports/{entry.name}"
+                if rel not in owned and entry.stat().st_mtime < now - STALE_AFTER:
+                    os.remove(entry.path)
+                    removed_files += 1
+    return {"jobs": removed_jobs, "files": removed_files}
+
+
+def _cleanup_in_background() -> None:
+    try:
+        result = cleanup()
+        if result["jobs"] or result["files"]:
+            logger.info("Removed %d expired export jobs and %d files", result["jobs"], result["files"])
+    except Exception:
+        logger.exception("Export cleanup failed")
+
+
+def maybe_cleanup() -> None:
+    """Run cleanup on the worker pool if it has not run for CLEANUP_INTERVAL."""
+    global _last_cleanup
+    now = time.monotonic()
+    if now - _last_cleanup >= CLEANUP_INTERVAL:
+        _last_cleanup = now
+        _get_pool().submit(_cleanup_in_background)
+
+
+def describe(job: Dict[str, Any]) -> Dict[str, Any]:
+    """The public view of a job, for the status endpoint."""
+    total = job["rows_total"]
+    return {
+        "job_id": job["job_id"],
+        "format": job["format"],
+        "state": job["state"],
+        "rows_done": job["rows_done"],
+        "rows_total": total,
+        "percent": round(100.0 * job["rows_done"] / total, 1) if total else (100.0 if job["state"] == "done" else 0.0),
+        "bytes": job["bytes"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "finished_at": job["finished_at"],
+        "expires_at": job["expires_at"],
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run or clean up background exports")
+    parser.add_argument("--submit", choices=sorted(FORMATS), help="build an export now and print its file")
+    parser.add_argument("--status", default="all")
+    parser.add_argument("--name", default="")
+    parser.add_argument("--year", type=int, default=0)
+    parser.add_argument("--month", type=int, default=0)
+    parser.add_argument("--images", default="link", choices=("embed", "link", "none"), help="XLSX photo cells")
+    parser.add_argument("--cleanup", action="store_true", help="remove expired jobs and their files")
+    args = parser.parse_args()
+
+    if args.submit:
+        filters = {"status": args.status, "name": args.name, "year": args.year, "month": args.month}
+        submitted = submit(args.submit, filters, {"images": args.images} if args.submit == "xlsx" else {})
+        _get_pool().shutdown(wait=True)
+        result = db_access.get_export_job(submitted["job_id"])
+        print(json.dumps(describe(result), indent=2))
+        if result["state"] == "done":
+            print(file_path(result))
+    if args.cleanup:
+        print(cleanup())
@@ -0,0 +1,345 @@
+"""Export generators for verifications.
+
+Each export walks the filtered verifications with db_access.iter_verifications,
+which pages through the table with a keyset cursor, and yields output in
+chunks so the web tier can stream it without holding the result set. An
+optional `progress` callback is given the number of rows written so far
+(export_jobs records it).
+"""
+import csv
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List
+
+import xlsxwriter
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas as rl_canvas
+
+import db_access
+import photos
+
+EXPORT_HEADERS = ["Timestamp", "Client ID", "Status", "Name", "ID Number", "Email", "ID Photo", "Selfie Photo"]
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# Exports stay in RAM up to this size, then spill to a temp file
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+STREAM_BLOCK = 64 * 1024
+# XLSX photo cells: row height in points and thumbnail scale to fit it
+XLSX_PHOTO_ROW_HEIGHT = 60
+XLSX_THUMB_SCALE = 0.8
+# PDF layout: a text line plus an 80x60pt photo box per row, fixed pitch so that
+# every page holds the same number of rows and chunks can be rendered independently
+PDF_TOP_MARGIN = 40
+PDF_TITLE_HEIGHT = 30
+PDF_BOTTOM_MARGIN = 80
+PDF_ROW_PITCH = 15 + 60 + 10
+PDF_ROWS_PER_PAGE = (int(letter[1]) - PDF_TOP_MARGIN - PDF_TITLE_HEIGHT - PDF_BOTTOM_MARGIN) // PDF_ROW_PITCH
+PDF_PAGES_PER_CHUNK = 20
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "0")) or os.cpu_count() or 1
+Progress = Callable[[int], None] | None
+NDJSON_FIELDS = ["id", "timestamp", "client_id", "status", "details", "name", "id_number", "email", "id_photo", "selfie_photo"]
+
+
+def export_row(v: Dict[str, Any]) -> List[Any]:
+    """The values of one verification in EXPORT_HEADERS order."""
+    return [
+        v.get("timestamp") or "",
+        v.get("client_id") or "",
+        v.get("status") or "",
+        v.get("name") or "",
+        v.get("id_number") or "",
+        v.get("email") or "",
+        v.get("id_photo") or "",
+        v.get("selfie_photo") or "",
+    ]
+
+
+def iter_csv(filters: Dict[str, Any] | None = None, chunk_size: int = db_access.EXPORT_CHUNK,
+             progress: Progress = None) -> Iterator[str]:
+    """Yield the CSV export as text chunks of roughly chunk_size rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADERS)
+    done = 0
+    for rows in db_access.iter_verification_chunks(filters, chunk_size):
+        for v in rows:
+            writer.writerow(export_row(v))
+        done += len(rows)
+        if progress:
+            progress(done)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson(filters: Dict[str, Any] | None = None, chunk_size: int = db_access.EXPORT_CHUNK,
+                progress: Progress = None) -> Iterator[str]:
+    """Yield one JSON object per line, chunk_size rows at a time."""
+    done = 0
+    for rows in db_access.iter_verification_chunks(filters, chunk_size):
+        yield "".join(json.dumps({k: v.get(k) for k in NDJSON_FIELDS}, ensure_ascii=False) + "\n" for v in rows)
+        done += len(rows)
+        if progress:
+            progress(done)
+
+
+def iter_file(fh: BinaryIO, block_size: int = STREAM_BLOCK) -> Iterator[bytes]:
+    """Stream an open file from its start in blocks, closing it when done."""
+    try:
+        fh.seek(0)
+        while True:
+            block = fh.read(block_size)
+            if not block:
+                return
+            yield block
+    finally:
+        fh.close()
+
+
+def write_xlsx(filters: Dict[str, Any] | None = None, images: str = "embed", base_url: str = "",
+               output: BinaryIO | None = None, progress: Progress = None) -> BinaryIO:
+    """Build the XLSX export into output (default: a spooled temp file) and return it.
+
+    The worksheet is written in xlsxwriter's constant_memory mode (rows are
+    flushed as they are written), and photos are embedded as cached
+    thumbnails. images="link" writes HYPERLINK formulas to the originals
+    instead, and images="none" leaves the photo columns as stored paths.
+    """
+    output = output or tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
+    worksheet = workbook.add_worksheet("Verifications")
+    worksheet.set_column(0, 5, 18)
+    worksheet.set_column(6, 7, 14)
+
+    for col, h in enumerate(EXPORT_HEADERS):
+        worksheet.write(0, col, h)
+
+    row = 0
+    for v in db_access.iter_verifications(filters):
+        row += 1
+        values = export_row(v)
+        photo_cells = []
+        for col, path in ((6, v.get("id_photo")), (7, v.get("selfie_photo"))):
+            if images == "embed" and path:
+                thumb = photos.ensure_variant(path, "thumb")
+                if thumb:
+                    photo_cells.append((col, thumb))
+        # constant_memory requires the row format before any cell in the row
+        if photo_cells:
+            worksheet.set_row(row, XLSX_PHOTO_ROW_HEIGHT)
+
+        for col, value in enumerate(values[:6]):
+            worksheet.write_string(row, col, str(value))
+        for col, path in ((6, v.get("id_photo")), (7, v.get("selfie_photo"))):
+            if not path:
+                continue
+            if images == "link":
+                # Formulas avoid Excel's 65,530 hyperlinks-per-sheet limit
+                url = f"{base_url.rstrip('/')}/{path}".replace('"', '""')
+                label = "ID Photo" if col == 6 else "Selfie Photo"
+                worksheet.write_formula(row, col, f'=HYPERLINK("{url}","{label}")', None, label)
+            elif images != "embed":
+                worksheet.write_string(row, col, path)
+        for col, thumb in photo_cells:
+            worksheet.insert_image(row, col, thumb, {"x_scale": XLSX_THUMB_SCALE, "y_scale": XLSX_THUMB_SCALE})
+        if progress and row % db_access.EXPORT_CHUNK == 0:
+            progress(row)
+
+    if progress:
+        progress(row)
+    workbook.close()
+    output.seek(0)
+    return output
+
+
+# ---------------- PDF ---------------- #
+
+_pdf_pool: ProcessPoolExecutor | None = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    """Shared worker pool for PDF chunks; spawned (not forked) since the web tier is threaded."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+
+def _pdf_line(v: Dict[str, Any]) -> str:
+    return (f"{v.get('timestamp') or ''} | {v.get('client_id') or ''} | {v.get('status') or ''} | "
+            f"{v.get('name') or ''} | {v.get('id_number') or ''} | {v.get('email') or ''}")
+
+
+def render_pdf_chunk(rows: List[Dict[str, Any]], with_title: bool = False) -> bytes:
+    """Render rows (each {"line", "id_photo", "selfie_photo"}) to standalone PDF pages.
+
+    Runs in a worker process; photos are drawn from the pre-scaled "print" variant.
+    """
+    output = io.BytesIO()
+    c = rl_canvas.Canvas(output, pagesize=letter)
+    height = letter[1]
+
+    y = height - PDF_TOP_MARGIN
+    if with_title:
+        c.setFont("Helvetica-Bold", 12)
+        c.drawString(30, y, "Verification Report")
+    y -= PDF_TITLE_HEIGHT
+    c.setFont("Helvetica", 9)
+
+    for i, v in enumerate(rows):
+        if i and i % PDF_ROWS_PER_PAGE == 0:
+            c.showPage()
+            y = height - PDF_TOP_MARGIN - PDF_TITLE_HEIGHT
+            c.setFont("Helvetica", 9)
+        c.drawString(30, y, v["line"])
+        for x, key, label in ((50, "id_photo", "ID Photo"), (150, "selfie_photo", "Selfie Photo")):
+            img_path = photos.ensure_variant(v.get(key), "print") if v.get(key) else None
+            if img_path:
+                try:
+                    c.drawImage(img_path, x, y - 75, width=80, height=60, preserveAspectRatio=True, mask="auto")
+                except Exception as e:
+                    c.drawString(x, y - 15, f"[Could not render {label}: {e}]")
+        y -= PDF_ROW_PITCH
+
+    c.save()
+    return output.getvalue()
+
+
+def _pdf_chunks(filters: Dict[str, Any] | None) -> Iterator[List[Dict[str, Any]]]:
+    chunk_rows = PDF_ROWS_PER_PAGE * PDF_PAGES_PER_CHUNK
+    chunk: List[Dict[str, Any]] = []
+    for v in db_access.iter_verifications(filters):
+        chunk.append({"line": _pdf_line(v), "id_photo": v.get("id_photo"), "selfie_photo": v.get("selfie_photo")})
+        if len(chunk) == chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _PdfConcat:
+    """Concatenates standalone PDFs into one, writing each page's objects to output as it is appended.
+
+    Objects are renumbered into the output as they are reached from a page;
+    only their offsets and the page ids are kept, and the page tree, xref table
+    and trailer are written by close().
+    """
+    CATALOG, PAGES = 1, 2
+
+    def __init__(self, output: BinaryIO):
+        self.output = output
+        self.pos = 0
+        self.offsets: List[int] = [0, 0, 0]
+        self.page_ids: List[int] = []
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data: bytes) -> None:
+        self.output.write(data)
+        self.pos += len(data)
+
+    def _object(self, number: int, obj) -> None:
+        buf = io.BytesIO()
+        buf.write(b"%d 0 obj\n" % number)
+        obj.write_to_stream(buf)
+        buf.write(b"\nendobj\n")
+        self.offsets[number] = self.pos
+        self._write(buf.getvalue())
+
+    def append(self, pdf: bytes) -> None:
+        reader = PdfReader(io.BytesIO(pdf))
+        numbers: Dict[tuple, int] = {}
+        queue: List[IndirectObject] = []
+
+        def ref(indirect: IndirectObject) -> IndirectObject:
+            if indirect.pdf is None:
+                # Already renumbered, in a direct object shared between pages
+                return indirect
+            key = (indirect.idnum, indirect.generation)
+            if key not in numbers:
+                self.offsets.append(0)
+                numbers[key] = len(self.offsets) - 1
+                queue.append(indirect)
+            return IndirectObject(numbers[key], 0, None)
+
+        def renumber(obj) -> None:
+            # dict.items/list indexing: DictionaryObject.__getitem__ would resolve the references
+            items = dict.items(obj) if isinstance(obj, DictionaryObject) else enumerate(obj)
+            for k, v in list(items):
+                if isinstance(v, IndirectObject):
+                    obj[k] = ref(v)
+                elif isinstance(v, (DictionaryObject, ArrayObject)):
+                    renumber(v)
+
+        # reader.pages are copies with inherited attributes (Resources, MediaBox) filled in: write those
+        pages = {}
+        for page in reader.pages:
+            page[NameObject("/Parent")] = IndirectObject(self.PAGES, 0, None)
+            pages[page.indirect_reference.idnum] = page
+            self.page_ids.append(ref(page.indirect_reference).idnum)
+        while queue:
+            indirect = queue.pop()
+            obj = pages[indirect.idnum] if indirect.idnum in pages else indirect.get_object()
+            renumber(obj)
+            self._object(numbers[(indirect.idnum, indirect.generation)], obj)
+
+    def close(self) -> None:
+        kids = ArrayObject(IndirectObject(n, 0, None) for n in self.page_ids)
+        self._object(self.PAGES, DictionaryObject({NameObject("/Type"): NameObject("/Pages"), NameObject("/Kids"): kids,
+                                                   NameObject("/Count"): NumberObject(len(kids))}))
+        self._object(self.CATALOG, DictionaryObject({NameObject("/Type"): NameObject("/Catalog"),
+                                                     NameObject("/Pages"): IndirectObject(self.PAGES, 0, None)}))
+        xref = self.pos
+        lines = [b"xref\n0 %d\n0000000000 65535 f \n" % len(self.offsets)]
+        lines += [b"%010d 00000 n \n" % offset for offset in self.offsets[1:]]
+        lines.append(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                     % (len(self.offsets), self.CATALOG, xref))
+        self._write(b"".join(lines))
+
+
+def write_pdf(filters: Dict[str, Any] | None = None, output: BinaryIO | None = None,
+              progress: Progress = None) -> BinaryIO:
+    """Build the PDF report into output (default: a spooled temp file) and return it.
+
+    Rows are cut into page-aligned chunks that are rendered in parallel by a
+    process pool and written to output in order as they finish. At most two
+    chunks per worker are in flight, so memory stays flat however large the
+    report is: besides those, only an offset per PDF object is kept.
+    """
+    pool = _get_pdf_pool()
+    output = output or tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    writer = _PdfConcat(output)
+    pending: deque = deque()
+    first = True
+    done = 0
+
+    def append_next():
+        nonlocal done
+        future, rows = pending.popleft()
+        writer.append(future.result())
+        done += rows
+        if progress:
+            progress(done)
+
+    for chunk in _pdf_chunks(filters):
+        pending.append((pool.submit(render_pdf_chunk, chunk, first), len(chunk)))
+        first = False
+        if len(pending) >= 2 * PDF_WORKERS:
+            append_next()
+    while pending:
+        append_next()
+    if first:
+        writer.append(render_pdf_chunk([], True))
+    writer.close()
+    output.seek(0)
+    return output
@@ -0,0 +1,168 @@
+"""HTTP caching and compression for the dashboard app.
+
+Photos: blobs are named by their content hash, and so are their variants, so
+they are served with a year-long immutable Cache-Control; other uploads get a
+day. Flask's send_file already answers conditional and Range requests.
+
+Pages and exports: @conditional gives a response an ETag built from the
+data_version counter (bumped by triggers on every write to verifications),
+the request's normalized parameters and a token for the templates and code.
+A matching If-None-Match is answered 304 before any query runs, so a refresh
+with no new data costs one single-row read.
+
+HTML and JSON bodies are compressed with brotli when it is installed and the
+client accepts it, else gzip. Rendered bodies and their compressed forms are
+kept in response_cache under their ETag, so a view another client already
+loaded is served without running it again.
+"""
+import glob
+import gzip
+import hashlib
+import json
+import os
+from functools import wraps
+
+from flask import Response, make_response, request
+
+import db_access
+import response_cache
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only
+    brotli = None
+
+IMMUTABLE_MAX_AGE = 365 * 86400
+PHOTO_MAX_AGE = 86400
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_TYPES = ("text/html", "application/json")
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Compressed representations get their own ETag: "<tag>-br" / "<tag>-gz"
+ENCODING_SUFFIXES = {"br": "-br", "gzip": "-gz"}
+
+
+def _build_token() -> str:
+    """Changes whenever the templates or the code that renders pages and exports does."""
+    base = db_access.BASE_DIR
+    files = sorted(glob.glob(os.path.join(base, "templates", "*")) + glob.glob(os.path.join(base, "*.py")))
+    digest = hashlib.sha1()
+    for path in files:
+        st = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{st.st_mtime_ns}:{st.st_size};".encode())
+    return digest.hexdigest()[:12]
+
+
+BUILD_TOKEN = _build_token()
+
+
+def data_etag(*parts, version: int | None = None) -> str:
+    version = db_access.data_version() if version is None else version
+    key = json.dumps([version, BUILD_TOKEN, *parts], sort_keys=True, default=str)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:24]
+
+
+def _matching_tag(etag: str) -> str | None:
+    """The tag (plain or per-encoding) the client already holds, if any."""
+    inm = request.if_none_match
+    for tag in (etag, *(etag + suffix for suffix in ENCODING_SUFFIXES.values())):
+        if inm.contains(tag):
+            return tag
+    return etag if inm.star_tag else None
+
+
+def conditional(key_fn=None):
+    """Decorate a view so it carries a data-version ETag and answers 304 when it still matches.
+
+    key_fn returns what identifies the response besides the path (normalized
+    filters, page cursor, ...); by default, the sorted query arguments.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = key_fn() if key_fn else sorted(request.args.items(multi=True))
+            version = db_access.data_version()
+            etag = data_etag(request.path, key, version=version)
+            held = _matching_tag(etag)
+            cached = None if held else response_cache.memory.get(("pages", etag), version)
+            if held:
+                response = Response(status=304)
+                etag = held
+            elif cached is not None:
+                # Another client already rendered this exact view of this data
+                body, headers = cached
+                response = Response(body, headers=headers)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if not (response.is_streamed or response.direct_passthrough):
+                    headers = [(k, v) for k, v in response.headers if k not in ("Content-Length", "ETag")]
+                    response_cache.memory.put(("pages", etag), version, (response.get_data(), headers),
+                                              len(response.get_data()))
+            response.set_etag(etag)
+            # Always revalidate; the 304 is what makes that cheap
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return wrapper
+    return decorator
+
+
+def is_immutable_upload(filename: str) -> bool:
+    """Blob paths (and variants of them) are content-addressed, so never change."""
+    parts = filename.split("/")
+    if parts[0] == "variants":
+        parts = parts[2:]
+    return len(parts) > 1 and parts[0] == "blobs" and parts[1] != "incoming"
+
+
+def cache_upload(response: Response, filename: str) -> Response:
+    if response.status_code in (200, 206, 304):
+        response.cache_control.no_cache = None
+        if is_immutable_upload(filename):
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.max_age = PHOTO_MAX_AGE
+    return response
+
+
+def _choose_encoding() -> str | None:
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress(response: Response) -> Response:
+    """after_request hook: compress buffered HTML/JSON responses the client can decode."""
+    response.vary.add("Accept-Encoding")
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers or response.mimetype not in COMPRESS_TYPES):
+        return response
+    body = response.get_data()
+    encoding = _choose_encoding() if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding is None:
+        return response
+    etag, weak = response.get_etag()
+    # The ETag pins the exact body, so its compressed form can be reused as is
+    compressed = response_cache.memory.get(("compressed", etag, encoding), None) if etag else None
+    if compressed is None:
+        if encoding == "br":
+            compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+        else:
+            compressed = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+        if etag:
+            response_cache.memory.put(("compressed", etag, encoding), None, compressed)
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    if etag:
+        response.set_etag(etag + ENCODING_SUFFIXES[encoding], weak=weak)
+    return response
+
+
+def init_app(app) -> None:
+    app.after_request(compress)
@@ -0,0 +1,89 @@
+"""Change notification for the live dashboard.
+
+Writes can come from any process (the poller, bulk runs, log ingestion), so
+there is nothing to subscribe to in SQLite itself. Instead one thread per
+process watches db_access.data_version() (a single-row read) every
+WATCH_INTERVAL and wakes the waiting server-sent-event streams when it moves.
+However many dashboards are open, the database sees one tiny query per
+interval plus one delta query per stream per actual change.
+"""
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator
+
+import db_access
+
+WATCH_INTERVAL = 0.5
+# Comment lines keep proxies from closing an idle stream
+HEARTBEAT_SECONDS = 15.0
+# Tell EventSource how long to wait before reconnecting (ms)
+RETRY_MS = 2000
+
+
+class VersionWatcher:
+    def __init__(self, interval: float = WATCH_INTERVAL):
+        self.interval = interval
+        self.version = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self.version = db_access.data_version()
+                self._thread = threading.Thread(target=self._run, name="live-feed-watcher", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                version = db_access.data_version()
+            except Exception:
+                continue
+            if version != self.version:
+                with self._cond:
+                    self.version = version
+                    self._cond.notify_all()
+
+    def wait_for_change(self, seen: int | None, timeout: float) -> int:
+        """Block until data_version differs from `seen` (or timeout); returns the current version."""
+        self._ensure_started()
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != seen, timeout)
+            return self.version
+
+
+watcher = VersionWatcher()
+
+
+def sse_event(data: Dict[str, Any], event: str, event_id: Any = None) -> str:
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(data, separators=(",", ":")))
+    return "\n".join(lines) + "\n\n"
+
+
+def stream(delta: Callable[[int], Dict[str, Any]], after: int) -> Iterator[str]:
+    """SSE stream of delta(after) payloads, one per change; delta returns rows, last_id and has_more."""
+    yield f"retry: {RETRY_MS}\n\n"
+    seen = watcher.wait_for_change(None, 0)
+    last_beat = time.monotonic()
+    while True:
+        version = watcher.wait_for_change(seen, HEARTBEAT_SECONDS)
+        if version == seen:
+            if time.monotonic() - last_beat >= HEARTBEAT_SECONDS:
+                last_beat = time.monotonic()
+                yield ": keep-alive\n\n"
+            continue
+        seen = version
+        while True:
+            payload = delta(after)
+            after = payload["last_id"]
+            yield sse_event(payload, "verifications", after)
+            if not payload["has_more"]:
+                break
+        last_beat = time.monotonic()
@@ -1,23 +1,27 @@
+"""Ingest audit log records into the verifications table.
+
+Reads the audit log segments (see audit_log) from a checkpoint of segment and
+byte offset, so each run parses only what was appended since the last one.
+Sessions go in in batches of INGEST_BATCH, one transaction each, together
+with the advanced checkpoint; sessions already stored (same timestamp,
+client_id and ID number, an index lookup) are skipped, and tombstoned records
+are never read.
+
+    python log_to_db.py              # catch up and exit
+    python log_to_db.py --follow     # keep tailing new records
+"""
+import json
+import os
+import time
+
+import audit_log
 import db_access
 
-DB_FILE = "verifications.db"
-LOG_FILE = "dov_audit_log.txt"
-
-
-def ensure_db_columns():
-    """Ensure id_photo and selfie_photo columns exist in verifications table."""
-    conn = db_access.get_conn()
-    c = conn.cursor()
-    c.execute("PRAGMA table_info(verifications)")
-    existing_cols = [row[1] for row in c.fetchall()]
-
-    if "id_photo" not in existing_cols:
-        c.execute("ALTER TABLE verifications ADD COLUMN id_photo TEXT;")
-    if "selfie_photo" not in existing_cols:
-        c.execute("ALTER TABLE verifications ADD COLUMN selfie_photo TEXT;")
-
-    conn.commit()
-    conn.close()
+DB_FILE = db_access.DB_FILE
+LOG_FILE = db_access.LOG_FILE
+CHECKPOINT = "audit_log"
+INGEST_BATCH = 5000
+FOLLOW_INTERVAL = 0.5
 
 
 def parse_session_block(block):
@@ -73,52 +77,166 @@ def insert_into_db(session):
     )
 
 
-def retrofill_photos():
-    """Update old DB records with photos from the log if missing."""
-    logs = db_access.fetch_all_verifications()
-    with open(LOG_FILE, "r", encoding="utf-8") as f:
-        blocks = f.read().split("--- Verification Session ---")
-
-    updated_count = 0
-    for block in blocks:
-        if "Timestamp:" in block and "ClientID:" in block:
-            session = parse_session_block(block)
-            for log in logs:
-                if log['timestamp'] == session['timestamp'] and log['client_id'] == session['client_id']:
-                    new_id_photo = log['id_photo'] or session['id_photo']
-                    new_selfie_photo = log['selfie_photo'] or session['selfie_photo']
-                    if new_id_photo != log['id_photo'] or new_selfie_photo != log['selfie_photo']:
-                        conn = db_access.get_conn()
-                        cur = conn.cursor()
-                        cur.execute("""
-                            UPDATE verifications
-                            SET id_photo=?, selfie_photo=?
-                            WHERE timestamp=? AND client_id=?
-                        """, (new_id_photo, new_selfie_photo, log['timestamp'], log['client_id']))
-                        conn.commit()
-                        conn.close()
-                        updated_count += 1
-
-    print(f"Retrofill complete. Updated {updated_count} records.")
-
-
-def process_log_file():
-    """Insert new log sessions into DB using db_access."""
-    with open(LOG_FILE, "r", encoding="utf-8") as f:
-        content = f.read()
-    blocks = content.split("--- Verification Session ---")
-    for block in blocks:
-        if "Timestamp:" in block and "ClientID:" in block:
-            session = parse_session_block(block)
-            # Check if already exists
-            exists = any(log['timestamp'] == session['timestamp'] and log['client_id'] == session['client_id']
-                         for log in db_access.fetch_all_verifications())
-            if not exists:
-                insert_into_db(session)
+_MISSING_PHOTO = """
+    ((COALESCE(verifications.id_photo, '') = '' AND a.id_photo IS NOT NULL)
+     OR (COALESCE(verifications.selfie_photo, '') = '' AND a.selfie_photo IS NOT NULL))
+"""
+
+
+def retrofill_photos(apply=True):
+    """Fill missing photo paths from the audit log with one joined UPDATE; returns rows updated (or to update).
+
+    The audit sessions' photos are loaded into a temp table keyed like the
+    (timestamp, client_id) index, so the join is index lookups.
+    """
+    conn = db_access.get_conn()
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS audit_photos (
+            timestamp TEXT, client_id TEXT, id_photo TEXT, selfie_photo TEXT,
+            PRIMARY KEY (timestamp, client_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("DELETE FROM temp.audit_photos")
+
+    def photo_rows(sessions):
+        return [(s["timestamp"], s["client_id"], db_access.resolve_photo_path(s["id_photo"]),
+                 db_access.resolve_photo_path(s["selfie_photo"])) for s in sessions if s["id_photo"] or s["selfie_photo"]]
+
+    audit_log.ensure_legacy_imported()
+    for sessions in iter_sessions():
+        conn.executemany("INSERT OR REPLACE INTO temp.audit_photos VALUES (?, ?, ?, ?)", photo_rows(sessions))
+
+    if not apply:
+        return conn.execute(f"""
+            SELECT COUNT(*) AS n FROM verifications
+            JOIN temp.audit_photos a ON a.timestamp = verifications.timestamp AND a.client_id = verifications.client_id
+            WHERE {_MISSING_PHOTO}
+        """).fetchone()["n"]
+    with db_access.transaction() as tx:
+        updated = tx.execute(f"""
+            UPDATE verifications
+            SET id_photo = COALESCE(NULLIF(verifications.id_photo, ''), a.id_photo),
+                selfie_photo = COALESCE(NULLIF(verifications.selfie_photo, ''), a.selfie_photo)
+            FROM temp.audit_photos a
+            WHERE a.timestamp = verifications.timestamp AND a.client_id = verifications.client_id AND {_MISSING_PHOTO}
+        """).rowcount
+    return updated
+
+
+def session_from_record(record):
+    """Verification columns for an audit record, or None if it is not an ingestible session."""
+    if record.get("kind") == "tombstone":
+        return None
+    if record.get("legacy"):
+        session = parse_session_block(record.get("text", ""))
+    else:
+        summary = record.get("summary") or {}
+        session = {
+            "timestamp": record.get("timestamp"),
+            "client_id": record.get("client_id") or record.get("enquiry_id"),
+            "status": record.get("status"),
+            "details": summary.get("Details"),
+            "name": summary.get("Name"),
+            "id_number": record.get("id_number") or summary.get("ID Number"),
+            "email": summary.get("Email"),
+            "id_photo": summary.get("ConsumerIDPhoto"),
+            "selfie_photo": summary.get("ConsumerCapturedPhoto"),
+        }
+    return session if session["timestamp"] and session["client_id"] else None
+
+
+def _segments_from(checkpoint):
+    """(segment, path, committed bytes, start offset) for each segment still to read."""
+    segments = db_access.get_conn().execute("""
+        SELECT segment, path, bytes FROM audit_segments WHERE segment >= ? ORDER BY segment
+    """, (checkpoint["segment"] if checkpoint else 0,)).fetchall()
+    for seg in segments:
+        start = 0
+        # A compacted segment has a new path and offsets; re-read it, duplicates are ignored
+        if checkpoint and seg["segment"] == checkpoint["segment"] and seg["path"] == checkpoint["path"]:
+            start = checkpoint["offset"]
+        yield seg["segment"], seg["path"], seg["bytes"], start
+
+
+def read_segment(segment, path, start, end, batch_size=INGEST_BATCH):
+    """Yield (offset after the batch, sessions) for each batch of live records in [start, end) of a segment.
+
+    Reads only indexed, live lines: tombstoned records and uncommitted tails are
+    skipped. Stops early if the segment is compacted away under us.
+    """
+    conn = db_access.get_conn()
+    with open(os.path.join(db_access.DATA_DIR, path), "rb") as f:
+        while True:
+            rows = conn.execute("""
+                SELECT i.offset, i.length FROM audit_index i JOIN audit_segments s USING (segment)
+                WHERE i.segment = ? AND s.path = ? AND i.offset >= ? AND i.offset < ?
+                  AND i.kind = 'record' AND i.deleted = 0
+                ORDER BY i.offset LIMIT ?
+            """, (segment, path, start, end, batch_size)).fetchall()
+            if not rows:
+                return
+            f.seek(rows[0]["offset"])
+            block = f.read(rows[-1]["offset"] + rows[-1]["length"] - rows[0]["offset"])
+            sessions = []
+            for r in rows:
+                pos = r["offset"] - rows[0]["offset"]
+                session = session_from_record(json.loads(block[pos:pos + r["length"]]))
+                if session:
+                    sessions.append(session)
+            start = rows[-1]["offset"] + rows[-1]["length"]
+            yield start, sessions
+
+
+def iter_sessions(batch_size=INGEST_BATCH):
+    """Every live session in the audit log, in batches (a full read, no checkpoint)."""
+    for segment, path, committed, start in _segments_from(None):
+        for _, sessions in read_segment(segment, path, start, committed, batch_size):
+            yield sessions
+
+
+def ingest_new(batch_size=INGEST_BATCH):
+    """Ingest everything appended since the checkpoint; returns (records read, rows inserted)."""
+    read = inserted = 0
+    audit_log.ensure_legacy_imported()
+    for segment, path, committed, start in _segments_from(db_access.get_ingest_checkpoint(CHECKPOINT)):
+        if start >= committed:
+            continue
+        for start, sessions in read_segment(segment, path, start, committed, batch_size):
+            inserted += db_access.ingest_verifications(sessions, CHECKPOINT, segment, path, start)
+            read += len(sessions)
+        if start < committed:
+            db_access.ingest_verifications([], CHECKPOINT, segment, path, committed)
+    return read, inserted
+
+
+def follow(interval=FOLLOW_INTERVAL):
+    """Tail the audit log until interrupted."""
+    while True:
+        try:
+            read, inserted = ingest_new()
+        except FileNotFoundError:
+            # Segment compacted between listing and opening it
+            continue
+        if read:
+            print(f"Ingested {inserted} new verifications from {read} audit records.")
+        else:
+            time.sleep(interval)
 
 
 if __name__ == "__main__":
-    ensure_db_columns()
-    process_log_file()
-    retrofill_photos()
-    print("Log processing complete. Data inserted and retrofilled.")
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ingest the audit log into the verifications table")
+    parser.add_argument("--follow", action="store_true", help="keep tailing the audit log")
+    args = parser.parse_args()
+
+    if args.follow:
+        try:
+            follow()
+        except KeyboardInterrupt:
+            pass
+    else:
+        started = time.perf_counter()
+        read, inserted = ingest_new()
+        print(f"Ingested {inserted} new verifications from {read} audit records in {time.perf_counter() - started:.1f}s.")
+        print(f"Retrofill complete. Updated {retrofill_photos()} records.")
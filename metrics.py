@@ -0,0 +1,247 @@
+"""Latency histograms and counters, exposed in the Prometheus text format.
+
+Instrumented:
+
+  xds_request_seconds / xds_request_errors_total        per SOAP operation, sync and async clients
+  db_query_seconds / db_query_errors_total              per db_access function
+  http_request_seconds / http_requests_total            per dashboard route (streamed bodies included)
+  dov_polls_total, dov_poll_attempts, dov_time_to_result_seconds   DOV result polling
+  export_job_seconds / export_jobs_total                background exports per format
+  response_cache_requests_total                         response cache hits and misses
+
+Metrics live in the process that records them: the dashboard serves its own
+at /metrics, and `dov_poller.py --metrics-port` serves the poller's. Recording
+is a bisect and a few additions under a lock, cheap enough for every query.
+"""
+import bisect
+import functools
+import inspect
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+# Seconds; spans a cached SQLite read up to a slow XDS call
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+ATTEMPT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34)
+RESULT_BUCKETS = (10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> Tuple:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines += [line for key, value in items for line in self._samples(key, value)]
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self, key, value):
+        yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        self._observe(self._key(labels), value)
+
+    def _observe(self, key: Tuple, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def _samples(self, key, state):
+        counts, total, n = state
+        running = 0
+        for bound, c in zip((*self.buckets, "+Inf"), counts):
+            running += c
+            le = 'le="+Inf"' if bound == "+Inf" else f'le="{_number(bound)}"'
+            yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {running}"
+        yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+        yield f"{self.name}_count{_labels(self.labelnames, key)} {n}"
+
+
+REGISTRY: List[_Metric] = []
+
+
+def counter(name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+    metric = Counter(name, help_text, labelnames)
+    REGISTRY.append(metric)
+    return metric
+
+
+def histogram(name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+    metric = Histogram(name, help_text, labelnames, buckets)
+    REGISTRY.append(metric)
+    return metric
+
+
+XDS_SECONDS = histogram("xds_request_seconds", "XDS SOAP call latency", ("operation",))
+XDS_ERRORS = counter("xds_request_errors_total", "XDS SOAP calls that raised", ("operation", "error"))
+DB_SECONDS = histogram("db_query_seconds", "db_access call latency", ("function",))
+DB_ERRORS = counter("db_query_errors_total", "db_access calls that raised", ("function", "error"))
+HTTP_SECONDS = histogram("http_request_seconds", "Dashboard request latency, until the body is sent", ("endpoint",))
+HTTP_REQUESTS = counter("http_requests_total", "Dashboard requests by response status", ("endpoint", "status"))
+DOV_POLLS = counter("dov_polls_total", "DOV result polls by outcome", ("outcome",))
+DOV_ATTEMPTS = histogram("dov_poll_attempts", "Polls an enquiry needed before its result", buckets=ATTEMPT_BUCKETS)
+DOV_TIME_TO_RESULT = histogram("dov_time_to_result_seconds", "Time from queueing an enquiry to storing its result",
+                               buckets=RESULT_BUCKETS)
+EXPORT_JOB_SECONDS = histogram("export_job_seconds", "Time to build a background export", ("format",))
+EXPORT_JOBS = counter("export_jobs_total", "Background exports by outcome", ("format", "outcome"))
+CACHE_REQUESTS = counter("response_cache_requests_total", "Response cache lookups", ("cache", "result"))
+
+
+@contextmanager
+def timed(hist: Histogram, errors: Counter | None = None, **labels):
+    """Observe the block's duration in hist (failures included); count failures in errors by exception type."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        if errors is not None and not isinstance(e, GeneratorExit):
+            errors.inc(error=type(e).__name__, **labels)
+        raise
+    finally:
+        hist.observe(time.perf_counter() - started, **labels)
+
+
+def instrument(func, hist: Histogram = DB_SECONDS, errors: Counter | None = DB_ERRORS, label: str = "function"):
+    """Wrap func so every call is timed under its name; generator functions are timed until exhausted."""
+    labels = {label: func.__name__}
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def gen_wrapper(*args, **kwargs):
+            with timed(hist, errors, **labels):
+                yield from func(*args, **kwargs)
+        return gen_wrapper
+
+    # Hot path (every query): no context manager, label key computed once
+    key = hist._key(labels)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if errors is not None:
+                errors.inc(error=type(e).__name__, **labels)
+            raise
+        finally:
+            hist._observe(key, time.perf_counter() - started)
+    return wrapper
+
+
+_SOAP_OPERATION = re.compile(r"<(?:\w+:)?Body>\s*<(?:\w+:)?(\w+)")
+
+
+def soap_operation(body: str) -> str:
+    """Operation name from an envelope: the first element inside the SOAP Body (e.g. "Login")."""
+    match = _SOAP_OPERATION.search(body)
+    return match.group(1) if match else "unknown"
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# ---------------- Flask ---------------- #
+
+def init_app(app) -> None:
+    """Time every request until its body has been sent (call_on_close), so streamed exports count in full."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record(response):
+        started = g.pop("metrics_started", None)
+        endpoint = request.endpoint or "unmatched"
+        HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+        # Event streams stay open for as long as the page does; their duration says nothing
+        if started is not None and response.mimetype != "text/event-stream":
+            response.call_on_close(lambda: HTTP_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint))
+        return response
+
+
+# ---------------- standalone exporter ---------------- #
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve /metrics from a daemon thread, for processes without a web app (e.g. the DOV poller)."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+    return server
@@ -0,0 +1,179 @@
+"""Content-addressed storage for DOV photos.
+
+Each distinct photo is stored once, named by the SHA-256 of its bytes, in a
+two-level sharded tree: uploads/blobs/ab/cd/abcd....jpg. The photo_blobs table
+counts how many verification columns point at each blob (kept up to date by
+triggers), and deletes only unlink blobs whose count drops to zero. Repeat
+verifications of the same person therefore add a reference, not a file.
+
+Photos stored before blobs existed are moved in with `--migrate`, which also
+repoints the verifications at the blobs; their old paths are kept in
+photo_aliases so db_access.resolve_photo_path still resolves them when they
+come back in (e.g. paths recorded in the audit log).
+
+    python photo_store.py --migrate
+    python photo_store.py --stats
+"""
+import hashlib
+import logging
+import os
+import shutil
+import threading
+
+import db_access
+import photos
+
+logger = logging.getLogger(__name__)
+
+BLOBS_DIR = os.path.join(db_access.DATA_DIR, db_access.BLOB_PREFIX)
+# Freshly decoded photos wait here until they are hashed into the store
+INCOMING_DIR = os.path.join(BLOBS_DIR, "incoming")
+HASH_BLOCK = 1024 * 1024
+BLOB_EXT = ".jpg"
+
+
+def blob_rel_path(digest: str) -> str:
+    """Stored path for a SHA-256 hex digest, relative to the data directory."""
+    return f"{db_access.BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{BLOB_EXT}"
+
+
+def incoming_path(name: str) -> str:
+    """A temp location under the store for a photo about to be passed to store_file()."""
+    return os.path.join(INCOMING_DIR, f"{os.getpid()}.{threading.get_ident()}.{name}")
+
+
+def hash_file(path: str) -> tuple:
+    """(SHA-256 hex digest, size) of a file; pass it to store_file to keep the hashing out of a transaction."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+def _place(src: str, dst: str) -> None:
+    """Hard-link src to dst (copying across filesystems); src itself is left in place."""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def store_file(src: str, keep_source: bool = False, hashed: tuple | None = None) -> str:
+    """Add the file at src to the store and return its blob path.
+
+    An identical photo already in the store is reused. The blob row is written
+    in the current transaction (or its own), so storing and inserting the
+    verification that references it can be made atomic by the caller. Callers
+    inside a transaction pass hashed=hash_file(src), computed before it began:
+    then all that runs under the write lock is a hard link and the blob row.
+    """
+    digest, size = hashed or hash_file(src)
+    rel = blob_rel_path(digest)
+    dst = os.path.join(db_access.DATA_DIR, rel)
+    with db_access.transaction():
+        if not os.path.exists(dst):
+            _place(src, dst)
+        db_access.register_photo_blob(rel, digest, size)
+    if not keep_source:
+        os.remove(src)
+    return rel
+
+
+# ---------------- migration of pre-blob photos ---------------- #
+
+def _legacy_originals():
+    """Photo files under uploads/ that are neither blobs nor cached variants."""
+    for root, dirs, files in os.walk(photos.UPLOADS_DIR):
+        if root == photos.UPLOADS_DIR:
+            dirs[:] = [d for d in dirs if d not in ("blobs", "variants")]
+        for name in files:
+            if name.lower().endswith((".jpg", ".jpeg", ".png")):
+                yield os.path.join(root, name)
+
+
+def _migrate_file(src: str, aliases) -> str:
+    rel_src = os.path.relpath(src, db_access.DATA_DIR).replace(os.sep, "/")
+    with db_access.transaction():
+        rel = store_file(src, keep_source=True)
+        for alias in {rel_src, *aliases}:
+            db_access.add_photo_alias(alias, rel)
+    # Only once the aliases are committed is the old copy dropped
+    os.remove(src)
+    return rel
+
+
+def migrate_existing(chunk_size: int = db_access.EXPORT_CHUNK) -> dict:
+    """Move every pre-blob photo into the store and repoint verifications at the blobs."""
+    counts = {"files": 0, "rows": 0}
+    conn = db_access.get_conn()
+
+    # Referenced photos first, so each stored spelling of a path becomes an alias
+    stored = conn.execute("""
+        SELECT id_photo AS p FROM verifications WHERE id_photo IS NOT NULL AND id_photo NOT LIKE 'uploads/blobs/%'
+        UNION
+        SELECT selfie_photo FROM verifications WHERE selfie_photo IS NOT NULL AND selfie_photo NOT LIKE 'uploads/blobs/%'
+    """).fetchall()
+    for row in stored:
+        rel = db_access.resolve_photo_path(row["p"])
+        if rel.startswith(db_access.BLOB_PREFIX):
+            continue
+        src = photos.source_path(rel)
+        if src:
+            _migrate_file(src, {rel})
+            counts["files"] += 1
+
+    for src in list(_legacy_originals()):
+        _migrate_file(src, ())
+        counts["files"] += 1
+
+    # Repoint rows; the photo_blobs triggers count the new references
+    last_id = 0
+    while True:
+        rows = conn.execute("""
+            SELECT id, id_photo, selfie_photo FROM verifications
+            WHERE id > ? AND (id_photo NOT LIKE 'uploads/blobs/%' OR selfie_photo NOT LIKE 'uploads/blobs/%')
+            ORDER BY id LIMIT ?
+        """, (last_id, chunk_size)).fetchall()
+        if not rows:
+            break
+        with db_access.transaction() as tx:
+            for r in rows:
+                id_photo = db_access.resolve_photo_path(r["id_photo"])
+                selfie_photo = db_access.resolve_photo_path(r["selfie_photo"])
+                if (id_photo, selfie_photo) != (r["id_photo"], r["selfie_photo"]):
+                    tx.execute("UPDATE verifications SET id_photo = ?, selfie_photo = ? WHERE id = ?",
+                               (id_photo, selfie_photo, r["id"]))
+                    counts["rows"] += 1
+        last_id = rows[-1]["id"]
+    return counts
+
+
+def store_stats() -> dict:
+    row = db_access.get_conn().execute("""
+        SELECT COUNT(*) AS blobs, COALESCE(SUM(size), 0) AS bytes, COALESCE(SUM(refcount), 0) AS refs
+        FROM photo_blobs
+    """).fetchone()
+    return row
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Content-addressed photo store maintenance")
+    parser.add_argument("--migrate", action="store_true", help="move pre-blob photos into uploads/blobs/")
+    parser.add_argument("--stats", action="store_true", help="show blob count, size and references")
+    args = parser.parse_args()
+    if args.migrate:
+        result = migrate_existing()
+        print(f"Moved {result['files']} photos into the store; repointed {result['rows']} verifications.")
+    elif args.stats:
+        stats = store_stats()
+        print(f"{stats['blobs']} blobs, {stats['bytes']} bytes, {stats['refs']} references")
+    else:
+        parser.print_help()
@@ -0,0 +1,138 @@
+"""Scaled-down variants of stored DOV photos.
+
+Variants are cached next to the originals under uploads/variants/<variant>/,
+mirroring the original's path below uploads/, and regenerated when the
+original is newer than the cached copy. The dashboard variants are built in a
+background pool as soon as a photo is saved; the others are built on first use.
+"""
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+import db_access
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_DIR = os.path.join(db_access.DATA_DIR, "uploads")
+VARIANTS_DIR = os.path.join(UPLOADS_DIR, "variants")
+
+# Bounding boxes in pixels; aspect ratio is preserved
+VARIANT_SIZES = {
+    # dashboard table cells and XLSX exports
+    "thumb": (96, 96),
+    # click-through view on the dashboard
+    "web": (640, 640),
+    # the PDF report's 80x60pt photo box at 2x for print
+    "print": (160, 120),
+}
+INGEST_VARIANTS = ("thumb", "web")
+JPEG_QUALITY = 80
+# Pillow releases the GIL while decoding/resizing, so threads scale across cores
+DERIVATIVE_WORKERS = int(os.getenv("PHOTO_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+
+_pool = ThreadPoolExecutor(max_workers=DERIVATIVE_WORKERS, thread_name_prefix="photo-derivatives")
+
+
+def source_path(stored_path: str | None) -> str | None:
+    """Absolute path of a stored photo on disk, or None if it is missing."""
+    rel = db_access.normalize_path(stored_path)
+    if not rel:
+        return None
+    full_path = os.path.join(db_access.DATA_DIR, rel)
+    if os.path.exists(full_path):
+        return full_path
+    # Legacy rows may point at a file that only exists flat in uploads/
+    flat = os.path.join(UPLOADS_DIR, os.path.basename(rel))
+    return flat if os.path.exists(flat) else None
+
+
+def variant_file(src: str, variant: str) -> str:
+    rel = os.path.relpath(src, UPLOADS_DIR)
+    return os.path.join(VARIANTS_DIR, variant, os.path.splitext(rel)[0] + ".jpg")
+
+
+def ensure_variant(stored_path: str | None, variant: str = "thumb") -> str | None:
+    """Absolute path of the cached variant, generating it if needed; None if there is no source."""
+    src = source_path(stored_path)
+    if not src:
+        return None
+    dst = variant_file(src, variant)
+    try:
+        if os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src):
+            return dst
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        size = VARIANT_SIZES[variant]
+        with Image.open(src) as img:
+            # Let the JPEG decoder downscale while decoding; much cheaper than a full decode
+            img.draft("RGB", size)
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            img.thumbnail(size, Image.LANCZOS)
+            tmp = f"{dst}.{os.getpid()}.tmp"
+            img.save(tmp, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        os.replace(tmp, dst)
+        return dst
+    except Exception:
+        logger.exception("Failed to build %s variant of %s", variant, src)
+        return None
+
+
+def generate_derivatives(stored_path: str | None) -> int:
+    """Build all ingest-time variants of one photo; returns how many exist afterwards."""
+    return sum(1 for variant in INGEST_VARIANTS if ensure_variant(stored_path, variant))
+
+
+def submit_derivatives(stored_path: str | None) -> Future:
+    """Queue generate_derivatives() on the background pool."""
+    return _pool.submit(generate_derivatives, stored_path)
+
+
+def photo_url(stored_path: str | None, variant: str = "thumb") -> str:
+    """Browser URL for a photo, preferring the given variant when it has been built.
+
+    Falls back to the original (and queues the variant) so pages never show a
+    broken image while a derivative is still pending.
+    """
+    src = source_path(stored_path)
+    if not src:
+        rel = db_access.normalize_path(stored_path)
+        return f"/{rel}" if rel else ""
+    target = src
+    dst = variant_file(src, variant)
+    if os.path.exists(dst):
+        target = dst
+    elif variant in INGEST_VARIANTS:
+        submit_derivatives(stored_path)
+    return "/" + os.path.relpath(target, db_access.DATA_DIR).replace(os.sep, "/")
+
+
+def _iter_originals():
+    for root, dirs, files in os.walk(UPLOADS_DIR):
+        if root == UPLOADS_DIR and "variants" in dirs:
+            dirs.remove("variants")
+        if root == os.path.join(UPLOADS_DIR, "blobs") and "incoming" in dirs:
+            dirs.remove("incoming")
+        for name in files:
+            if name.lower().endswith((".jpg", ".jpeg", ".png")):
+                yield os.path.relpath(os.path.join(root, name), db_access.DATA_DIR)
+
+
+def backfill() -> int:
+    """Build missing ingest variants for every photo already under uploads/."""
+    futures = [submit_derivatives(path) for path in _iter_originals()]
+    for f in futures:
+        f.result()
+    return len(futures)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Photo variant maintenance")
+    parser.add_argument("--backfill", action="store_true", help="build thumb/web variants for existing uploads")
+    args = parser.parse_args()
+    if args.backfill:
+        print(f"Processed {backfill()} photos.")
+    else:
+        parser.print_help()
@@ -0,0 +1,234 @@
+"""Reconcile the database, uploads/ and the audit log.
+
+Checks, reported by default and fixed with --apply:
+
+  retrofill        rows missing a photo path that the audit log recorded
+                   (one joined UPDATE, see log_to_db.retrofill_photos)
+  orphan_blobs     files under uploads/blobs/ with no referenced photo_blobs row
+  missing_blobs    photo_blobs rows whose file is gone (unreferenced rows are dropped)
+  orphan_originals pre-blob photos under uploads/ that no verification points at
+  orphan_variants  cached variants whose original is gone
+  stale_incoming   decoded photos left in uploads/blobs/incoming/ by a crash
+  dangling_refs    verification photo columns pointing at a missing file (set to NULL)
+  duplicate_sessions  rows repeating an earlier row's timestamp, client_id and ID number, e.g.
+                   a log ingested twice before ingestion skipped known sessions (the first is kept)
+
+uploads/ is walked with os.scandir on a thread pool and loaded into a temp
+table, so every check is a set query rather than a per-file lookup. Files
+younger than GRACE_SECONDS are left alone: they may belong to a store that
+has not committed yet.
+
+    python reconcile.py              # dry run: report only
+    python reconcile.py --apply
+"""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List
+
+import db_access
+import log_to_db
+import photos
+
+SCAN_WORKERS = int(os.getenv("RECONCILE_WORKERS", "0")) or min(16, (os.cpu_count() or 1) * 4)
+SCAN_BATCH = 10_000
+GRACE_SECONDS = 3600
+SAMPLE = 10
+
+BLOBS = db_access.BLOB_PREFIX
+INCOMING = BLOBS + "incoming/"
+VARIANTS = "uploads/variants/"
+
+
+# ---------------- parallel uploads/ scan ---------------- #
+
+def _scan_dir(path: str):
+    files, dirs = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                files.append((entry.path, st.st_mtime))
+    return files, dirs
+
+
+def scan_uploads(root: str = photos.UPLOADS_DIR, workers: int = SCAN_WORKERS) -> Iterator[List[tuple]]:
+    """Yield batches of (path relative to the data directory, mtime) for every file under root."""
+    if not os.path.isdir(root):
+        return
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reconcile-scan") as pool:
+        pending = {pool.submit(_scan_dir, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                files, dirs = fut.result()
+                pending |= {pool.submit(_scan_dir, d) for d in dirs}
+                if files:
+                    yield [(os.path.relpath(p, db_access.DATA_DIR).replace(os.sep, "/"), m) for p, m in files]
+
+
+def _kind_and_stem(rel: str) -> tuple:
+    """Classify a file and give the key that ties a variant to its original (path without extension)."""
+    if rel.startswith(INCOMING):
+        return "incoming", None
+    if rel.startswith(BLOBS):
+        return "blob", os.path.splitext(rel)[0]
+    if rel.startswith(VARIANTS):
+        # uploads/variants/<variant>/<path below uploads/ without extension>.jpg
+        rest = rel[len(VARIANTS):].split("/", 1)
+        return "variant", "uploads/" + os.path.splitext(rest[1])[0] if len(rest) == 2 else None
+    if not rel.lower().endswith((".jpg", ".jpeg", ".png")):
+        return "other", None
+    return "original", os.path.splitext(rel)[0]
+
+
+def load_files(conn) -> int:
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS fs_files (
+            path TEXT PRIMARY KEY, kind TEXT NOT NULL, stem TEXT, mtime REAL
+        ) WITHOUT ROWID
+    """)
+    conn.execute("DELETE FROM temp.fs_files")
+    conn.execute("CREATE INDEX IF NOT EXISTS temp.idx_fs_files_stem ON fs_files (stem)")
+    total, rows = 0, []
+    for batch in scan_uploads():
+        rows.extend((rel, *_kind_and_stem(rel), mtime) for rel, mtime in batch)
+        if len(rows) >= SCAN_BATCH:
+            conn.executemany("INSERT OR REPLACE INTO temp.fs_files VALUES (?, ?, ?, ?)", rows)
+            total += len(rows)
+            rows = []
+    conn.executemany("INSERT OR REPLACE INTO temp.fs_files VALUES (?, ?, ?, ?)", rows)
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS photo_refs (path TEXT PRIMARY KEY) WITHOUT ROWID
+    """)
+    conn.execute("DELETE FROM temp.photo_refs")
+    conn.execute("""
+        INSERT OR IGNORE INTO temp.photo_refs
+        SELECT id_photo FROM verifications WHERE id_photo IS NOT NULL AND id_photo <> ''
+        UNION SELECT selfie_photo FROM verifications WHERE selfie_photo IS NOT NULL AND selfie_photo <> ''
+    """)
+    return total + len(rows)
+
+
+# ---------------- checks ---------------- #
+
+def _orphan_file_queries(cutoff: float) -> Dict[str, tuple]:
+    return {
+        "orphan_blobs": ("""
+            SELECT f.path FROM temp.fs_files f LEFT JOIN photo_blobs b ON b.path = f.path
+            WHERE f.kind = 'blob' AND f.mtime < ? AND COALESCE(b.refcount, 0) <= 0
+        """, (cutoff,)),
+        "orphan_originals": ("""
+            SELECT f.path FROM temp.fs_files f
+            WHERE f.kind = 'original' AND f.mtime < ?
+              AND NOT EXISTS (SELECT 1 FROM temp.photo_refs r WHERE r.path = f.path)
+        """, (cutoff,)),
+        "orphan_variants": ("""
+            SELECT f.path FROM temp.fs_files f
+            WHERE f.kind = 'variant' AND f.mtime < ?
+              AND NOT EXISTS (SELECT 1 FROM temp.fs_files o WHERE o.stem = f.stem AND o.kind IN ('original', 'blob'))
+        """, (cutoff,)),
+        "stale_incoming": ("SELECT path FROM temp.fs_files WHERE kind = 'incoming' AND mtime < ?", (cutoff,)),
+    }
+
+
+def _legacy_flat_names(conn) -> set:
+    # photos.source_path falls back to uploads/<basename> for old rows
+    names = set()
+    for r in conn.execute(f"SELECT path FROM temp.photo_refs WHERE path NOT LIKE '{BLOBS}%'"):
+        names.add(os.path.basename(r["path"]))
+    return names
+
+
+def find_problems(conn, cutoff: float) -> Dict[str, List[str]]:
+    found = {}
+    for name, (sql, params) in _orphan_file_queries(cutoff).items():
+        found[name] = [r["path"] for r in conn.execute(sql, params)]
+    flat = _legacy_flat_names(conn)
+    found["orphan_originals"] = [p for p in found["orphan_originals"]
+                                 if not (p.count("/") == 1 and os.path.basename(p) in flat)]
+    found["missing_blobs"] = [r["path"] for r in conn.execute("""
+        SELECT b.path FROM photo_blobs b WHERE NOT EXISTS (SELECT 1 FROM temp.fs_files f WHERE f.path = b.path)
+    """)]
+    dangling = [r["path"] for r in conn.execute("""
+        SELECT r.path FROM temp.photo_refs r WHERE NOT EXISTS (SELECT 1 FROM temp.fs_files f WHERE f.path = r.path)
+    """)]
+    found["dangling_refs"] = [p for p in dangling if p.startswith(BLOBS) or not photos.source_path(p)]
+    found["duplicate_sessions"] = [f"id {r['id']}: {r['timestamp']} {r['client_id']} (repeats id {r['keep_id']})"
+                                   for r in db_access.duplicate_sessions()]
+    return found
+
+
+# ---------------- fixes ---------------- #
+
+def _remove(rel_paths: List[str]) -> int:
+    removed = 0
+    for rel in rel_paths:
+        try:
+            os.remove(os.path.join(db_access.DATA_DIR, rel))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def apply_fixes(found: Dict[str, List[str]]) -> Dict[str, int]:
+    fixed = {}
+    # Blobs: re-check the count inside a transaction so a concurrent store keeps its file
+    with db_access.transaction() as tx:
+        blobs = [p for p in found["orphan_blobs"] if (tx.execute(
+            "SELECT refcount FROM photo_blobs WHERE path = ?", (p,)).fetchone() or {"refcount": 0})["refcount"] <= 0]
+        tx.executemany("DELETE FROM photo_blobs WHERE path = ? AND refcount <= 0", [(p,) for p in blobs])
+        fixed["orphan_blobs"] = _remove(blobs)
+        fixed["missing_blobs"] = tx.executemany(
+            "DELETE FROM photo_blobs WHERE path = ? AND refcount <= 0", [(p,) for p in found["missing_blobs"]]
+        ).rowcount
+        # Setting the column to NULL also releases the blob reference via the photo_blobs triggers
+        refs = [(p,) for p in found["dangling_refs"]]
+        fixed["dangling_refs"] = tx.executemany(
+            "UPDATE verifications SET id_photo = NULL WHERE id_photo = ?", refs).rowcount
+        fixed["dangling_refs"] += tx.executemany(
+            "UPDATE verifications SET selfie_photo = NULL WHERE selfie_photo = ?", refs).rowcount
+    for name in ("orphan_originals", "orphan_variants", "stale_incoming"):
+        fixed[name] = _remove(found[name])
+    fixed["duplicate_sessions"] = db_access.delete_duplicate_sessions() if found["duplicate_sessions"] else 0
+    return fixed
+
+
+def reconcile(apply: bool = False, grace: float = GRACE_SECONDS) -> Dict[str, object]:
+    conn = db_access.get_conn()
+    started = time.perf_counter()
+    report = {"retrofill": log_to_db.retrofill_photos(apply=apply)}
+    report["files_scanned"] = load_files(conn)
+    report["scan_seconds"] = round(time.perf_counter() - started, 2)
+    found = find_problems(conn, time.time() - grace)
+    report["found"] = found
+    if apply:
+        report["fixed"] = apply_fixes(found)
+    conn.execute("DROP TABLE IF EXISTS temp.fs_files")
+    conn.execute("DROP TABLE IF EXISTS temp.photo_refs")
+    report["seconds"] = round(time.perf_counter() - started, 2)
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Reconcile verifications, uploads/ and the audit log")
+    parser.add_argument("--apply", action="store_true", help="fix what is found (default: report only)")
+    parser.add_argument("--grace", type=float, default=GRACE_SECONDS, help="ignore files younger than this (seconds)")
+    parser.add_argument("--verbose", action="store_true", help="list every path, not just a sample")
+    args = parser.parse_args()
+
+    result = reconcile(args.apply, args.grace)
+    verb = "Retrofilled" if args.apply else "Would retrofill"
+    print(f"{verb} photos on {result['retrofill']} rows; scanned {result['files_scanned']} files "
+          f"in {result['scan_seconds']}s")
+    for name, paths in result["found"].items():
+        fixed = f", fixed {result['fixed'][name]}" if args.apply else ""
+        print(f"{name}: {len(paths)}{fixed}")
+        for p in paths if args.verbose else paths[:SAMPLE]:
+            print(f"  {p}")
+    print(f"Done in {result['seconds']}s{'' if args.apply else ' (dry run; --apply to fix)'}")
@@ -0,0 +1,249 @@
+"""LRU caches keyed on the data version, for pages, aggregates and export files.
+
+Every entry is tagged with db_access.data_version(), which triggers bump on
+every insert, update and delete of a verification. The first lookup that
+sees a newer version drops everything cached for older ones, so nothing is
+served after the data changes and nothing is thrown away before it does.
+
+  memory  rendered page bodies (keyed by their data-version ETag), their
+          compressed encodings, and dashboard aggregates (stats and monthly
+          counts) keyed by the normalized filters; bounded to MEMORY_BYTES
+  files   built XLSX/PDF exports under cache/, bounded to DISK_BYTES
+
+Both evict least recently used entries first; a budget of 0 disables a cache
+(benchmarks.py does that, so its cases time the work and not the cache). The
+caches are per process; the disk cache is rescanned when the version changes,
+so processes sharing DATA_DIR also clean up each other's stale files.
+"""
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, BinaryIO, Callable, Dict, Hashable
+
+import db_access
+import metrics
+
+MEMORY_BYTES = int(os.getenv("RESPONSE_CACHE_BYTES", str(64 * 1024 * 1024)))
+DISK_BYTES = int(os.getenv("RESPONSE_CACHE_DISK_BYTES", str(1024 * 1024 * 1024)))
+CACHE_DIR = os.path.join(db_access.DATA_DIR, "cache")
+# Size charged for values that are not bytes (aggregates and the like)
+OBJECT_BYTES = 1024
+# No single entry may take more than this share of a cache
+MAX_ENTRY_SHARE = 8
+# Temp files younger than this (seconds) may still be being written
+TMP_GRACE = 3600.0
+
+
+def filters_key(filters: Dict[str, Any] | None) -> str:
+    """Normalized, order-independent form of a filter set."""
+    return json.dumps(filters or {}, sort_keys=True, default=str)
+
+
+class MemoryLRU:
+    def __init__(self, max_bytes: int = MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self.version: int | None = None
+        self.bytes = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _current(self, version: int | None) -> bool:
+        """Adopt a newer version (dropping every entry); False if the caller's version is already stale."""
+        if version is None or version == self.version:
+            return True
+        if self.version is not None and version < self.version:
+            return False
+        self._entries.clear()
+        self.bytes = 0
+        self.version = version
+        return True
+
+    def get(self, key: tuple, version: int | None) -> Any:
+        """The cached value or None. version=None means the key itself pins the data (e.g. an ETag)."""
+        if not self.max_bytes:
+            return None
+        with self._lock:
+            entry = self._entries.get(key) if self._current(version) else None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        metrics.CACHE_REQUESTS.inc(cache=key[0], result="hit" if entry is not None else "miss")
+        return entry[0] if entry is not None else None
+
+    def put(self, key: tuple, version: int | None, value: Any, size: int | None = None) -> None:
+        size = size if size is not None else (len(value) if isinstance(value, (bytes, str)) else OBJECT_BYTES)
+        if size > self.max_bytes // MAX_ENTRY_SHARE:
+            return
+        with self._lock:
+            if not self._current(version):
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def get_or_compute(self, key: tuple, compute: Callable[[], Any]) -> Any:
+        # Read the version before computing: a write in between makes the entry stale at once
+        version = db_access.data_version()
+        value = self.get(key, version)
+        if value is None:
+            value = compute()
+            self.put(key, version, value)
+        return value
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskLRU:
+    """Files named <version>-<key hash>.<ext>; recency is the file's mtime, refreshed on every hit."""
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = DISK_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version: int | None = None
+        self.bytes = 0
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _rescan(self) -> None:
+        """Rebuild the LRU from the directory, deleting files cached for older versions."""
+        self._files.clear()
+        self.bytes = 0
+        if not os.path.isdir(self.directory):
+            return
+        found = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                prefix = entry.name.split("-", 1)[0]
+                if not prefix.isdigit():
+                    continue
+                if entry.name.endswith(".tmp"):
+                    # Still being written (maybe by another process, for an older version): its
+                    # writer renames it into place, and the next rescan deletes it if it is stale
+                    try:
+                        if entry.stat().st_mtime < time.time() - TMP_GRACE:
+                            self._unlink(entry.path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if int(prefix) < self.version:
+                    self._unlink(entry.path)
+                    continue
+                found.append((st.st_mtime, entry.name, st.st_size))
+        for _, name, size in sorted(found):
+            self._files[name] = size
+            self.bytes += size
+
+    @staticmethod
+    def _unlink(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _current(self, version: int) -> bool:
+        if version == self.version:
+            return True
+        if self.version is not None and version < self.version:
+            return False
+        self.version = version
+        self._rescan()
+        return True
+
+    @staticmethod
+    def _name(key: str, version: int, ext: str) -> str:
+        return f"{version}-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}.{ext}"
+
+    def get(self, key: str, version: int, ext: str) -> BinaryIO | None:
+        """The cached file, opened for reading, or None.
+
+        An open file stays readable even if a rescan or eviction unlinks it before it has been sent.
+        """
+        if not self.max_bytes:
+            return None
+        name = self._name(key, version, ext)
+        path = os.path.join(self.directory, name)
+        fh = None
+        with self._lock:
+            if self._current(version) and name in self._files:
+                try:
+                    fh = open(path, "rb")
+                    os.utime(path)
+                    self._files.move_to_end(name)
+                except FileNotFoundError:
+                    # Removed behind our back (another process's rescan): forget it
+                    if fh is not None:
+                        fh.close()
+                        fh = None
+                    self.bytes -= self._files.pop(name)
+        metrics.CACHE_REQUESTS.inc(cache="files", result="hit" if fh is not None else "miss")
+        return fh
+
+    def put(self, key: str, version: int, ext: str, write: Callable[[BinaryIO], Any]) -> BinaryIO:
+        """Build a file with write(fh) and cache it; returns it opened for reading.
+
+        The file is served from the handle it was written through, so it is sent even if it could not be
+        cached: too big to keep, built for a version that is already stale, or its temp file removed.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        name = self._name(key, version, ext)
+        path = os.path.join(self.directory, name)
+        tmp = f"{path}.{secrets.token_hex(4)}.tmp"
+        fh = open(tmp, "w+b")
+        try:
+            write(fh)
+            fh.flush()
+            fh.seek(0)
+        except BaseException:
+            fh.close()
+            self._unlink(tmp)
+            raise
+        size = os.fstat(fh.fileno()).st_size
+        if not self.max_bytes or size > self.max_bytes // MAX_ENTRY_SHARE:
+            # Not worth a share of the budget (or caching is off): served from fh, gone once it is closed
+            self._unlink(tmp)
+            return fh
+        try:
+            os.replace(tmp, path)
+        except FileNotFoundError:
+            # The temp file was unlinked while being written: a miss, but the data is still in fh
+            return fh
+        with self._lock:
+            if not self._current(version):
+                return fh
+            self.bytes += size - self._files.pop(name, 0)
+            self._files[name] = size
+            # Evict oldest first, but never the file just built
+            while self.bytes > self.max_bytes and len(self._files) > 1:
+                old, old_size = self._files.popitem(last=False)
+                self._unlink(os.path.join(self.directory, old))
+                self.bytes -= old_size
+        return fh
+
+
+memory = MemoryLRU()
+files = DiskLRU()
+
+
+def aggregate(name: str, filters: Dict[str, Any] | None, compute: Callable[[Dict[str, Any] | None], Any]) -> Any:
+    """compute(filters), cached per normalized filter set until the data changes."""
+    return memory.get_or_compute((name, filters_key(filters)), lambda: compute(filters))
+
+
+def cached_file(key_parts: list, ext: str, write: Callable[[BinaryIO], Any]) -> BinaryIO:
+    """A file built by write(fh) for these key parts at the current data version, opened for reading."""
+    version = db_access.data_version()
+    key = json.dumps(key_parts, sort_keys=True, default=str)
+    return files.get(key, version, ext) or files.put(key, version, ext, write)
@@ -0,0 +1,138 @@
+"""Asyncio XDS client for high-volume verification.
+
+Runs many SOAP calls concurrently over one pooled aiohttp session instead of a
+blocking request per thread. Envelopes and response parsing are shared with
+xds_main, so both clients speak exactly the same protocol; concurrency is
+capped by a semaphore (and the connector's connection limit) so XDS is never
+sent more than `concurrency` requests at once.
+
+    async with AsyncXDSClient(concurrency=20) as xds:
+        ticket = await xds.get_ticket()
+        results = await asyncio.gather(*(xds.match_consumer(ticket, i, c) for i, c in people))
+"""
+import asyncio
+import logging
+import os
+from typing import Tuple
+
+import aiohttp
+
+import metrics
+import xds_main
+import xds_tickets
+
+logger = logging.getLogger(__name__)
+
+ASYNC_CONCURRENCY = int(os.getenv("XDS_ASYNC_CONCURRENCY", "20"))
+
+
+class XDSHTTPError(Exception):
+    """Non-2xx response from XDS; .text carries the body for auth-failure checks."""
+
+    def __init__(self, status: int, text: str):
+        super().__init__(f"XDS returned HTTP {status}")
+        self.status = status
+        self.text = text
+
+
+class AsyncXDSClient:
+    def __init__(self, url: str | None = None, concurrency: int = ASYNC_CONCURRENCY,
+                 timeout: float = xds_main.REQUEST_TIMEOUT, tickets: xds_tickets.TicketManager | None = None):
+        self.url = url or xds_main.XDS_URL
+        if tickets is None:
+            # Share xds_main's tickets for the real endpoint; anything else (e.g. a stand-in) logs in itself
+            if self.url == xds_main.XDS_URL:
+                tickets = xds_main.ticket_manager
+            else:
+                tickets = xds_tickets.TicketManager(
+                    login=lambda user, password: xds_main.login_to_xds(user, password, url=self.url),
+                    credentials=[(xds_main.XDS_USER, xds_main.XDS_PASS)],
+                )
+        self.tickets = tickets
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._session: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self) -> "AsyncXDSClient":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def open(self) -> None:
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=30)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Accept": "*/*"},
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    # ---------------- transport ---------------- #
+
+    async def _post_soap(self, envelope: Tuple[str, dict], timeout: float | None = None) -> bytes:
+        body, headers = envelope
+        h = {"Content-Type": "text/xml; charset=utf-8"}
+        h.update(headers)
+        await self.open()
+        call_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+        async with self._semaphore:
+            # Timed inside the semaphore: XDS latency, not time spent queueing for a slot
+            with metrics.timed(metrics.XDS_SECONDS, metrics.XDS_ERRORS, operation=metrics.soap_operation(body)):
+                async with self._session.post(self.url, data=body.encode("utf-8"), headers=h,
+                                              timeout=call_timeout) as resp:
+                    content = await resp.read()
+                    if resp.status >= 400:
+                        raise XDSHTTPError(resp.status, content.decode("utf-8", "replace"))
+                    return content
+
+    # ---------------- XDS operations ---------------- #
+
+    async def get_ticket(self) -> str:
+        """A cached ticket (logging in off the event loop if needed)."""
+        return await asyncio.to_thread(self.tickets.get)
+
+    async def login(self, username: str | None = None, password: str | None = None,
+                    timeout: float | None = None) -> str:
+        envelope = xds_main.build_login_envelope(username or xds_main.XDS_USER, password or xds_main.XDS_PASS)
+        return xds_main.parse_login_response(await self._post_soap(envelope, timeout))
+
+    async def is_ticket_valid(self, ticket, timeout: float | None = None) -> str:
+        envelope = xds_main.build_ticket_valid_envelope(ticket)
+        return xds_main.parse_ticket_valid_response(await self._post_soap(envelope, timeout))
+
+    async def match_consumer(self, ticket, id_number, cell_number, reference="", voucher_code="",
+                             timeout: float | None = None) -> dict:
+        envelope = xds_main.build_match_envelope(ticket, id_number, cell_number, reference, voucher_code)
+        return xds_main.parse_match_response(await self._post_soap(envelope, timeout))
+
+    async def request_facial_verification(self, ticket, enquiry_id, enquiry_result_id, redirect_url="",
+                                          timeout: float | None = None) -> str:
+        envelope = xds_main.build_dov_request_envelope(ticket, enquiry_id, enquiry_result_id, redirect_url)
+        return xds_main.parse_dov_request_response(await self._post_soap(envelope, timeout))
+
+    async def get_dov_result(self, ticket, enquiry_id, timeout: float | None = None) -> str:
+        envelope = xds_main.build_dov_result_envelope(ticket, enquiry_id)
+        return xds_main.parse_dov_result_response(await self._post_soap(envelope, timeout))
+
+    async def call(self, method, *args, **kwargs):
+        """await method(ticket, *args, **kwargs), retried once with a fresh ticket on an auth failure."""
+        ticket = await self.get_ticket()
+        try:
+            result = await method(ticket, *args, **kwargs)
+        except XDSHTTPError as e:
+            if not xds_tickets.is_auth_failure(e.text):
+                raise
+            result = None
+        if result is not None and not xds_tickets.result_is_auth_failure(result):
+            return result
+        logger.info("XDS rejected ticket; logging in again")
+        self.tickets.invalidate(ticket)
+        return await method(await self.get_ticket(), *args, **kwargs)
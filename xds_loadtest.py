@@ -0,0 +1,217 @@
+"""Load-test driver for the XDS flow, meant to run against xds_standin.
+
+Each simulated client goes through the full flow: match, DOV request, poll
+until the result is ready, then extract the photos and (with --store) insert
+the verification. --mode sync drives xds_main's blocking functions from a
+thread pool; --mode async uses xds_async.AsyncXDSClient. The run ends with
+throughput and p50/p95/p99 latency per operation.
+
+    python xds_standin.py --result-after 5 &
+    python xds_loadtest.py --url http://127.0.0.1:8089/ --clients 500 --concurrency 50
+
+--store writes to the configured database and uploads/, so point
+DOVS_DATA_DIR (or DOVS_DB_FILE) at scratch data when using it.
+"""
+import asyncio
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import dov_result
+import xds_main
+from dov_poller import result_ready
+from xds_async import AsyncXDSClient
+
+DEFAULT_URL = "http://127.0.0.1:8089/"
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(q * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(rank, 1)) - 1]
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors = Counter()
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    def record(self, op: str, seconds: float) -> None:
+        with self._lock:
+            self.latencies[op].append(seconds)
+
+    def error(self, op: str) -> None:
+        with self._lock:
+            self.errors[op] += 1
+
+    def complete(self, seconds: float) -> None:
+        with self._lock:
+            self.latencies["flow"].append(seconds)
+            self.completed += 1
+
+    def report(self, elapsed: float, clients: int) -> str:
+        calls = sum(len(v) for op, v in self.latencies.items() if op != "flow")
+        lines = [
+            f"{self.completed}/{clients} flows completed in {elapsed:.2f}s "
+            f"({self.completed / elapsed if elapsed else 0:.1f} flows/s, {calls / elapsed if elapsed else 0:.1f} calls/s)",
+            f"  {'operation':<14}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}",
+        ]
+        for op in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(op, []))
+            ms = [percentile(values, q) * 1000 for q in (0.5, 0.95, 0.99)] + [(values[-1] if values else 0) * 1000]
+            lines.append(f"  {op:<14}{len(values):>7}" + "".join(f"{v:>10.1f}" for v in ms) + f"{self.errors[op]:>8}")
+        return "\n".join(lines)
+
+
+def _id_number(i: int) -> str:
+    return f"{800101 + i % 9000:06d}{5000000 + i:07d}"[:13]
+
+
+class Flow:
+    """Per-run settings shared by the sync and async drivers."""
+
+    def __init__(self, stats: LoadStats, store: bool, poll_interval: float, max_wait: float):
+        self.stats = stats
+        self.store = store
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+        self.scratch = tempfile.mkdtemp(prefix="xds-loadtest-")
+
+    def finish(self, enquiry_id: str, xml: str) -> None:
+        """Extract (or store) a completed result, as the poller would."""
+        started = time.perf_counter()
+        if self.store:
+            xds_main.insert_verification_with_xml(enquiry_id, None, xml)
+        else:
+            targets = {tag: os.path.join(self.scratch, f"{enquiry_id}_{tag}.jpg") for tag in dov_result.PHOTO_TAGS}
+            _, written = dov_result.parse_dov_result(xml, targets)
+            for path in written.values():
+                os.remove(path)
+        self.stats.record("store" if self.store else "extract", time.perf_counter() - started)
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+
+# ---------------- sync (xds_main) ---------------- #
+
+def _timed_sync(flow: Flow, op: str, fn, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return xds_main.ticket_manager.call(fn, *args, **kwargs)
+    except Exception:
+        flow.stats.error(op)
+        raise
+    finally:
+        flow.stats.record(op, time.perf_counter() - started)
+
+
+def _sync_client(flow: Flow, i: int) -> None:
+    started = time.perf_counter()
+    match = _timed_sync(flow, "match", xds_main.match_consumer, _id_number(i), "0820000000", f"load-{i}")
+    enquiry_id, result_id = match.get("enquiry_id"), match.get("enquiry_result_id")
+    _timed_sync(flow, "dov_request", xds_main.request_facial_verification, enquiry_id, result_id, redirect_url="")
+    deadline = time.monotonic() + flow.max_wait
+    while time.monotonic() < deadline:
+        try:
+            xml = _timed_sync(flow, "dov_result", xds_main.get_dov_result, enquiry_id)
+        except Exception:
+            # A failed poll is retried on the next tick, as dov_poller does
+            xml = None
+        if result_ready(xml):
+            flow.finish(enquiry_id, xml)
+            flow.stats.complete(time.perf_counter() - started)
+            return
+        time.sleep(flow.poll_interval)
+    flow.stats.error("flow")
+
+
+def run_sync(url: str, flow: Flow, clients: int, concurrency: int) -> None:
+    xds_main.XDS_URL = url
+    started = time.perf_counter()
+    xds_main.get_ticket()
+    flow.stats.record("login", time.perf_counter() - started)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for f in [pool.submit(_sync_client, flow, i) for i in range(clients)]:
+            try:
+                f.result()
+            except Exception:
+                pass
+
+
+# ---------------- async (xds_async) ---------------- #
+
+async def _timed_async(flow: Flow, client: AsyncXDSClient, op: str, method, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return await client.call(method, *args, **kwargs)
+    except Exception:
+        flow.stats.error(op)
+        raise
+    finally:
+        flow.stats.record(op, time.perf_counter() - started)
+
+
+async def _async_client(flow: Flow, client: AsyncXDSClient, limit: asyncio.Semaphore, i: int) -> None:
+    async with limit:
+        started = time.perf_counter()
+        match = await _timed_async(flow, client, "match", client.match_consumer, _id_number(i), "0820000000", f"load-{i}")
+        enquiry_id, result_id = match.get("enquiry_id"), match.get("enquiry_result_id")
+        await _timed_async(flow, client, "dov_request", client.request_facial_verification, enquiry_id, result_id)
+    deadline = time.monotonic() + flow.max_wait
+    while time.monotonic() < deadline:
+        try:
+            xml = await _timed_async(flow, client, "dov_result", client.get_dov_result, enquiry_id)
+        except Exception:
+            xml = None
+        if result_ready(xml):
+            await asyncio.to_thread(flow.finish, enquiry_id, xml)
+            flow.stats.complete(time.perf_counter() - started)
+            return
+        await asyncio.sleep(flow.poll_interval)
+    flow.stats.error("flow")
+
+
+async def run_async(url: str, flow: Flow, clients: int, concurrency: int) -> None:
+    async with AsyncXDSClient(url=url, concurrency=concurrency) as client:
+        started = time.perf_counter()
+        await client.get_ticket()
+        flow.stats.record("login", time.perf_counter() - started)
+        limit = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(_async_client(flow, client, limit, i) for i in range(clients)), return_exceptions=True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Drive the XDS verification flow against a stand-in and report latency")
+    parser.add_argument("--url", default=DEFAULT_URL, help="stand-in endpoint")
+    parser.add_argument("--clients", type=int, default=200, help="verification flows to run")
+    parser.add_argument("--concurrency", type=int, default=20, help="flows (sync: threads) in flight at once")
+    parser.add_argument("--mode", choices=("async", "sync"), default="async")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between result polls")
+    parser.add_argument("--max-wait", type=float, default=300.0, help="give up on a flow's result after this long")
+    parser.add_argument("--store", action="store_true", help="insert results into the database (use DOVS_DATA_DIR)")
+    args = parser.parse_args()
+
+    stats = LoadStats()
+    flow = Flow(stats, args.store, args.poll_interval, args.max_wait)
+    started = time.perf_counter()
+    try:
+        if args.mode == "sync":
+            run_sync(args.url, flow, args.clients, args.concurrency)
+        else:
+            asyncio.run(run_async(args.url, flow, args.clients, args.concurrency))
+    finally:
+        flow.cleanup()
+    print(stats.report(time.perf_counter() - started, args.clients))
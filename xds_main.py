@@ -3,7 +3,13 @@ from xml.etree import ElementTree as ET
 import requests
 import sqlite3
 import os
+import audit_log
 import db_access
+import dov_result
+import metrics
+import photo_store
+import photos
+import xds_tickets
 import base64
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
@@ -13,7 +19,7 @@ from logging.handlers import RotatingFileHandler
 
 # --- Logging setup ---
 handler = RotatingFileHandler(
-    "xds_dovs.log", maxBytes=5_000_000, backupCount=3
+    os.path.join(db_access.DATA_DIR, "xds_dovs.log"), maxBytes=5_000_000, backupCount=3
 )
 logging.basicConfig(
     level=logging.INFO,
@@ -26,9 +32,8 @@ load_dotenv()
 
 # === Safeguards & Paths ===
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(BASE_DIR, "verifications.db")
-LOG_FILE = os.path.join(BASE_DIR, "dov_audit_log.txt")
-UPLOADS_DIR = os.path.join(BASE_DIR, "uploads")
+DB_FILE = db_access.DB_FILE
+UPLOADS_DIR = os.path.join(db_access.DATA_DIR, "uploads")
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 
 # --- Logging setup ---
@@ -37,118 +42,26 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s",
     handlers=[
         logging.StreamHandler(),
-        logging.FileHandler(os.path.join(os.path.dirname(DB_FILE), "xds_dovs.log"), encoding="utf-8")
+        logging.FileHandler(os.path.join(db_access.DATA_DIR, "xds_dovs.log"), encoding="utf-8")
     ]
 )
 logger = logging.getLogger(__name__)
 
 
-def ensure_database() -> None:
-    logger.info("Checking database at: %s", DB_FILE)
-    recreate = False
-    if not os.path.exists(DB_FILE):
-        recreate = True
-    else:
-        try:
-            conn = sqlite3.connect(DB_FILE)
-            cur = conn.cursor()
-            cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='verifications'")
-            if not cur.fetchone():
-                recreate = True
-            conn.close()
-        except sqlite3.DatabaseError:
-            recreate = True
-
-    if recreate:
-        conn = sqlite3.connect(DB_FILE)
-        cur = conn.cursor()
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS verifications (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT,
-                client_id TEXT,
-                status TEXT,
-                details TEXT,
-                name TEXT,
-                id_number TEXT,
-                email TEXT,
-                id_photo TEXT,
-                selfie_photo TEXT
-            )
-            """
-        )
-        conn.commit()
-        conn.close()
-        logger.info("Database created with `verifications` table.")
-
-
-def migrate_database_schema(db_path: str = DB_FILE) -> None:
-    """Ensure the verifications table has all required columns. Adds missing columns if needed."""
-    required_columns = {
-        "id_photo": "TEXT",
-        "selfie_photo": "TEXT",
-        # Add future required columns here
-    }
-
-    try:
-        conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-
-        # Get existing column names
-        cur.execute("PRAGMA table_info(verifications)")
-        existing_cols = {row[1] for row in cur.fetchall()}
-
-        # Add any missing columns
-        for col, col_type in required_columns.items():
-            if col not in existing_cols:
-                logger.info("Adding missing column '%s' (%s) to verifications", col, col_type)
-                cur.execute(f"ALTER TABLE verifications ADD COLUMN {col} {col_type}")
-
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        logger.exception("Failed to migrate database schema: %s", e)
-
-
 def ensure_audit_log() -> None:
     try:
-        if not os.path.exists(LOG_FILE):
-            with open(LOG_FILE, "w", encoding="utf-8") as f:
-                f.write("")
-        else:
-            with open(LOG_FILE, "a", encoding="utf-8"):
-                pass
+        os.makedirs(audit_log.AUDIT_DIR, exist_ok=True)
     except Exception:
         logger.exception("Could not ensure audit log")
 
 
 def verified_within_last_3_months(id_number: str) -> bool:
-    if not os.path.exists(DB_FILE):
-        return False
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT timestamp FROM verifications WHERE id_number = ? ORDER BY timestamp DESC LIMIT 1",
-            (id_number,),
-        )
-        row = cur.fetchone()
-        conn.close()
+        return db_access.verified_since(id_number, datetime.now() - timedelta(days=90))
     except sqlite3.DatabaseError:
         return False
-    if row:
-        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
-            try:
-                last_verified = datetime.strptime(row[0], fmt)
-                return last_verified >= datetime.now() - timedelta(days=90)
-            except Exception:
-                continue
-    return False
-
-
-ensure_database()
-migrate_database_schema()
+
+
 ensure_audit_log()
 
 # Constants from .env
@@ -167,43 +80,39 @@ def _post_soap(url: str, body: str, headers: dict | None = None) -> requests.Res
     h = {"Content-Type": "text/xml; charset=utf-8"}
     if headers:
         h.update(headers)
-    resp = _session.post(url, data=body, headers=h, timeout=REQUEST_TIMEOUT)
-    resp.raise_for_status()
+    with metrics.timed(metrics.XDS_SECONDS, metrics.XDS_ERRORS, operation=metrics.soap_operation(body)):
+        resp = _session.post(url, data=body, headers=h, timeout=REQUEST_TIMEOUT)
+        resp.raise_for_status()
     return resp
 
 
 def save_photo_from_base64(data: str, filename: str) -> str | None:
+    """Decode a base64 photo to an incoming file for store_verification; None if it cannot be."""
     if not data:
         return None
     try:
-        img_path = os.path.join(UPLOADS_DIR, filename)
-        # ensure subdirectories exist (e.g., uploads/ids, uploads/selfies)
+        img_path = photo_store.incoming_path(os.path.basename(filename))
         os.makedirs(os.path.dirname(img_path), exist_ok=True)
         with open(img_path, "wb") as f:
             f.write(base64.b64decode(data))
-        # return web-friendly relative path
-        return f"uploads/{filename}".replace("\\", "/")
+        return img_path
     except Exception:
         logger.exception("Failed to save photo %s", filename)
         return None
 
 
-def log_verification_result(enquiry_id, enquiry_result_id, summary_dict, status, logfile=None):
-    logfile = logfile or LOG_FILE
+def log_verification_result(enquiry_id, enquiry_result_id, summary_dict, status):
     try:
-        with open(logfile, "a", encoding="utf-8") as log:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            log.write(f"Timestamp: {timestamp}\n")
-            log.write(f"Enquiry ID: {enquiry_id}\n")
-            log.write(f"Enquiry Result ID: {enquiry_result_id}\n")
-            log.write(f"Status: {status}\n")
-            if isinstance(summary_dict, dict):
-                id_no = summary_dict.get("ID Number") or summary_dict.get("id_number") or ""
-                if id_no:
-                    log.write(f"ID Number: {id_no}\n")
-                for k, v in summary_dict.items():
-                    log.write(f"  {k}: {v}\n")
-            log.write("--- Verification Session ---\n")
+        summary = summary_dict if isinstance(summary_dict, dict) else {}
+        audit_log.append({
+            "timestamp": summary.get("Timestamp") or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "client_id": summary.get("Client ID") or enquiry_id,
+            "enquiry_id": enquiry_id,
+            "enquiry_result_id": enquiry_result_id,
+            "status": status,
+            "id_number": summary.get("ID Number") or summary.get("id_number") or "",
+            "summary": summary,
+        })
     except Exception:
         logger.exception("Could not write to audit log")
 
@@ -216,10 +125,13 @@ def print_verification_status(status, summary=None):
             logging.info(f"  {k}: {v}")
 
 
-def login_to_xds(username: str | None = None, password: str | None = None) -> str:
-    username = username or XDS_USER
-    password = password or XDS_PASS
-    headers = {"Content-Type": "application/soap+xml; charset=utf-8"}
+# --- SOAP envelopes & response parsing ---
+# Shared by the blocking functions below and the asyncio client in xds_async.
+XDS_NS = "{http://www.web.xds.co.za/XDSConnectWS}"
+SOAP12_HEADERS = {"Content-Type": "application/soap+xml; charset=utf-8"}
+
+
+def build_login_envelope(username: str, password: str) -> Tuple[str, dict]:
     body = f"""<?xml version="1.0" encoding="utf-8"?>
 <soap12:Envelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
                  xmlns:xsd="http://www.w3.org/2001/XMLSchema"
@@ -231,15 +143,16 @@ def login_to_xds(username: str | None = None, password: str | None = None) -> st
     </Login>
   </soap12:Body>
 </soap12:Envelope>"""
-    resp = _post_soap(XDS_URL, body, headers)
-    logging.info("XDS Login raw response [truncated]: %s", resp.text[:400])
-    tree = ET.fromstring(resp.content)
-    ticket = tree.find(".//{http://www.web.xds.co.za/XDSConnectWS}LoginResult")
+    return body, dict(SOAP12_HEADERS)
+
+
+def parse_login_response(content: bytes) -> str:
+    tree = ET.fromstring(content)
+    ticket = tree.find(f".//{XDS_NS}LoginResult")
     return ticket.text if ticket is not None else ""
 
 
-def is_ticket_valid(ticket):
-    headers = {"Content-Type": "application/soap+xml; charset=utf-8"}
+def build_ticket_valid_envelope(ticket) -> Tuple[str, dict]:
     body = f"""<?xml version="1.0" encoding="utf-8"?>
 <soap12:Envelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
                  xmlns:xsd="http://www.w3.org/2001/XMLSchema"
@@ -250,14 +163,16 @@ def is_ticket_valid(ticket):
     </IsTicketValid>
   </soap12:Body>
 </soap12:Envelope>"""
-    resp = _post_soap(XDS_URL, body, headers)
-    tree = ET.fromstring(resp.content)
-    result = tree.find(".//{http://www.web.xds.co.za/XDSConnectWS}IsTicketValidResult")
+    return body, dict(SOAP12_HEADERS)
+
+
+def parse_ticket_valid_response(content: bytes) -> str:
+    tree = ET.fromstring(content)
+    result = tree.find(f".//{XDS_NS}IsTicketValidResult")
     return result.text if result is not None else ""
 
 
-def match_consumer(ticket, id_number, cell_number, reference="", voucher_code=""):
-    # Build the SOAP 1.2 envelope first
+def build_match_envelope(ticket, id_number, cell_number, reference="", voucher_code="") -> Tuple[str, dict]:
     body = f"""<?xml version="1.0" encoding="utf-8"?>
 <soap12:Envelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
                  xmlns:xsd="http://www.w3.org/2001/XMLSchema"
@@ -273,14 +188,13 @@ def match_consumer(ticket, id_number, cell_number, reference="", voucher_code=""
     </ConnectConsumerMatchDOVS>
   </soap12:Body>
 </soap12:Envelope>"""
-
     # Enforce SOAP 1.2 content type
-    headers = {"Content-Type": "application/soap+xml; charset=utf-8"}
-    resp = _post_soap(XDS_URL, body, headers)
+    return body, dict(SOAP12_HEADERS)
+
 
-    # Parse the response exactly as you already do
-    tree = ET.fromstring(resp.content)
-    result_node = tree.find(".//{http://www.web.xds.co.za/XDSConnectWS}ConnectConsumerMatchDOVSResult")
+def parse_match_response(content: bytes) -> dict:
+    tree = ET.fromstring(content)
+    result_node = tree.find(f".//{XDS_NS}ConnectConsumerMatchDOVSResult")
     if result_node is None:
         return {"error": "No result found"}
     result_xml = ET.fromstring(result_node.text)
@@ -289,14 +203,7 @@ def match_consumer(ticket, id_number, cell_number, reference="", voucher_code=""
     return {"xml": result_node.text, "enquiry_id": enquiry_id, "enquiry_result_id": enquiry_result_id}
 
 
-def request_facial_verification(ticket, enquiry_id, enquiry_result_id, redirect_url=""):
-    """
-    Initiates the DOVS facial verification request with XDS.
-    Per XDS production spec, RedirectURL must be blank.
-    """
-    # --- SOAP 1.2 header (preferred) ---
-    headers = {"Content-Type": "application/soap+xml; charset=utf-8"}
-
+def build_dov_request_envelope(ticket, enquiry_id, enquiry_result_id, redirect_url="") -> Tuple[str, dict]:
     # --- SOAP 1.2 envelope ---
     body = f"""<?xml version="1.0" encoding="utf-8"?>
     <soap12:Envelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
@@ -312,18 +219,20 @@ def request_facial_verification(ticket, enquiry_id, enquiry_result_id, redirect_
         </ConnectDOVRequest>
       </soap12:Body>
     </soap12:Envelope>"""
+    return body, dict(SOAP12_HEADERS)
 
-    resp = _post_soap(XDS_URL, body, headers)
-    resp.raise_for_status()
-    xml_resp = resp.text
-    logging.info("XDS Facial Verification Response [truncated]: %s", xml_resp[:400])
-    tree = ET.fromstring(xml_resp)
-    result = tree.find(".//{http://www.web.xds.co.za/XDSConnectWS}ConnectDOVRequestResult")
+
+def parse_dov_request_response(content: bytes) -> str:
+    tree = ET.fromstring(content)
+    result = tree.find(f".//{XDS_NS}ConnectDOVRequestResult")
     return result.text if result is not None else ""
 
 
-def get_dov_result(ticket, enquiry_id):
-    headers = {"SOAPAction": "http://www.web.xds.co.za/XDSConnectWS/ConnectGetDOVResult"}
+def build_dov_result_envelope(ticket, enquiry_id) -> Tuple[str, dict]:
+    headers = {
+        "Content-Type": "text/xml; charset=utf-8",
+        "SOAPAction": "http://www.web.xds.co.za/XDSConnectWS/ConnectGetDOVResult",
+    }
     body = f"""<?xml version="1.0" encoding="utf-8"?>
 <soap:Envelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
                xmlns:xsd="http://www.w3.org/2001/XMLSchema"
@@ -335,31 +244,73 @@ def get_dov_result(ticket, enquiry_id):
     </ConnectGetDOVResult>
   </soap:Body>
 </soap:Envelope>"""
-    resp = _post_soap(XDS_URL, body, headers)
-    tree = ET.fromstring(resp.content)
-    result = tree.find(".//{http://www.web.xds.co.za/XDSConnectWS}ConnectGetDOVResultResult")
+    return body, headers
+
+
+def parse_dov_result_response(content: bytes) -> str:
+    tree = ET.fromstring(content)
+    result = tree.find(f".//{XDS_NS}ConnectGetDOVResultResult")
     return result.text if result is not None else ""
 
 
+# --- XDS operations ---
+
+def login_to_xds(username: str | None = None, password: str | None = None, url: str | None = None) -> str:
+    username = username or XDS_USER
+    password = password or XDS_PASS
+    body, headers = build_login_envelope(username, password)
+    resp = _post_soap(url or XDS_URL, body, headers)
+    logging.info("XDS Login raw response [truncated]: %s", resp.text[:400])
+    return parse_login_response(resp.content)
+
+
+# Tickets are cached and shared by every caller in the process (see xds_tickets)
+ticket_manager = xds_tickets.TicketManager(
+    login=login_to_xds,
+    credentials=xds_tickets.parse_credentials(os.getenv("XDS_CREDENTIALS"), XDS_USER, XDS_PASS),
+    cache_file=os.getenv("XDS_TICKET_CACHE") or None,
+)
+
+
+def get_ticket() -> str:
+    """A cached XDS ticket, logging in only when none is valid."""
+    return ticket_manager.get()
+
+
+def is_ticket_valid(ticket):
+    body, headers = build_ticket_valid_envelope(ticket)
+    resp = _post_soap(XDS_URL, body, headers)
+    return parse_ticket_valid_response(resp.content)
+
+
+def match_consumer(ticket, id_number, cell_number, reference="", voucher_code=""):
+    body, headers = build_match_envelope(ticket, id_number, cell_number, reference, voucher_code)
+    resp = _post_soap(XDS_URL, body, headers)
+    return parse_match_response(resp.content)
+
+
+def request_facial_verification(ticket, enquiry_id, enquiry_result_id, redirect_url=""):
+    """
+    Initiates the DOVS facial verification request with XDS.
+    Per XDS production spec, RedirectURL must be blank.
+    """
+    body, headers = build_dov_request_envelope(ticket, enquiry_id, enquiry_result_id, redirect_url)
+    resp = _post_soap(XDS_URL, body, headers)
+    logging.info("XDS Facial Verification Response [truncated]: %s", resp.text[:400])
+    return parse_dov_request_response(resp.content)
+
+
+def get_dov_result(ticket, enquiry_id):
+    body, headers = build_dov_result_envelope(ticket, enquiry_id)
+    resp = _post_soap(XDS_URL, body, headers)
+    return parse_dov_result_response(resp.content)
+
+
 def summarize_consumer_info(xml_data):
     try:
-        root = ET.fromstring(xml_data)
-        details = root.find(".//ConsumerDetails")
-        if details is None:
+        summary, _ = dov_result.parse_dov_result(xml_data)
+        if not summary:
             return {}
-        summary = {
-            "Name": f"{details.findtext('FirstName', '')} {details.findtext('SecondName', '')} {details.findtext('Surname', '')}".strip(),
-            "ID Number": details.findtext('IDNo', 'N/A'),
-            "Date of Birth": details.findtext('BirthDate', 'N/A'),
-            "Gender": details.findtext('Gender', 'N/A'),
-            "Marital Status": details.findtext('MaritalStatusDesc', 'N/A'),
-            "Contact Number": details.findtext('CellularNo', 'N/A'),
-            "Email": details.findtext('EmailAddress', 'N/A'),
-            "Address": details.findtext('ResidentialAddress', 'N/A'),
-            "Employer": details.findtext('EmployerDetail', 'N/A'),
-            "Privacy Status": details.findtext('PrivacyStatus', 'N/A'),
-            "Verification Reference": details.findtext('ReferenceNo', 'N/A'),
-        }
         logging.info("\n✅ Consumer Summary:")
         for k, v in summary.items():
             logging.info(f"{k}: {v}")
@@ -370,29 +321,80 @@ def summarize_consumer_info(xml_data):
 
 
 def poll_dov_result(ticket, enquiry_id, max_attempts=30, interval=10):
+    """Block until one enquiry has a result; for manual checks only.
+
+    Verifications started by this module are queued with
+    db_access.enqueue_dov_poll and picked up by dov_poller instead.
+    """
     logging.info("🔄 Polling DOV result...")
+    started = time.monotonic()
     for attempt in range(max_attempts):
         try:
             dov_result = get_dov_result(ticket, enquiry_id)
         except Exception:
             logger.exception("Error calling get_dov_result")
-            dov_result = ""
+            metrics.DOV_POLLS.inc(outcome="error")
+            dov_result = None
         if dov_result and "<NoResult>" not in dov_result:
             logging.info(f"DOV Result found on attempt {attempt + 1}:")
+            metrics.DOV_POLLS.inc(outcome="result")
+            metrics.DOV_ATTEMPTS.observe(attempt + 1)
+            metrics.DOV_TIME_TO_RESULT.observe(time.monotonic() - started)
             return dov_result
+        if dov_result is not None:
+            metrics.DOV_POLLS.inc(outcome="no_result")
         logging.info(f"Attempt {attempt + 1}: No result yet. Retrying in {interval} seconds...")
         time.sleep(interval)
+    metrics.DOV_POLLS.inc(outcome="expired")
     return "⛔ DOV Result polling timed out after multiple attempts."
 
 
 def insert_verification_to_db(enquiry_id, summary_data, id_photo_data=None, selfie_photo_data=None):
     """Insert verification into DB using db_access, with normalized photo paths."""
-    id_photo_path = save_photo_from_base64(id_photo_data, f"ids/id_{enquiry_id}.jpg") if id_photo_data else None
-    selfie_photo_path = save_photo_from_base64(selfie_photo_data, f"selfies/selfie_{enquiry_id}.jpg") if selfie_photo_data else None
+    incoming = {
+        "ConsumerIDPhoto": save_photo_from_base64(id_photo_data, f"ids/id_{enquiry_id}.jpg"),
+        "ConsumerCapturedPhoto": save_photo_from_base64(selfie_photo_data, f"selfies/selfie_{enquiry_id}.jpg"),
+    }
+    store_verification(enquiry_id, summary_data, {tag: path for tag, path in incoming.items() if path})
+    logging.info("✅ Verification inserted into database with photos via db_access.")
+
+
+def store_verification(enquiry_id, summary_data, incoming, finish=None):
+    """Store decoded photos ({tag: incoming path}) and insert the verification in one short transaction.
 
+    The photos are hashed first, so the write lock covers only hard links and
+    row writes: one transaction, so the blobs cannot be released before the row
+    references them. finish, if given, runs in the same transaction.
+    """
+    hashed = {tag: photo_store.hash_file(path) for tag, path in incoming.items()}
+    photo_paths = {}
+    try:
+        with db_access.transaction():
+            for tag, path in incoming.items():
+                photo_paths[tag] = photo_store.store_file(path, hashed=hashed[tag])
+            _insert_summary(enquiry_id, summary_data,
+                            photo_paths.get("ConsumerIDPhoto"), photo_paths.get("ConsumerCapturedPhoto"))
+            if finish is not None:
+                finish()
+    except BaseException:
+        discard_incoming(incoming)
+        raise
+    # thumbnails/web variants for the dashboard are built off the request path
+    for rel_path in photo_paths.values():
+        photos.submit_derivatives(rel_path)
+
+
+def _insert_summary(enquiry_id, summary_data, id_photo_path, selfie_photo_path):
+    # Stamped into the summary so the audit record matches the row (see log_to_db)
+    summary_data.setdefault("Timestamp", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    summary_data.setdefault("Client ID", enquiry_id or "N/A")
+    if id_photo_path:
+        summary_data["ConsumerIDPhoto"] = id_photo_path
+    if selfie_photo_path:
+        summary_data["ConsumerCapturedPhoto"] = selfie_photo_path
     db_access.insert_verification(
-        timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        client_id=summary_data.get("Client ID", enquiry_id or "N/A"),
+        timestamp=summary_data["Timestamp"],
+        client_id=summary_data["Client ID"],
         status=summary_data.get("Status", "Success"),
         details=summary_data.get("Details", f"Verification for {summary_data.get('Name', 'N/A')} - Success"),
         name=summary_data.get("Name", "N/A"),
@@ -402,48 +404,53 @@ def insert_verification_to_db(enquiry_id, summary_data, id_photo_data=None, self
         selfie_photo=selfie_photo_path
     )
 
-    logging.info("✅ Verification inserted into database with photos via db_access.")
 
+def read_dov_result(enquiry_id, xml_data):
+    """Parse a DOV result, streaming its photos to incoming files; returns (summary, {tag: incoming path}).
 
-def extract_photos_from_xml(xml: str) -> Tuple[str | None, str | None]:
-    """Return (id_photo_b64, selfie_b64) from a DOV result XML."""
-    try:
-        root = ET.fromstring(xml)
-        id_b64 = root.findtext(".//ConsumerIDPhoto", "") or None
-        selfie_b64 = root.findtext(".//ConsumerCapturedPhoto", "") or None
-        return id_b64, selfie_b64
-    except Exception:
-        logger.exception("Failed to parse photos from XML")
-        return None, None
+    Raises on malformed or truncated XML, keeping no files.
+    """
+    targets = {
+        "ConsumerIDPhoto": photo_store.incoming_path(f"id_{enquiry_id}.jpg"),
+        "ConsumerCapturedPhoto": photo_store.incoming_path(f"selfie_{enquiry_id}.jpg"),
+    }
+    return dov_result.parse_dov_result(xml_data, targets)
 
 
-def insert_verification_with_xml(enquiry_id, summary_data, xml_data):
-    """Extract photos from XML and insert into DB using db_access."""
-    id_b64, selfie_b64 = extract_photos_from_xml(xml_data)
-    id_photo_path = save_photo_from_base64(id_b64, f"ids/id_{enquiry_id}.jpg") if id_b64 else None
-    selfie_photo_path = save_photo_from_base64(selfie_b64, f"selfies/selfie_{enquiry_id}.jpg") if selfie_b64 else None
+def discard_incoming(incoming):
+    """Remove decoded photos that will not be stored."""
+    for path in incoming.values():
+        if os.path.exists(path):
+            os.remove(path)
 
-    db_access.insert_verification(
-        timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        client_id=summary_data.get("Client ID", enquiry_id or "N/A"),
-        status=summary_data.get("Status", "Success"),
-        details=summary_data.get("Details", f"Verification for {summary_data.get('Name', 'N/A')} - Success"),
-        name=summary_data.get("Name", "N/A"),
-        id_number=summary_data.get("ID Number", "N/A"),
-        email=summary_data.get("Email", "N/A"),
-        id_photo=id_photo_path,
-        selfie_photo=selfie_photo_path
-    )
+
+def insert_verification_with_xml(enquiry_id, summary_data, xml_data, finish=None):
+    """Stream photos from the XML to disk and insert the verification using db_access.
+
+    summary_data may be None to use the summary parsed in the same pass (a
+    parse failure is then raised, since there is nothing to store); the summary
+    used is returned. The XML is parsed before the write transaction begins;
+    finish, if given, runs inside it (see store_verification).
+    """
+    try:
+        parsed_summary, written = read_dov_result(enquiry_id, xml_data)
+    except Exception:
+        if summary_data is None:
+            raise
+        logger.exception("Failed to extract photos from XML")
+        parsed_summary, written = {}, {}
+    if summary_data is None:
+        summary_data = parsed_summary
+    store_verification(enquiry_id, summary_data, written, finish)
+    return summary_data
 
 
 if __name__ == "__main__":
     id_number = "9104036161082"
     cell_number = "0732563864"
-    ticket = login_to_xds()
+    ticket = get_ticket()
     safe_ticket = ticket[:8] + "..." + ticket[-8:] if ticket else "None"
     logging.info(f"XDS Ticket: {safe_ticket}")
-    validation_result = is_ticket_valid(ticket)
-    logging.info(f"Ticket Validation Result: {validation_result}")
 
     id_number = "9104036161082"
     if verified_within_last_3_months(id_number):
@@ -451,7 +458,7 @@ if __name__ == "__main__":
     else:
         logging.info(f"Proceeding with new verification for {id_number}.")
 
-        match_result = match_consumer(ticket, id_number, cell_number)
+        match_result = ticket_manager.call(match_consumer, id_number, cell_number)
         enquiry_id = match_result.get("enquiry_id")
         enquiry_result_id = match_result.get("enquiry_result_id")
 
@@ -461,10 +468,12 @@ if __name__ == "__main__":
 
         logging.info(f"✅ Enquiry IDs received: EnquiryID={enquiry_id}, EnquiryResultID={enquiry_result_id}")
 
-        link = request_facial_verification(ticket, enquiry_id, enquiry_result_id, redirect_url="")
+        link = ticket_manager.call(request_facial_verification, enquiry_id, enquiry_result_id, redirect_url="")
         if link:
             logging.info("📩 SMS verification link requested successfully!")
             logging.info(f"🔗 Verification link (for testing): {link}")
+            # dov_poller stores the result once the consumer completes the check
+            db_access.enqueue_dov_poll(enquiry_id, enquiry_result_id, id_number)
             logging.info("✅ Verification cycle completed successfully.\n" + "-" * 80)
         else:
             logging.error("❌ Failed to request facial verification.")
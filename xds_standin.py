@@ -0,0 +1,229 @@
+"""Local stand-in for the XDS Connect SOAP service, for load and soak testing.
+
+Implements Login, IsTicketValid, ConnectConsumerMatchDOVS, ConnectDOVRequest
+and ConnectGetDOVResult with the response shapes xds_main parses, including
+large base64 photos and <NoResult> while a verification is pending. Latency
+(log-normal around a median), error rates, ticket rejections and the time a
+consumer takes to complete the check are all configurable.
+
+    python xds_standin.py --port 8089 --latency-ms 120 --error-rate 0.01 --result-after 20
+    python xds_loadtest.py --url http://127.0.0.1:8089/ --clients 500
+
+GET /stats returns request counts per operation as JSON.
+"""
+import asyncio
+import io
+import itertools
+import math
+import random
+import re
+import time
+from base64 import b64encode
+from collections import Counter
+from xml.sax.saxutils import escape
+
+from aiohttp import web
+from PIL import Image
+
+XDS_NS = "http://www.web.xds.co.za/XDSConnectWS"
+OPERATIONS = ("Login", "IsTicketValid", "ConnectConsumerMatchDOVS", "ConnectDOVRequest", "ConnectGetDOVResult")
+_OPERATION_RE = re.compile(r"<(" + "|".join(OPERATIONS) + r")[\s>]")
+NO_RESULT = "<NoResult><Error>Verification not yet completed by consumer</Error></NoResult>"
+
+_SOAP12 = """<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+  <soap:Body>
+    <{op}Response xmlns="{ns}">
+      <{op}Result>{result}</{op}Result>
+    </{op}Response>
+  </soap:Body>
+</soap:Envelope>"""
+_SOAP11 = _SOAP12.replace("http://www.w3.org/2003/05/soap-envelope", "http://schemas.xmlsoap.org/soap/envelope/")
+_FAULT = """<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope">
+  <soap:Body>
+    <soap:Fault>
+      <soap:Code><soap:Value>soap:Receiver</soap:Value></soap:Code>
+      <soap:Reason><soap:Text xml:lang="en">{reason}</soap:Text></soap:Reason>
+    </soap:Fault>
+  </soap:Body>
+</soap:Envelope>"""
+
+FIRST_NAMES = ("Thabo", "Lerato", "Sipho", "Naledi", "Johan", "Anele", "Pieter", "Zanele")
+SURNAMES = ("Nkosi", "Dlamini", "van der Merwe", "Mokoena", "Botha", "Khumalo", "Naidoo")
+
+
+def _field(body: str, tag: str) -> str:
+    m = re.search(rf"<{tag}>(.*?)</{tag}>", body, re.S)
+    return m.group(1).strip() if m else ""
+
+
+def make_photo_b64(size_kb: int, seed: int) -> str:
+    """A real JPEG of roughly size_kb (noise compresses poorly), base64-encoded."""
+    side = max(64, int(math.sqrt(size_kb * 1024 / 0.9)))
+    rnd = random.Random(seed)
+    img = Image.effect_noise((side, side), 40 + rnd.randint(0, 30)).convert("RGB")
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=90)
+    return b64encode(out.getvalue()).decode("ascii")
+
+
+class XDSStandin:
+    def __init__(self, latency_ms: float = 80, latency_sigma: float = 0.5, error_rate: float = 0.0,
+                 auth_fail_rate: float = 0.0, result_after: float = 15.0, result_jitter: float = 5.0,
+                 photo_kb: int = 250, ticket_ttl: float = 3600, seed: int | None = None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.auth_fail_rate = auth_fail_rate
+        self.result_after = result_after
+        self.result_jitter = result_jitter
+        self.ticket_ttl = ticket_ttl
+        self.random = random.Random(seed)
+        self.tickets = {}
+        self.enquiries = {}
+        self.ids = itertools.count(int(time.time()) % 1_000_000 * 1000)
+        self.stats = Counter()
+        # Encoded once; every completed result shares them
+        self.id_photo = make_photo_b64(photo_kb, 1)
+        self.selfie_photo = make_photo_b64(photo_kb, 2)
+
+    # ---------------- behaviour ---------------- #
+
+    def _latency(self) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        return self.latency_ms / 1000 * math.exp(self.random.gauss(0, self.latency_sigma))
+
+    def _ticket_ok(self, ticket: str) -> bool:
+        expires = self.tickets.get(ticket)
+        if expires is None or expires < time.time():
+            return False
+        if self.auth_fail_rate and self.random.random() < self.auth_fail_rate:
+            del self.tickets[ticket]
+            return False
+        return True
+
+    def login(self, body: str) -> str:
+        ticket = "%032x" % self.random.getrandbits(128)
+        self.tickets[ticket] = time.time() + self.ticket_ttl
+        return ticket
+
+    def is_ticket_valid(self, body: str) -> str:
+        expires = self.tickets.get(_field(body, "XDSConnectTicket"))
+        return "true" if expires and expires > time.time() else "false"
+
+    def match(self, body: str) -> str:
+        enquiry_id, result_id = str(next(self.ids)), str(next(self.ids))
+        id_number = _field(body, "IdNumber")
+        self.enquiries[enquiry_id] = {
+            "id_number": id_number,
+            "cell": _field(body, "CellNumber"),
+            "first": self.random.choice(FIRST_NAMES),
+            "surname": self.random.choice(SURNAMES),
+            "ready_at": None,
+        }
+        return escape(
+            "<ListOfConsumers><ConsumerDetails>"
+            f"<EnquiryID>{enquiry_id}</EnquiryID><EnquiryResultID>{result_id}</EnquiryResultID>"
+            f"<IDNo>{id_number}</IDNo><Reference>{_field(body, 'YourReference')}</Reference>"
+            "</ConsumerDetails></ListOfConsumers>"
+        )
+
+    def dov_request(self, body: str) -> str:
+        enquiry = self.enquiries.get(_field(body, "EnquiryID"))
+        if enquiry is None:
+            return escape("<NoResult><Error>Unknown EnquiryID</Error></NoResult>")
+        delay = max(0.0, self.random.gauss(self.result_after, self.result_jitter))
+        enquiry["ready_at"] = time.time() + delay
+        return f"https://standin.invalid/dov/{_field(body, 'EnquiryID')}"
+
+    def dov_result(self, body: str) -> str:
+        enquiry = self.enquiries.get(_field(body, "EnquiryID"))
+        if enquiry is None or enquiry["ready_at"] is None or enquiry["ready_at"] > time.time():
+            return escape(NO_RESULT)
+        self.stats["results_delivered"] += 1
+        details = (
+            "<ConsumerDetails>"
+            f"<FirstName>{enquiry['first']}</FirstName><SecondName></SecondName><Surname>{enquiry['surname']}</Surname>"
+            f"<IDNo>{enquiry['id_number']}</IDNo><BirthDate>1991-04-03</BirthDate><Gender>Male</Gender>"
+            f"<MaritalStatusDesc>Single</MaritalStatusDesc><CellularNo>{enquiry['cell']}</CellularNo>"
+            "<EmailAddress>consumer@example.invalid</EmailAddress><ResidentialAddress>1 Main Rd, Johannesburg</ResidentialAddress>"
+            "<EmployerDetail>N/A</EmployerDetail><PrivacyStatus>None</PrivacyStatus>"
+            f"<ReferenceNo>SI-{_field(body, 'EnquiryID')}</ReferenceNo>"
+            "</ConsumerDetails>"
+        )
+        # base64 needs no escaping, so the photos are spliced in unchanged
+        return (escape("<DOVResult>" + details + "<ConsumerIDPhoto>") + self.id_photo
+                + escape("</ConsumerIDPhoto><ConsumerCapturedPhoto>") + self.selfie_photo
+                + escape("</ConsumerCapturedPhoto><Result>Match</Result></DOVResult>"))
+
+    # ---------------- HTTP ---------------- #
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.text()
+        m = _OPERATION_RE.search(body)
+        op = m.group(1) if m else "Unknown"
+        self.stats[op] += 1
+        await asyncio.sleep(self._latency())
+
+        if op == "Unknown":
+            return self._fault("Unknown operation", 400)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.stats["injected_errors"] += 1
+            return self._fault("Server was unable to process request. Injected failure.", 500)
+        if op not in ("Login", "IsTicketValid"):
+            ticket = _field(body, "ConnectTicket")
+            if not self._ticket_ok(ticket):
+                self.stats["auth_failures"] += 1
+                return self._fault("Invalid ticket. User not logged in.", 500)
+
+        handler = {
+            "Login": self.login,
+            "IsTicketValid": self.is_ticket_valid,
+            "ConnectConsumerMatchDOVS": self.match,
+            "ConnectDOVRequest": self.dov_request,
+            "ConnectGetDOVResult": self.dov_result,
+        }[op]
+        template = _SOAP11 if op == "ConnectGetDOVResult" else _SOAP12
+        content_type = "text/xml" if op == "ConnectGetDOVResult" else "application/soap+xml"
+        text = template.format(op=op, ns=XDS_NS, result=handler(body))
+        return web.Response(text=text, content_type=content_type, charset="utf-8")
+
+    def _fault(self, reason: str, status: int) -> web.Response:
+        return web.Response(text=_FAULT.format(reason=escape(reason)), status=status,
+                            content_type="application/soap+xml", charset="utf-8")
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        now = time.time()
+        pending = sum(1 for e in self.enquiries.values() if e["ready_at"] is None or e["ready_at"] > now)
+        return web.json_response(dict(self.stats, pending=pending))
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_get("/stats", self.handle_stats)
+        app.router.add_post("/{tail:.*}", self.handle)
+        return app
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local XDS SOAP stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=80, help="median response latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal spread of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with a SOAP fault")
+    parser.add_argument("--auth-fail-rate", type=float, default=0.0, help="fraction of calls that reject the ticket")
+    parser.add_argument("--result-after", type=float, default=15.0, help="mean seconds until a DOV result is ready")
+    parser.add_argument("--result-jitter", type=float, default=5.0, help="std deviation of --result-after")
+    parser.add_argument("--photo-kb", type=int, default=250, help="approximate size of each photo")
+    parser.add_argument("--ticket-ttl", type=float, default=3600)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    standin = XDSStandin(args.latency_ms, args.latency_sigma, args.error_rate, args.auth_fail_rate,
+                         args.result_after, args.result_jitter, args.photo_kb, args.ticket_ttl, args.seed)
+    print(f"XDS stand-in on http://{args.host}:{args.port}/")
+    web.run_app(standin.make_app(), host=args.host, port=args.port, print=None)
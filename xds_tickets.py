@@ -0,0 +1,180 @@
+"""Cached, thread-safe XDS ConnectTicket management.
+
+A ticket is obtained with a SOAP Login and then reused by every caller until
+it nears TICKET_TTL, when the next caller refreshes it while the others keep
+using the current one. After expiry, or after XDS rejects a ticket, callers
+wait on a single in-flight Login instead of each logging in. Several
+credentials can be pooled; get() hands out their tickets round-robin.
+"""
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterable, Tuple
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+TICKET_TTL = int(os.getenv("XDS_TICKET_TTL", "3600"))
+REFRESH_MARGIN = int(os.getenv("XDS_TICKET_REFRESH_MARGIN", "300"))
+LOGIN_WAIT_TIMEOUT = 60
+
+# Phrases XDS uses in results/faults when a ticket is not (or no longer) accepted
+AUTH_FAILURE_MARKERS = (
+    "invalid ticket",
+    "ticket is invalid",
+    "ticket expired",
+    "ticket has expired",
+    "not authenticated",
+    "authentication failed",
+    "user not logged in",
+)
+
+
+def is_auth_failure(text: str | None) -> bool:
+    lowered = (text or "").lower()
+    return any(marker in lowered for marker in AUTH_FAILURE_MARKERS)
+
+
+def result_is_auth_failure(result) -> bool:
+    if isinstance(result, str):
+        return is_auth_failure(result)
+    if isinstance(result, dict):
+        return is_auth_failure(result.get("error")) or is_auth_failure(result.get("xml"))
+    return False
+
+
+class _Slot:
+    def __init__(self, username: str, password: str):
+        self.username = username
+        self.password = password
+        self.ticket: str | None = None
+        self.issued_at = 0.0
+        self.refreshing: threading.Event | None = None
+
+
+class TicketManager:
+    def __init__(self, login: Callable[[str, str], str], credentials: Iterable[Tuple[str, str]],
+                 ttl: int = TICKET_TTL, refresh_margin: int = REFRESH_MARGIN, cache_file: str | None = None):
+        self._login = login
+        self._slots = [_Slot(u, p) for u, p in credentials]
+        if not self._slots:
+            raise ValueError("TicketManager needs at least one credential")
+        self._ttl = ttl
+        self._margin = min(refresh_margin, ttl)
+        self._cache_file = cache_file
+        self._lock = threading.Lock()
+        self._next_slot = itertools.cycle(self._slots)
+        self._load_cache()
+
+    # ---------------- public API ---------------- #
+
+    def get(self) -> str:
+        """A valid ticket from the next pooled credential."""
+        with self._lock:
+            slot = next(self._next_slot)
+        return self._ticket_for(slot)
+
+    def invalidate(self, ticket: str) -> None:
+        """Forget a ticket XDS rejected; a newer ticket for the same credential is kept."""
+        with self._lock:
+            for slot in self._slots:
+                if slot.ticket == ticket:
+                    slot.ticket = None
+                    slot.issued_at = 0.0
+        self._save_cache()
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """fn(ticket, *args, **kwargs), retried once with a fresh ticket on an auth failure."""
+        ticket = self.get()
+        try:
+            result = fn(ticket, *args, **kwargs)
+        except requests.HTTPError as e:
+            if e.response is None or not is_auth_failure(e.response.text):
+                raise
+            result = None
+        if result is not None and not result_is_auth_failure(result):
+            return result
+        logger.info("XDS rejected ticket; logging in again")
+        self.invalidate(ticket)
+        return fn(self.get(), *args, **kwargs)
+
+    # ---------------- internals ---------------- #
+
+    def _ticket_for(self, slot: _Slot) -> str:
+        with self._lock:
+            age = time.time() - slot.issued_at
+            valid = bool(slot.ticket) and age < self._ttl
+            if valid and age < self._ttl - self._margin:
+                return slot.ticket
+            if slot.refreshing is not None:
+                # Someone is already logging in: keep using a still-valid ticket, else wait
+                if valid:
+                    return slot.ticket
+                waiter = slot.refreshing
+            else:
+                slot.refreshing = threading.Event()
+                waiter = None
+
+        if waiter is not None:
+            waiter.wait(LOGIN_WAIT_TIMEOUT)
+            with self._lock:
+                if slot.ticket and time.time() - slot.issued_at < self._ttl:
+                    return slot.ticket
+            raise RuntimeError(f"XDS login for {slot.username} did not produce a ticket")
+
+        try:
+            ticket = self._login(slot.username, slot.password)
+            if not ticket:
+                raise RuntimeError(f"XDS login for {slot.username} returned no ticket")
+            with self._lock:
+                slot.ticket = ticket
+                slot.issued_at = time.time()
+            self._save_cache()
+            return ticket
+        finally:
+            with self._lock:
+                event, slot.refreshing = slot.refreshing, None
+            event.set()
+
+    def _load_cache(self) -> None:
+        if not self._cache_file or not os.path.exists(self._cache_file):
+            return
+        try:
+            with open(self._cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable ticket cache %s", self._cache_file)
+            return
+        for slot in self._slots:
+            entry = cached.get(slot.username) or {}
+            if entry.get("ticket"):
+                slot.ticket = entry["ticket"]
+                slot.issued_at = float(entry.get("issued_at", 0))
+
+    def _save_cache(self) -> None:
+        if not self._cache_file:
+            return
+        with self._lock:
+            data = {s.username: {"ticket": s.ticket, "issued_at": s.issued_at} for s in self._slots if s.ticket}
+        tmp = f"{self._cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self._cache_file)
+        except OSError:
+            logger.exception("Could not write ticket cache %s", self._cache_file)
+
+
+def parse_credentials(value: str | None, default_user: str, default_pass: str) -> list:
+    """Parse "user1:pass1,user2:pass2" (XDS_CREDENTIALS), falling back to the single default login."""
+    pairs = []
+    for item in (value or "").split(","):
+        user, sep, password = item.strip().partition(":")
+        if sep and user:
+            pairs.append((user, password))
+    return pairs or [(default_user, default_pass)]